@@ -0,0 +1,3 @@
+from webhook_service.asgi import app
+
+# Run with: uvicorn asgi:app --host 0.0.0.0 --port 5000 --workers 4
@@ -0,0 +1,38 @@
+"""add fair outbox queues
+
+Revision ID: 0a7e4c2d9b16
+Revises: f1c6d9a2b375
+Create Date: 2026-10-18 15:12:37.804519
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0a7e4c2d9b16'
+down_revision: Union[str, None] = 'f1c6d9a2b375'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('subscriptions', sa.Column('weight', sa.Integer(), server_default=sa.text('1'), nullable=False))
+    op.add_column('delivery_outbox', sa.Column('subscription_id', postgresql.UUID(as_uuid=True), nullable=True))
+    op.execute("""
+        UPDATE delivery_outbox o
+        SET subscription_id = t.subscription_id
+        FROM delivery_tasks t
+        WHERE t.id = o.delivery_task_id
+    """)
+    op.alter_column('delivery_outbox', 'subscription_id', nullable=False)
+    op.create_index('idx_delivery_outbox_subscription_id_id', 'delivery_outbox', ['subscription_id', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('idx_delivery_outbox_subscription_id_id', table_name='delivery_outbox')
+    op.drop_column('delivery_outbox', 'subscription_id')
+    op.drop_column('subscriptions', 'weight')
@@ -0,0 +1,30 @@
+"""add attempt timeouts
+
+Revision ID: 1b8e5d3f7a62
+Revises: 0a7e4c2d9b16
+Create Date: 2026-10-18 16:02:37.518204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '1b8e5d3f7a62'
+down_revision: Union[str, None] = '0a7e4c2d9b16'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('delivery_attempts', sa.Column('connect_timeout_ms', sa.Integer(), nullable=True))
+    op.add_column('delivery_attempts', sa.Column('read_timeout_ms', sa.Integer(), nullable=True))
+    op.add_column('delivery_attempts', sa.Column('latency_ms', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('delivery_attempts', 'latency_ms')
+    op.drop_column('delivery_attempts', 'read_timeout_ms')
+    op.drop_column('delivery_attempts', 'connect_timeout_ms')
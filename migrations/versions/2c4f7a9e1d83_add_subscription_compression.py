@@ -0,0 +1,28 @@
+"""add subscription compression
+
+Revision ID: 2c4f7a9e1d83
+Revises: 1b8e5d3f7a62
+Create Date: 2026-10-18 16:48:12.604517
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2c4f7a9e1d83'
+down_revision: Union[str, None] = '1b8e5d3f7a62'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('subscriptions', sa.Column('compression', sa.String(length=10), nullable=True))
+    op.add_column('subscriptions', sa.Column('compression_min_bytes', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('subscriptions', 'compression_min_bytes')
+    op.drop_column('subscriptions', 'compression')
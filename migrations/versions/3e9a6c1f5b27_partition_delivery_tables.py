@@ -0,0 +1,119 @@
+"""partition delivery tables
+
+Revision ID: 3e9a6c1f5b27
+Revises: 2c4f7a9e1d83
+Create Date: 2026-10-18 17:35:09.214786
+
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3e9a6c1f5b27'
+down_revision: Union[str, None] = '2c4f7a9e1d83'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+PREMAKE_DAYS = 7 # Later days are created by the create_partitions beat task
+
+# table -> (partition column, [(index name, definition)])
+PARTITIONED_TABLES = {
+    'delivery_tasks': ('created_at', [
+        ('idx_delivery_tasks_subscription_id', '(subscription_id)'),
+        ('idx_delivery_tasks_status', '(status)'),
+        ('idx_delivery_tasks_next_attempt_at', "(next_attempt_at) WHERE status = 'retrying'"),
+        ('ix_delivery_tasks_created_at', '(created_at)'),
+    ]),
+    'delivery_attempts': ('"timestamp"', [
+        ('idx_delivery_attempts_delivery_task_id', '(delivery_task_id)'),
+        ('idx_delivery_attempts_timestamp', '("timestamp")'),
+    ]),
+}
+
+# Foreign keys cannot point at a partitioned table without its partition column
+TASK_REFERENCES = ['delivery_attempts', 'delivery_outbox', 'delivery_payloads']
+
+
+def _day_start(day):
+    return datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+
+
+def upgrade() -> None:
+    # Idempotency keys move to their own table: a unique index on a partitioned table must include created_at
+    op.create_table('delivery_idempotency_keys',
+    sa.Column('subscription_id', postgresql.UUID(as_uuid=True), nullable=False),
+    sa.Column('idempotency_key', sa.String(length=255), nullable=False),
+    sa.Column('delivery_task_id', postgresql.UUID(as_uuid=True), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.ForeignKeyConstraint(['subscription_id'], ['subscriptions.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('subscription_id', 'idempotency_key')
+    )
+    op.execute("""
+        INSERT INTO delivery_idempotency_keys (subscription_id, idempotency_key, delivery_task_id, created_at)
+        SELECT subscription_id, idempotency_key, id, created_at FROM delivery_tasks WHERE idempotency_key IS NOT NULL
+    """)
+    op.create_index('idx_delivery_idempotency_keys_created_at', 'delivery_idempotency_keys', ['created_at'], unique=False)
+    op.drop_index('idx_delivery_tasks_idempotency_key', table_name='delivery_tasks', postgresql_where=sa.text('idempotency_key IS NOT NULL'))
+
+    for table in TASK_REFERENCES:
+        op.execute(f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {table}_delivery_task_id_fkey")
+
+    # The existing table becomes the first partition (up to tomorrow), so no rows are copied
+    tomorrow = datetime.now(timezone.utc).date() + timedelta(days=1)
+    for table, (column, indexes) in PARTITIONED_TABLES.items():
+        legacy = f"{table}_legacy"
+        op.execute(f"ALTER TABLE {table} RENAME TO {legacy}")
+        op.execute(f"ALTER TABLE {legacy} RENAME CONSTRAINT {table}_pkey TO {legacy}_pkey")
+        for name, _ in indexes:
+            op.execute(f"ALTER INDEX IF EXISTS {name} RENAME TO {name}_legacy")
+
+        op.execute(f"CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) PARTITION BY RANGE ({column})")
+        op.execute(f"ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY (id, {column})")
+        if table == 'delivery_tasks':
+            op.execute("""
+                ALTER TABLE delivery_tasks ADD CONSTRAINT delivery_tasks_subscription_id_fkey
+                FOREIGN KEY (subscription_id) REFERENCES subscriptions (id) ON DELETE CASCADE
+            """)
+        op.execute(f"ALTER TABLE {table} ATTACH PARTITION {legacy} FOR VALUES FROM (MINVALUE) TO ('{_day_start(tomorrow).isoformat()}')")
+        op.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+        for offset in range(PREMAKE_DAYS):
+            day = tomorrow + timedelta(days=offset)
+            op.execute(
+                f"CREATE TABLE {table}_p{day:%Y%m%d} PARTITION OF {table} "
+                f"FOR VALUES FROM ('{_day_start(day).isoformat()}') TO ('{_day_start(day + timedelta(days=1)).isoformat()}')"
+            )
+        # Matching indexes of the legacy partition are attached, not rebuilt
+        for name, definition in indexes:
+            op.execute(f"CREATE INDEX {name} ON {table} {definition}")
+
+
+def downgrade() -> None:
+    for table, (column, indexes) in PARTITIONED_TABLES.items():
+        op.execute(f"CREATE TABLE {table}_unpartitioned (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+        op.execute(f"INSERT INTO {table}_unpartitioned SELECT * FROM {table}")
+        op.execute(f"DROP TABLE {table}")
+        op.execute(f"ALTER TABLE {table}_unpartitioned RENAME TO {table}")
+        op.execute(f"ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY (id)")
+        for name, definition in indexes:
+            op.execute(f"CREATE INDEX {name} ON {table} {definition}")
+    op.execute("""
+        ALTER TABLE delivery_tasks ADD CONSTRAINT delivery_tasks_subscription_id_fkey
+        FOREIGN KEY (subscription_id) REFERENCES subscriptions (id) ON DELETE CASCADE
+    """)
+
+    for table in TASK_REFERENCES:
+        # Rows of tasks whose partition was dropped by retention have nothing to point at
+        op.execute(f"DELETE FROM {table} r WHERE NOT EXISTS (SELECT 1 FROM delivery_tasks t WHERE t.id = r.delivery_task_id)")
+        op.execute(f"""
+            ALTER TABLE {table} ADD CONSTRAINT {table}_delivery_task_id_fkey
+            FOREIGN KEY (delivery_task_id) REFERENCES delivery_tasks (id) ON DELETE CASCADE
+        """)
+
+    op.create_index('idx_delivery_tasks_idempotency_key', 'delivery_tasks', ['subscription_id', 'idempotency_key'], unique=True, postgresql_where=sa.text('idempotency_key IS NOT NULL'))
+    op.drop_index('idx_delivery_idempotency_keys_created_at', table_name='delivery_idempotency_keys')
+    op.drop_table('delivery_idempotency_keys')
@@ -0,0 +1,81 @@
+"""add listing indexes
+
+Revision ID: 4d7b2e9a8c15
+Revises: 3e9a6c1f5b27
+Create Date: 2026-10-18 18:12:44.930175
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4d7b2e9a8c15'
+down_revision: Union[str, None] = '3e9a6c1f5b27'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# name -> (per-partition index suffix, columns)
+TASK_INDEXES = {
+    'idx_delivery_tasks_subscription_created': ('subscription_created_idx', '(subscription_id, created_at DESC, id DESC)'),
+    'idx_delivery_tasks_status_created': ('status_created_idx', '(status, created_at DESC, id DESC)'),
+    'idx_delivery_tasks_subscription_status_created': ('subscription_status_created_idx', '(subscription_id, status, created_at DESC, id DESC)'),
+}
+# Prefixes of the indexes above
+LEGACY_TASK_INDEXES = {
+    'idx_delivery_tasks_subscription_id': ('subscription_id_idx', '(subscription_id)'),
+    'idx_delivery_tasks_status': ('status_idx', '(status)'),
+}
+
+
+def _partitions(connection):
+    return connection.execute(sa.text("""
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = 'delivery_tasks'
+        ORDER BY child.relname
+    """)).scalars().all()
+
+
+def _create_task_indexes(connection, indexes):
+    """
+    A partitioned index cannot be built CONCURRENTLY and a plain build blocks inserts
+    into delivery_tasks: build each partition's, then attach it to the parent's.
+    """
+    partitions = _partitions(connection)
+    for name, (suffix, columns) in indexes.items():
+        op.execute(f"CREATE INDEX IF NOT EXISTS {name} ON ONLY delivery_tasks {columns}")
+        for partition in partitions:
+            op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {partition}_{suffix} ON {partition} {columns}")
+            op.execute(f"ALTER INDEX {name} ATTACH PARTITION {partition}_{suffix}")
+
+
+def _drop_task_indexes(indexes):
+    # Dropping a partitioned index is a catalog change; it cannot be done CONCURRENTLY
+    for name in indexes:
+        op.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+def upgrade() -> None:
+    connection = op.get_bind()
+    with op.get_context().autocommit_block():
+        _create_task_indexes(connection, TASK_INDEXES)
+        _drop_task_indexes(LEGACY_TASK_INDEXES)
+
+        op.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_subscriptions_created_at_id ON subscriptions (created_at, id)")
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_subscriptions_created_at")
+
+
+def downgrade() -> None:
+    connection = op.get_bind()
+    with op.get_context().autocommit_block():
+        op.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_subscriptions_created_at ON subscriptions (created_at)")
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS idx_subscriptions_created_at_id")
+
+        _create_task_indexes(connection, LEGACY_TASK_INDEXES)
+        _drop_task_indexes(TASK_INDEXES)
@@ -0,0 +1,74 @@
+"""add attempt subscription_id
+
+Revision ID: 5a3c8e1d7f49
+Revises: 4d7b2e9a8c15
+Create Date: 2026-10-18 18:40:27.518342
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5a3c8e1d7f49'
+down_revision: Union[str, None] = '4d7b2e9a8c15'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BACKFILL_BATCH_SIZE = 5000
+INDEX_NAME = 'idx_delivery_attempts_subscription_timestamp'
+INDEX_COLUMNS = '(subscription_id, "timestamp" DESC, id DESC)'
+
+
+def _partitions(connection):
+    return connection.execute(sa.text("""
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = 'delivery_attempts'
+        ORDER BY child.relname
+    """)).scalars().all()
+
+
+def _backfill(connection, partition):
+    """Copies subscription_id from the tasks, one committed batch of attempts at a time in id order."""
+    after = '00000000-0000-0000-0000-000000000000'
+    while True:
+        ids = connection.execute(sa.text(
+            f"SELECT id FROM {partition} WHERE id > :after ORDER BY id LIMIT :batch_size"
+        ), {'after': after, 'batch_size': BACKFILL_BATCH_SIZE}).scalars().all()
+        if not ids:
+            return
+        connection.execute(sa.text(f"""
+            UPDATE {partition} a SET subscription_id = t.subscription_id
+            FROM delivery_tasks t
+            WHERE a.id = ANY(:ids) AND a.subscription_id IS NULL AND t.id = a.delivery_task_id
+        """), {'ids': ids})
+        after = ids[-1]
+
+
+def upgrade() -> None:
+    # Nullable without a default: adding the column does not rewrite the table
+    op.add_column('delivery_attempts', sa.Column('subscription_id', postgresql.UUID(as_uuid=True), nullable=True))
+
+    # Short autocommitted statements instead of one long transaction holding locks on every attempt row
+    connection = op.get_bind()
+    with op.get_context().autocommit_block():
+        partitions = _partitions(connection)
+        for partition in partitions:
+            _backfill(connection, partition)
+
+        # A partitioned index cannot be built CONCURRENTLY: build each partition's, then attach it to the parent's
+        op.execute(f"CREATE INDEX IF NOT EXISTS {INDEX_NAME} ON ONLY delivery_attempts {INDEX_COLUMNS}")
+        for partition in partitions:
+            op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {partition}_subscription_timestamp_idx ON {partition} {INDEX_COLUMNS}")
+            op.execute(f"ALTER INDEX {INDEX_NAME} ATTACH PARTITION {partition}_subscription_timestamp_idx")
+
+
+def downgrade() -> None:
+    op.drop_index(INDEX_NAME, table_name='delivery_attempts')
+    op.drop_column('delivery_attempts', 'subscription_id')
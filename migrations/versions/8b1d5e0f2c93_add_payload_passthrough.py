@@ -0,0 +1,38 @@
+"""add payload passthrough
+
+Revision ID: 8b1d5e0f2c93
+Revises: 3f9c2a7d1e44
+Create Date: 2026-10-18 10:03:17.214590
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8b1d5e0f2c93'
+down_revision: Union[str, None] = '3f9c2a7d1e44'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('subscriptions', sa.Column('passthrough', sa.Boolean(), server_default=sa.text('false'), nullable=False))
+    op.add_column('delivery_tasks', sa.Column('raw_body', sa.LargeBinary(), nullable=True))
+    op.add_column('delivery_tasks', sa.Column('content_type', sa.String(length=255), nullable=True))
+    op.alter_column('delivery_tasks', 'payload',
+               existing_type=postgresql.JSONB(astext_type=sa.Text()),
+               nullable=True)
+
+
+def downgrade() -> None:
+    op.execute("DELETE FROM delivery_tasks WHERE payload IS NULL")
+    op.alter_column('delivery_tasks', 'payload',
+               existing_type=postgresql.JSONB(astext_type=sa.Text()),
+               nullable=False)
+    op.drop_column('delivery_tasks', 'content_type')
+    op.drop_column('delivery_tasks', 'raw_body')
+    op.drop_column('subscriptions', 'passthrough')
@@ -0,0 +1,28 @@
+"""add idempotency key
+
+Revision ID: c47e9a1b6d20
+Revises: 8b1d5e0f2c93
+Create Date: 2026-10-18 10:41:52.903377
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c47e9a1b6d20'
+down_revision: Union[str, None] = '8b1d5e0f2c93'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('delivery_tasks', sa.Column('idempotency_key', sa.String(length=255), nullable=True))
+    op.create_index('idx_delivery_tasks_idempotency_key', 'delivery_tasks', ['subscription_id', 'idempotency_key'], unique=True, postgresql_where=sa.text('idempotency_key IS NOT NULL'))
+
+
+def downgrade() -> None:
+    op.drop_index('idx_delivery_tasks_idempotency_key', table_name='delivery_tasks', postgresql_where=sa.text('idempotency_key IS NOT NULL'))
+    op.drop_column('delivery_tasks', 'idempotency_key')
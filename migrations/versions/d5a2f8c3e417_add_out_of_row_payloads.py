@@ -0,0 +1,39 @@
+"""add out of row payloads
+
+Revision ID: d5a2f8c3e417
+Revises: c47e9a1b6d20
+Create Date: 2026-10-18 11:20:06.448213
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd5a2f8c3e417'
+down_revision: Union[str, None] = 'c47e9a1b6d20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('delivery_tasks', sa.Column('payload_storage', sa.String(length=16), nullable=True))
+    op.add_column('delivery_tasks', sa.Column('payload_encoding', sa.String(length=16), nullable=True))
+    op.add_column('delivery_tasks', sa.Column('payload_size', sa.Integer(), nullable=True))
+    op.create_table('delivery_payloads',
+    sa.Column('delivery_task_id', sa.UUID(), nullable=False),
+    sa.Column('data', sa.LargeBinary(), nullable=False),
+    sa.ForeignKeyConstraint(['delivery_task_id'], ['delivery_tasks.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('delivery_task_id')
+    )
+    # Already compressed; keep Postgres from trying to compress it again in TOAST
+    op.execute("ALTER TABLE delivery_payloads ALTER COLUMN data SET STORAGE EXTERNAL")
+
+
+def downgrade() -> None:
+    op.drop_table('delivery_payloads')
+    op.drop_column('delivery_tasks', 'payload_size')
+    op.drop_column('delivery_tasks', 'payload_encoding')
+    op.drop_column('delivery_tasks', 'payload_storage')
@@ -0,0 +1,28 @@
+"""add subscription batching
+
+Revision ID: e93b7c1a4f58
+Revises: d5a2f8c3e417
+Create Date: 2026-10-18 13:41:08.552107
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e93b7c1a4f58'
+down_revision: Union[str, None] = 'd5a2f8c3e417'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('subscriptions', sa.Column('batch_max_size', sa.Integer(), nullable=True))
+    op.add_column('subscriptions', sa.Column('batch_linger_ms', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('subscriptions', 'batch_linger_ms')
+    op.drop_column('subscriptions', 'batch_max_size')
@@ -0,0 +1,28 @@
+"""add subscription rate limits
+
+Revision ID: f1c6d9a2b375
+Revises: e93b7c1a4f58
+Create Date: 2026-10-18 14:26:51.390842
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f1c6d9a2b375'
+down_revision: Union[str, None] = 'e93b7c1a4f58'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('subscriptions', sa.Column('rate_limit_per_second', sa.Float(), nullable=True))
+    op.add_column('subscriptions', sa.Column('rate_limit_burst', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('subscriptions', 'rate_limit_burst')
+    op.drop_column('subscriptions', 'rate_limit_per_second')
@@ -0,0 +1,94 @@
+import uuid
+from collections import Counter
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from webhook_service import outbox
+from webhook_service.models import OutboxMessage
+
+SUB_A, SUB_B, SUB_C = sorted(uuid.uuid4() for _ in range(3))
+
+
+@pytest.fixture
+def relay_env(monkeypatch):
+    """An outbox table in SQLite, with publishing and subscription lookups captured."""
+    engine = create_engine('sqlite://')
+    OutboxMessage.__table__.create(engine)
+    session = scoped_session(sessionmaker(bind=engine))
+    monkeypatch.setattr(outbox, 'db_session', session)
+    # SQLite has no loose index scan; the relay only needs the active subscriptions
+    monkeypatch.setattr(outbox, 'ACTIVE_SUBSCRIPTIONS_SQL', select(OutboxMessage.subscription_id).distinct())
+    weights = {}
+    monkeypatch.setattr(outbox, 'get_subscriptions_details',
+                        lambda sub_ids, session: {sub_id: {'weight': weights.get(sub_id, 1)} for sub_id in sub_ids})
+    published = []
+    monkeypatch.setattr(outbox, 'publish_deliveries', lambda task_ids: published.append(list(task_ids)))
+    tasks = {}
+
+    def enqueue(sub_id, count):
+        with engine.begin() as connection:
+            for _ in range(count):
+                next_id = len(tasks) + 1
+                tasks[next_id] = (uuid.uuid4(), sub_id)
+                connection.execute(insert(OutboxMessage).values(id=next_id, delivery_task_id=tasks[next_id][0],
+                                                                subscription_id=sub_id))
+
+    def subscriptions_of(batch):
+        owners = {task_id: sub_id for task_id, sub_id in tasks.values()}
+        return [owners[task_id] for task_id in batch]
+
+    def remaining():
+        with engine.connect() as connection:
+            return connection.execute(select(OutboxMessage.id)).scalars().all()
+
+    return SimpleNamespace(enqueue=enqueue, weights=weights, published=published, subscriptions_of=subscriptions_of,
+                           remaining=remaining, tasks=tasks)
+
+
+def test_burst_does_not_starve_other_subscriptions(relay_env):
+    relay_env.enqueue(SUB_A, 100) # Queued first, so FIFO would publish only A
+    relay_env.enqueue(SUB_B, 5)
+    relay_env.enqueue(SUB_C, 5)
+
+    assert outbox.FairRelay(quantum=2).relay_batch(budget=6) == 6
+    assert Counter(relay_env.subscriptions_of(relay_env.published[0])) == {SUB_A: 2, SUB_B: 2, SUB_C: 2}
+
+
+def test_shares_follow_weights(relay_env):
+    relay_env.enqueue(SUB_A, 50)
+    relay_env.enqueue(SUB_B, 50)
+    relay_env.enqueue(SUB_C, 50)
+    relay_env.weights[SUB_C] = 2
+
+    relay = outbox.FairRelay(quantum=2)
+    relay.relay_batch(budget=8)
+    relay.relay_batch(budget=8)
+
+    assert Counter(relay_env.subscriptions_of(relay_env.published[0] + relay_env.published[1])) == {SUB_A: 4, SUB_B: 4, SUB_C: 8}
+
+
+def test_every_row_is_published_once_in_order_per_subscription(relay_env):
+    relay_env.enqueue(SUB_A, 13)
+    relay_env.enqueue(SUB_B, 3)
+    relay_env.enqueue(SUB_C, 7)
+    relay_env.weights[SUB_A] = 3
+
+    relay = outbox.FairRelay(quantum=1)
+    while relay.relay_batch(budget=5):
+        pass
+
+    everything = [task_id for batch in relay_env.published for task_id in batch]
+    assert len(everything) == len(set(everything)) == 23
+    assert relay_env.remaining() == []
+    # FIFO within each subscription
+    for sub_id in (SUB_A, SUB_B, SUB_C):
+        queued = [task_id for task_id, owner in relay_env.tasks.values() if owner == sub_id]
+        assert [task_id for task_id in everything if task_id in queued] == queued
+
+
+def test_empty_outbox(relay_env):
+    assert outbox.FairRelay().relay_batch(budget=10) == 0
+    assert relay_env.published == []
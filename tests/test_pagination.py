@@ -0,0 +1,94 @@
+import uuid
+from datetime import datetime, timezone, timedelta
+
+import pytest
+from flask import Flask
+from sqlalchemy import create_engine
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from webhook_service import create_app
+from webhook_service.api import pagination, subscriptions
+from webhook_service.api.pagination import InvalidCursor, encode_cursor, decode_cursor, keyset
+from webhook_service.database import db_session
+from webhook_service.models import DeliveryAttempt, Subscription
+
+app = Flask(__name__)
+
+
+def test_cursor_round_trip():
+    timestamp = datetime(2026, 10, 18, 12, 30, 45, 123456, tzinfo=timezone.utc)
+    row_id = uuid.uuid4()
+    token = encode_cursor(timestamp, row_id)
+
+    assert decode_cursor(token) == (timestamp, row_id)
+    # Safe to put in a query string as is
+    assert '=' not in token and '+' not in token and '/' not in token
+
+
+def test_cursor_keeps_the_utc_offset():
+    timestamp = datetime(2026, 1, 2, 3, 4, 5, tzinfo=timezone(timedelta(hours=5, minutes=30)))
+    decoded, _ = decode_cursor(encode_cursor(timestamp, uuid.uuid4()))
+    assert decoded == timestamp and decoded.utcoffset() == timestamp.utcoffset()
+
+
+@pytest.mark.parametrize('token', ['', 'not-a-cursor', encode_cursor(datetime.now(timezone.utc), uuid.uuid4())[:-3],
+                                   'WyJub3QgYSBkYXRlIiwgIngiXQ'])
+def test_malformed_cursor_is_rejected(token):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(token)
+
+
+def compile_query(query):
+    return str(query.statement.compile(dialect=postgresql.dialect()))
+
+
+def test_keyset_continues_after_the_cursor_row():
+    token = encode_cursor(datetime.now(timezone.utc), uuid.uuid4())
+    with app.test_request_context(f'/?cursor={token}'):
+        query = keyset(db_session.query(DeliveryAttempt), DeliveryAttempt.timestamp, DeliveryAttempt.id, descending=True)
+        sql = compile_query(query)
+    assert '(delivery_attempts.timestamp, delivery_attempts.id) < (' in sql
+    assert 'ORDER BY delivery_attempts.timestamp DESC, delivery_attempts.id DESC' in sql
+
+
+def test_keyset_first_page_has_no_bound():
+    with app.test_request_context('/'):
+        sql = compile_query(keyset(db_session.query(DeliveryAttempt), DeliveryAttempt.timestamp, DeliveryAttempt.id))
+    assert 'WHERE' not in sql
+    assert 'ORDER BY delivery_attempts.timestamp, delivery_attempts.id' in sql
+
+
+@pytest.fixture
+def subscriptions_env(monkeypatch):
+    """Five subscriptions in SQLite, served to GET /subscriptions as if by the read replica."""
+    engine = create_engine('sqlite://')
+    Subscription.__table__.create(engine)
+    session = scoped_session(sessionmaker(bind=engine))
+    monkeypatch.setattr(subscriptions, 'db_read_session', session)
+    monkeypatch.setattr(pagination, 'read_engine', lambda: engine)
+    # Smaller than the listing, so a default page or a single stream batch would cut it short
+    monkeypatch.setattr(pagination.Config, 'LIST_PAGE_SIZE', 2)
+    monkeypatch.setattr(pagination.Config, 'LIST_STREAM_BATCH_SIZE', 2)
+    started = datetime(2026, 10, 18, 12, 0, 0)
+    session.add_all([Subscription(id=uuid.uuid4(), target_url=f'https://example.com/{n}', created_at=started + timedelta(seconds=n))
+                     for n in range(5)])
+    session.commit()
+    session.remove()
+    return create_app().test_client()
+
+
+def test_subscriptions_are_listed_whole_without_limit_or_cursor(subscriptions_env):
+    response = subscriptions_env.get('/api/v1/subscriptions')
+    assert response.status_code == 200
+    assert 'X-Next-Cursor' not in response.headers
+    assert [s['target_url'] for s in response.get_json()] == [f'https://example.com/{n}' for n in range(5)]
+
+
+def test_subscriptions_page_with_limit_and_cursor(subscriptions_env):
+    first = subscriptions_env.get('/api/v1/subscriptions?limit=3')
+    assert [s['target_url'] for s in first.get_json()] == [f'https://example.com/{n}' for n in range(3)]
+
+    rest = subscriptions_env.get(f"/api/v1/subscriptions?cursor={first.headers['X-Next-Cursor']}")
+    assert [s['target_url'] for s in rest.get_json()] == [f'https://example.com/{n}' for n in range(3, 5)]
+    assert 'X-Next-Cursor' not in rest.headers
@@ -0,0 +1,63 @@
+import uuid
+
+import fakeredis
+import pytest
+
+from webhook_service import rate_limit
+
+TARGET_URL = "https://receiver.example.com/hooks"
+
+
+@pytest.fixture
+def redis_server(monkeypatch):
+    server = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(rate_limit, '_take_token_script', server.register_script(rate_limit.TAKE_TOKEN_SCRIPT))
+    monkeypatch.setattr(rate_limit.Config, 'HOST_RATE_LIMIT_PER_SECOND', 0)
+    return server
+
+
+def take(subscription, task_id):
+    return rate_limit.take_token('sub-1', subscription, TARGET_URL, task_id)
+
+
+def test_burst_goes_out_without_waiting(redis_server):
+    subscription = {'rate_limit_per_second': 10, 'rate_limit_burst': 3}
+    assert [take(subscription, uuid.uuid4()) for _ in range(3)] == [None, None, None]
+
+
+def test_refused_callers_reserve_distinct_increasing_slots(redis_server):
+    subscription = {'rate_limit_per_second': 10, 'rate_limit_burst': 1}
+    assert take(subscription, uuid.uuid4()) is None
+
+    waits = [take(subscription, uuid.uuid4()) for _ in range(5)]
+
+    assert all(wait is not None for wait in waits)
+    assert waits == sorted(waits) and len(set(waits)) == len(waits)
+    # The k-th refused caller waits for the k-th token after the burst, 1/rate apart
+    for k, wait in enumerate(waits, start=1):
+        assert wait == pytest.approx(k * 0.1, abs=0.02)
+
+
+def test_deferred_task_goes_out_on_its_reservation(redis_server):
+    subscription = {'rate_limit_per_second': 10, 'rate_limit_burst': 1}
+    deferred = uuid.uuid4()
+    assert take(subscription, uuid.uuid4()) is None
+    first_wait = take(subscription, deferred)
+    assert first_wait is not None
+
+    # Back at its release time the task does not take (or wait for) another token
+    assert take(subscription, deferred) is None
+    # The reservation is used up once, and later callers still queue behind it
+    assert take(subscription, uuid.uuid4()) > first_wait
+
+
+def test_host_bucket_is_reserved_too(redis_server, monkeypatch):
+    monkeypatch.setattr(rate_limit.Config, 'HOST_RATE_LIMIT_PER_SECOND', 5)
+    monkeypatch.setattr(rate_limit.Config, 'HOST_RATE_LIMIT_BURST', 1)
+    assert rate_limit.take_token('sub-1', {}, TARGET_URL, uuid.uuid4()) is None
+    waits = [rate_limit.take_token(f'sub-{i}', {}, TARGET_URL, uuid.uuid4()) for i in range(3)]
+    assert waits == pytest.approx([0.2, 0.4, 0.6], abs=0.02)
+
+
+def test_no_limits_configured(redis_server):
+    assert take({}, uuid.uuid4()) is None
@@ -0,0 +1,138 @@
+import json
+import uuid
+from datetime import datetime, timezone, timedelta
+
+import fakeredis
+import pytest
+
+from webhook_service import create_app
+from webhook_service.api import status
+from webhook_service.api.schemas import delivery_attempt_schema
+from webhook_service.models import DeliveryTask, DeliveryAttempt
+
+
+class FakeReadSession:
+    """Stands in for db_read_session: answers the status query with one (task, attempts) row and counts queries."""
+
+    def __init__(self):
+        self.row = None
+        self.queries = 0
+
+    def query(self, *entities):
+        self.queries += 1
+        return self
+
+    def filter(self, *criteria):
+        return self
+
+    def first(self):
+        return self.row
+
+    def remove(self):
+        pass
+
+
+@pytest.fixture
+def env(monkeypatch):
+    redis_server = fakeredis.FakeRedis(decode_responses=True)
+    session = FakeReadSession()
+    monkeypatch.setattr(status, 'redis_client', redis_server)
+    monkeypatch.setattr(status, 'db_read_session', session)
+    client = create_app().test_client()
+    return client, session, redis_server
+
+
+def as_attempts_json(attempt):
+    """An attempt as the attempts_json() subquery returns it: timestamps through to_char(), the rest as JSON values."""
+    row = json.loads(json.dumps(delivery_attempt_schema.dump(attempt)))
+    row['timestamp'] = attempt.timestamp.isoformat(timespec='microseconds') # YYYY-MM-DD"T"HH24:MI:SS.USTZH:TZM
+    return row
+
+
+def make_attempts(task, outcomes, tz=timezone.utc):
+    started = datetime(2026, 10, 18, 12, 0, 0, tzinfo=tz)
+    return [DeliveryAttempt(id=uuid.uuid4(), delivery_task_id=task.id, subscription_id=task.subscription_id,
+                            attempt_number=n, outcome=outcome, http_status=500 if outcome == 'failed_attempt' else 200,
+                            # Whole seconds, and 0.5s past them: Python and Postgres print fractions differently
+                            timestamp=started + timedelta(seconds=n, microseconds=500000 * (n % 2)), latency_ms=120)
+            for n, outcome in enumerate(outcomes, start=1)]
+
+
+def make_row(task_status, outcomes):
+    task = DeliveryTask(id=uuid.uuid4(), subscription_id=uuid.uuid4(), payload={'event': 'order.created'},
+                        status=task_status, attempts_count=len(outcomes),
+                        created_at=datetime(2026, 10, 18, tzinfo=timezone.utc))
+    return task, [as_attempts_json(attempt) for attempt in make_attempts(task, outcomes)]
+
+
+def status_url(task):
+    return f'/api/v1/status/delivery_tasks/{task.id}'
+
+
+def test_status_and_attempts_come_from_one_query(env):
+    client, session, _ = env
+    session.row = make_row('retrying', ['failed_attempt'])
+
+    response = client.get(status_url(session.row[0]))
+
+    assert response.status_code == 200
+    assert session.queries == 1
+    assert response.get_json()['status'] == 'retrying'
+    assert [attempt['outcome'] for attempt in response.get_json()['attempts']] == ['failed_attempt']
+
+
+@pytest.mark.parametrize('tz', [timezone.utc, timezone(timedelta(hours=-5))])
+def test_attempts_are_dumped_like_the_rest_of_the_api(env, tz):
+    client, session, _ = env
+    task, _ = make_row('retrying', [])
+    attempts = make_attempts(task, ['failed_attempt', 'failed_attempt'], tz)
+    session.row = task, [as_attempts_json(attempt) for attempt in attempts]
+
+    body = client.get(status_url(task)).get_json()
+
+    assert body['attempts'] == delivery_attempt_schema.dump(attempts, many=True)
+    assert [attempt['timestamp'] for attempt in body['attempts']] == [attempt.timestamp.isoformat() for attempt in attempts]
+
+
+def test_etag_answers_304_when_unchanged(env):
+    client, session, _ = env
+    session.row = make_row('processing', [])
+    first = client.get(status_url(session.row[0]))
+    assert first.headers['ETag']
+
+    again = client.get(status_url(session.row[0]), headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304 and again.data == b''
+
+    session.row[0].status = 'succeeded'
+    changed = client.get(status_url(session.row[0]), headers={'If-None-Match': first.headers['ETag']})
+    assert changed.status_code == 200 and changed.headers['ETag'] != first.headers['ETag']
+
+
+def test_finished_task_is_served_from_redis(env):
+    client, session, redis_server = env
+    task, _ = session.row = make_row('succeeded', ['failed_attempt', 'success'])
+    first = client.get(status_url(task))
+    assert redis_server.get(f'{status.TASK_STATUS_KEY_PREFIX}{task.id}') == first.get_data(as_text=True)
+
+    session.row = None # A database read would now answer 404
+    cached = client.get(status_url(task))
+    assert cached.status_code == 200
+    assert cached.data == first.data and cached.headers['ETag'] == first.headers['ETag']
+    assert session.queries == 1
+
+
+@pytest.mark.parametrize('task_status, outcomes', [
+    ('retrying', ['failed_attempt']),
+    # The final attempt row is written behind the status update and is not visible yet
+    ('failed', ['failed_attempt']),
+])
+def test_unfinished_status_is_not_cached(env, task_status, outcomes):
+    client, session, redis_server = env
+    task, _ = session.row = make_row(task_status, outcomes)
+    client.get(status_url(task))
+    assert redis_server.get(f'{status.TASK_STATUS_KEY_PREFIX}{task.id}') is None
+
+
+def test_unknown_task(env):
+    client, _, _ = env
+    assert client.get(f'/api/v1/status/delivery_tasks/{uuid.uuid4()}').status_code == 404
@@ -1,130 +1,128 @@
-from flask import request, jsonify, g
+from flask import request, jsonify, g, Response, stream_with_context
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
 from . import api_bp
 from ..database import db_session
-from ..models import Subscription, DeliveryTask
-from ..celery_app import celery_app
-from ..cache import redis_client
+from ..models import Subscription, DeliveryTask, new_delivery_task_row
+from ..cache import get_subscription_details, get_subscriptions_details
 from ..config import Config
 import uuid
 import json
-import hmac
-import hashlib
 import time
-from ..tasks import process_delivery
+from ..outbox import add_to_outbox
+from ..validation import verify_signature, check_event_type
+from ..write_buffer import group_commit_buffer, GroupCommitWithdrawn, GroupCommitTimeout
+from ..payloads import offload_large_payload, add_payload_blobs, discard_offloaded_payload
+from ..idempotency import (extract_idempotency_key, claim_idempotency_key, claim_idempotency_keys,
+                           remember_idempotency_key, release_idempotency_key, find_existing_task_ids,
+                           add_idempotency_keys, add_new_idempotency_keys)
+
 
 @api_bp.route('/ingest/<uuid:sub_id>', methods=['POST'])
 def ingest_webhook(sub_id):
     """Ingests a webhook payload and queues it for delivery."""
-    if not request.json:
-        return jsonify({"message": "Request body must be JSON"}), 415
-
-    payload = request.json
     session = None
 
     try:
-        cache_key = f"subscription:{sub_id}"
-        sub_details = redis_client.get(cache_key)
-        subscription = None
-        if sub_details:
-            try:
-                subscription = json.loads(sub_details) # type: ignore[reportGeneralTypeIssues]
-                print(f"Webhook {sub_id}: Fetched subscription {sub_id} from cache.")
-            except json.JSONDecodeError:
-                print(f"Webhook {sub_id}: Cache decode error for {sub_id}, fetching from DB.")
-                # Delete bad cache entry
-                redis_client.delete(cache_key)
-                sub_details = None
-
+        # --- 1. Subscription lookup (local cache, then Redis, then DB) ---
+        subscription = get_subscription_details(sub_id, db_session)
+        db_session.remove()
         if not subscription:
-            db_subscription = db_session.query(Subscription).filter_by(id=sub_id).first()
-            if not db_subscription:
-                 db_session.remove()
-                 return jsonify({"message": "Subscription not found"}), 404
-
-            # Cache the subscription details from DB
-            subscription = {
-                'target_url': db_subscription.target_url,
-                'secret': db_subscription.secret,
-                'event_type_filter': db_subscription.event_type_filter
-            }
-            redis_client.setex(cache_key, Config.CACHE_EXPIRY_SECONDS, json.dumps(subscription))
-            db_session.remove()
-            print(f"Webhook {sub_id}: Fetched subscription {sub_id} from DB and cached.")
+            return jsonify({"message": "Subscription not found"}), 404
+
+        body = request.get_data() # Raw bytes, as signed by the producer
+        payload = None
+        if subscription.get('passthrough'):
+            # Stored and forwarded verbatim, never decoded
+            task_row = new_delivery_task_row(sub_id, raw_body=body, content_type=request.content_type)
+        else:
+            payload = request.get_json(silent=True)
+            if not payload:
+                return jsonify({"message": "Request body must be JSON"}), 415
+            task_row = new_delivery_task_row(sub_id, payload=payload)
 
 
         # --- 2. Bonus: Signature Verification ---
         secret = subscription.get('secret')
         if secret: # type: ignore[reportGeneralTypeIssues] # <-- Added ignore
-            signature_header = request.headers.get(Config.WEBHOOK_SECRET_HEADER)
-            if not signature_header:
-                print(f"Webhook {sub_id}: Signature header missing.")
-                return jsonify({"message": "Signature header missing"}), 401
-
-            try:
-                hash_method, signature = signature_header.split('=', 1)
-            except ValueError:
-                 print(f"Webhook {sub_id}: Invalid signature header format.")
-                 return jsonify({"message": "Invalid signature header format"}), 400
-
-            if hash_method != 'sha256':
-                 print(f"Webhook {sub_id}: Unsupported signature hash method: {hash_method}")
-                 return jsonify({"message": "Unsupported signature hash method"}), 400
-            expected_signature = hmac.new(
-                secret.encode('utf-8'),
-                request.data,
-                hashlib.sha256
-            ).hexdigest()
-
-            # Secure comparison to prevent timing attacks
-            if not hmac.compare_digest(expected_signature, signature):
-                 print(f"Webhook {sub_id}: Invalid signature.")
-                 return jsonify({"message": "Invalid signature"}), 401
+            signature_error = verify_signature(secret, body, request.headers.get(Config.WEBHOOK_SECRET_HEADER))
+            if signature_error:
+                message, status_code = signature_error
+                print(f"Webhook {sub_id}: Signature check failed: {message}.")
+                return jsonify({"message": message}), status_code
 
             print(f"Webhook {sub_id}: Signature verified successfully.")
 
 
         # --- 3. Bonus: Event Type Filtering ---
-        event_type_filter = subscription.get('event_type_filter')
         event_type = request.headers.get(Config.WEBHOOK_EVENT_TYPE_HEADER)
-        if event_type_filter and event_type: # type: ignore[reportGeneralTypeIssues] # <-- Added ignore
-             if event_type_filter != event_type: # type: ignore[reportGeneralTypeIssues] # <-- Added ignore
-                 print(f"Webhook {sub_id}: Event type '{event_type}' filtered by '{event_type_filter}'. Skipping delivery.")
-                 # Log the filtered event if desired
-                 return jsonify({"message": f"Event type '{event_type}' filtered, delivery skipped"}), 202 # Accepted, but not queued
-
-             print(f"Webhook {sub_id}: Event type '{event_type}' matches filter '{event_type_filter}'. Proceeding to queue.")
-        elif event_type_filter and not event_type: # type: ignore[reportGeneralTypeIssues] # <-- Added ignore
-            print(f"Webhook {sub_id}: Event type filter '{event_type_filter}' exists, but no '{Config.WEBHOOK_EVENT_TYPE_HEADER}' header provided. Skipping delivery.")
-            return jsonify({"message": f"Subscription has event type filter, but no '{Config.WEBHOOK_EVENT_TYPE_HEADER}' header provided. Delivery skipped"}), 202
-
-
-        # --- 4. Create Delivery Task in DB ---
-        # Get a new DB session specifically for creating the task
-        # This session is needed to commit the new task before sending to queue
-        session = db_session()
+        skipped_message = check_event_type(subscription.get('event_type_filter'), event_type)
+        if skipped_message:
+            print(f"Webhook {sub_id}: {skipped_message}")
+            return jsonify({"message": skipped_message}), 202 # Accepted, but not queued
 
-        new_task = DeliveryTask(
-            id=uuid.uuid4(),
-            subscription_id=sub_id,
-            payload=payload,
-            status='pending',
-            attempts_count=0
-        )
 
-        session.add(new_task)
-        session.commit()
-        task_id = new_task.id
+        # --- 4. Idempotency: a retried request gets its original task back, without a write ---
+        task_id = task_row['id']
+        idempotency_key = extract_idempotency_key(request.headers, payload)
+        if idempotency_key:
+            task_row['idempotency_key'] = idempotency_key
+            original_task_id = claim_idempotency_key(sub_id, idempotency_key, task_id)
+            if original_task_id:
+                print(f"Webhook {sub_id}: Duplicate idempotency key '{idempotency_key}', returning task {original_task_id}.")
+                return jsonify({"message": "Duplicate webhook, already queued", "task_id": original_task_id}), 202
 
-        print(f"Webhook {sub_id}: Delivery task {task_id} created.")
+        # --- 5. Create Delivery Task and its outbox row in one transaction ---
+        # The outbox relay publishes it to the Celery queue, so ingestion never waits on the broker
+        try:
+            payload_blob = offload_large_payload(task_row, body) # Large bodies are compressed and kept out of row
+            committed = False
+            if Config.INGEST_GROUP_COMMIT_ENABLED:
+                try:
+                    # Coalesced with concurrent ingests of this process; returns once our row is committed
+                    group_commit_buffer.submit(task_row, payload_blob, timeout=Config.INGEST_GROUP_COMMIT_TIMEOUT_MS / 1000.0)
+                    committed = True
+                except GroupCommitWithdrawn as e:
+                    print(f"Webhook {sub_id}: {e} Writing the task directly.")
+            if not committed:
+                session = db_session()
 
+                new_task = DeliveryTask(**task_row)
 
-        # --- 5. Send Task to Celery Queue ---
-        # Use delay() as a shortcut for apply_async() with args
-        # Ignore Pyright's confusion about the .delay() method
-        process_delivery.delay(str(task_id)) # type: ignore[reportGeneralTypeIssues] # <-- Added ignore
+                session.add(new_task)
+                session.flush()
+                add_idempotency_keys(session, [task_row])
+                add_payload_blobs(session, [payload_blob])
+                add_to_outbox(session, [(new_task.id, new_task.subscription_id)])
+                session.commit()
+        except IntegrityError:
+            # The idempotency key table caught a duplicate whose Redis claim had already expired
+            if session and session.is_active:
+                session.rollback()
+            discard_offloaded_payload(task_row)
+            original_task_id = None
+            if idempotency_key:
+                original_task_id = find_existing_task_ids(db_session, [(sub_id, idempotency_key)]).get((str(sub_id), idempotency_key))
+                db_session.remove()
+            if not original_task_id:
+                # Another constraint (e.g. the subscription was deleted): the claimed key has no task behind it
+                if idempotency_key:
+                    release_idempotency_key(sub_id, idempotency_key, task_id)
+                raise
+            remember_idempotency_key(sub_id, idempotency_key, original_task_id)
+            print(f"Webhook {sub_id}: Duplicate idempotency key '{idempotency_key}', returning task {original_task_id}.")
+            return jsonify({"message": "Duplicate webhook, already queued", "task_id": original_task_id}), 202
+        except GroupCommitTimeout as e:
+            # The row may still commit, so the idempotency claim stays: a retry with the key gets this task
+            print(f"Webhook {sub_id}: {e}")
+            return jsonify({"message": "Ingestion is temporarily unavailable, retry later", "task_id": task_id}), 503
+        except Exception:
+            discard_offloaded_payload(task_row)
+            if idempotency_key:
+                release_idempotency_key(sub_id, idempotency_key, task_id)
+            raise
 
-
-        print(f"Webhook {sub_id}: Task {task_id} queued.")
+        print(f"Webhook {sub_id}: Delivery task {task_id} created and queued.")
 
         # --- 6. Return 202 Accepted ---
         # Include the task ID in the response for status tracking
@@ -138,3 +136,207 @@ def ingest_webhook(sub_id):
     finally:
         if session:
              db_session.remove()
+
+
+def ingest_batch_items(items, start_index=0):
+    """
+    Validates a chunk of batch items and queues the accepted ones.
+    Each item is {"subscription_id", "payload" or "body", "event_type"?, "signature"?, "idempotency_key"?}.
+    "body" is the payload as the JSON text the producer signed; the signature is checked
+    against exactly those bytes, so items of subscriptions with a secret must use it.
+    Idempotency keys are claimed with one Redis pipeline; all new items and their outbox
+    rows are written with one multi-row INSERT each, in a single transaction.
+    Returns one result dict per item, in input order.
+    """
+    results = [None] * len(items)
+    parsed = []
+
+    # --- 1. Shape validation ---
+    for i, item in enumerate(items):
+        index = start_index + i
+        if not isinstance(item, dict) or not ('payload' in item or isinstance(item.get('body'), str)):
+            results[i] = {"index": index, "status": 400, "message": "Item must be an object with a 'payload' or a 'body' string"}
+            continue
+        try:
+            sub_id = uuid.UUID(str(item.get('subscription_id')))
+        except ValueError:
+            results[i] = {"index": index, "status": 400, "message": "Invalid subscription_id"}
+            continue
+        body = None
+        payload = item.get('payload')
+        if isinstance(item.get('body'), str):
+            body = item['body'].encode('utf-8') # The bytes the producer signed
+            try:
+                payload = json.loads(body)
+            except json.JSONDecodeError:
+                results[i] = {"index": index, "status": 400, "message": "Item 'body' must be a JSON document"}
+                continue
+        parsed.append((i, sub_id, item, body, payload))
+
+    # --- 2. One subscription lookup per distinct subscription ---
+    try:
+        subscriptions = get_subscriptions_details({sub_id for _, sub_id, _, _, _ in parsed}, db_session)
+    finally:
+        db_session.remove()
+
+    # --- 3. Per-item signature verification and event type filtering ---
+    accepted = [] # (position in items, task row)
+    payload_blobs = {} # task id -> delivery_payloads row, for bodies stored out of row
+    for i, sub_id, item, body, payload in parsed:
+        index = start_index + i
+        subscription = subscriptions.get(sub_id)
+        if not subscription:
+            results[i] = {"index": index, "status": 404, "message": "Subscription not found"}
+            continue
+
+        secret = subscription.get('secret')
+        if secret:
+            if body is None:
+                # A re-serialized payload is not what the producer signed
+                results[i] = {"index": index, "status": 400, "message": "Items of a subscription with a secret must send the signed 'body'"}
+                continue
+            signature_error = verify_signature(secret, body, item.get('signature'))
+            if signature_error:
+                message, status_code = signature_error
+                results[i] = {"index": index, "status": status_code, "message": message}
+                continue
+
+        skipped_message = check_event_type(subscription.get('event_type_filter'), item.get('event_type'))
+        if skipped_message:
+            results[i] = {"index": index, "status": 202, "message": skipped_message}
+            continue
+
+        if body is None:
+            body = json.dumps(payload).encode('utf-8')
+        idempotency_key = extract_idempotency_key({Config.IDEMPOTENCY_KEY_HEADER: item.get('idempotency_key')}, payload)
+        if subscription.get('passthrough'):
+            # Forward exactly the bytes the item signature covers
+            row = new_delivery_task_row(sub_id, raw_body=body, content_type='application/json', idempotency_key=idempotency_key)
+        else:
+            row = new_delivery_task_row(sub_id, payload=payload, idempotency_key=idempotency_key)
+        accepted.append((i, row, body))
+
+    # --- 4. Idempotency claims for all keyed items in one Redis pipeline ---
+    keyed = [(i, row) for i, row, _ in accepted if row['idempotency_key']]
+    if keyed:
+        originals = claim_idempotency_keys([(row['subscription_id'], row['idempotency_key'], row['id']) for _, row in keyed])
+        duplicate_ids = set()
+        for (i, row), original_task_id in zip(keyed, originals):
+            if original_task_id:
+                results[i] = {"index": start_index + i, "status": 202, "message": "Duplicate webhook, already queued", "task_id": original_task_id}
+                duplicate_ids.add(row['id'])
+        accepted = [(i, row, body) for i, row, body in accepted if row['id'] not in duplicate_ids]
+
+    # --- 5. One multi-row INSERT for the tasks and one for their outbox rows ---
+    # The key rows go first with ON CONFLICT DO NOTHING: a key whose Redis claim had expired
+    # but whose task exists is skipped together with its task
+    if accepted:
+        rows = []
+        for _, row, body in accepted:
+            payload_blob = offload_large_payload(row, body)
+            if payload_blob:
+                payload_blobs[row['id']] = payload_blob
+            rows.append(row)
+        session = db_session()
+        try:
+            keyed_ids = add_new_idempotency_keys(session, rows)
+            inserted_ids = {row['id'] for row in rows if not row['idempotency_key'] or row['id'] in keyed_ids}
+            if inserted_ids:
+                session.execute(insert(DeliveryTask), [row for row in rows if row['id'] in inserted_ids])
+            add_payload_blobs(session, [payload_blobs.get(task_id) for task_id in inserted_ids])
+            add_to_outbox(session, [(row['id'], row['subscription_id']) for row in rows if row['id'] in inserted_ids])
+
+            conflicting = [(row['subscription_id'], row['idempotency_key']) for row in rows if row['id'] not in inserted_ids]
+            existing = find_existing_task_ids(session, conflicting)
+            session.commit()
+        except Exception:
+            session.rollback()
+            for row in rows:
+                discard_offloaded_payload(row)
+                if row['idempotency_key']:
+                    release_idempotency_key(row['subscription_id'], row['idempotency_key'], row['id'])
+            raise
+        finally:
+            db_session.remove()
+        # Blob files written for items whose key turned out to be taken
+        for row in rows:
+            if row['id'] not in inserted_ids:
+                discard_offloaded_payload(row)
+
+        for i, row, _ in accepted:
+            if row['id'] in inserted_ids:
+                results[i] = {"index": start_index + i, "status": 202, "message": "Webhook received and queued", "task_id": str(row['id'])}
+            else:
+                original_task_id = existing.get((str(row['subscription_id']), row['idempotency_key']))
+                if not original_task_id:
+                    results[i] = {"index": start_index + i, "status": 409, "message": "Duplicate idempotency key"}
+                    continue
+                remember_idempotency_key(row['subscription_id'], row['idempotency_key'], original_task_id)
+                results[i] = {"index": start_index + i, "status": 202, "message": "Duplicate webhook, already queued", "task_id": str(original_task_id)}
+
+        print(f"Batch: {len(inserted_ids)} delivery tasks created and queued.")
+
+    return results
+
+
+@api_bp.route('/ingest/batch', methods=['POST'])
+def ingest_batch():
+    """
+    Ingests many webhook payloads in one request.
+    Accepts a JSON body ({"items": [...]} or a bare list) or, with an
+    application/x-ndjson body, one item per line; NDJSON results are streamed
+    back as one JSON line per item, processed in chunks of BATCH_INGEST_CHUNK_SIZE.
+    """
+    if request.mimetype == 'application/x-ndjson':
+        return ingest_batch_ndjson()
+
+    body = request.get_json(silent=True)
+    if body is None:
+        return jsonify({"message": "Request body must be JSON"}), 415
+
+    items = body.get('items') if isinstance(body, dict) else body
+    if not isinstance(items, list):
+        return jsonify({"message": "Request body must be a list of items or an object with 'items'"}), 400
+    if len(items) > Config.BATCH_INGEST_MAX_ITEMS:
+        return jsonify({"message": f"Batch exceeds {Config.BATCH_INGEST_MAX_ITEMS} items"}), 413
+
+    try:
+        results = ingest_batch_items(items)
+    except Exception as e:
+        print(f"Error during batch webhook ingestion: {e}")
+        return jsonify({"message": "An internal error occurred during ingestion"}), 500
+
+    queued = sum(1 for result in results if result.get('task_id'))
+    return jsonify({"queued": queued, "total": len(results), "results": results}), 202
+
+
+def ingest_batch_ndjson():
+    """Streams NDJSON items from the request body and streams per-item results back."""
+    def process_chunk(chunk, index):
+        try:
+            results = ingest_batch_items(chunk, index)
+        except Exception as e:
+            print(f"Error during NDJSON batch ingestion at item {index}: {e}")
+            results = [{"index": index + i, "status": 500, "message": "An internal error occurred during ingestion"}
+                       for i in range(len(chunk))]
+        return "".join(json.dumps(result) + "\n" for result in results)
+
+    def generate():
+        chunk = []
+        index = 0
+        for line in request.stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                chunk.append(json.loads(line))
+            except json.JSONDecodeError:
+                chunk.append(None) # Reported as a 400 result for this line
+            if len(chunk) >= Config.BATCH_INGEST_CHUNK_SIZE:
+                yield process_chunk(chunk, index)
+                index += len(chunk)
+                chunk = []
+        if chunk:
+            yield process_chunk(chunk, index)
+
+    return Response(stream_with_context(generate()), status=202, mimetype='application/x-ndjson')
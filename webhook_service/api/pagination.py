@@ -0,0 +1,133 @@
+"""
+Keyset pagination and NDJSON streaming for the listing endpoints.
+
+Listings are ordered by a timestamp plus the row's id, which is unique, and a page
+continues after the last row served (?cursor=, an opaque token of that row's sort
+key) instead of using OFFSET, so deep pages cost the same as the first one. The body
+stays a JSON array; the token of the next page is returned in the X-Next-Cursor
+header, which is absent on the last page. Listings that were not paginated before
+(GET /subscriptions) only page when ?limit= or ?cursor= is passed; without them the
+whole array is streamed, as json_array_response() below.
+
+With ?format=ndjson (or Accept: application/x-ndjson) every matching row from the
+cursor on is streamed instead, one JSON object per line. The rows are read through
+a server-side cursor, LIST_STREAM_BATCH_SIZE at a time, so neither the API process
+nor Postgres builds the whole result in memory.
+"""
+import base64
+import json
+import uuid
+from datetime import datetime
+from flask import request, jsonify, Response, stream_with_context
+from sqlalchemy import tuple_
+from sqlalchemy.orm import Session
+
+from ..database import read_engine
+from ..config import Config
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(timestamp, row_id):
+    """Opaque token for the sort key (timestamp, id) of the last row of a page."""
+    raw = json.dumps([timestamp.isoformat(), str(row_id)]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Returns the (timestamp, id) of a cursor token. Raises InvalidCursor for a malformed token."""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        timestamp, row_id = json.loads(raw)
+        return datetime.fromisoformat(timestamp), uuid.UUID(row_id)
+    except (TypeError, ValueError) as e: # binascii.Error and JSONDecodeError are ValueErrors
+        raise InvalidCursor(f"Invalid cursor: {token}") from e
+
+
+def page_limit(default=None):
+    """The page size from ?limit=, clamped to 1..LIST_MAX_PAGE_SIZE."""
+    limit = request.args.get('limit', default or Config.LIST_PAGE_SIZE, type=int)
+    return min(max(limit, 1), Config.LIST_MAX_PAGE_SIZE)
+
+
+def wants_ndjson():
+    if request.args.get('format') == 'ndjson':
+        return True
+    return request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+
+def keyset(query, timestamp_column, id_column, descending=False):
+    """
+    Orders query by (timestamp_column, id_column) and continues after ?cursor=.
+    Raises InvalidCursor for a malformed cursor.
+    """
+    token = request.args.get('cursor')
+    if token:
+        after = decode_cursor(token)
+        key = tuple_(timestamp_column, id_column)
+        query = query.filter(key < after if descending else key > after)
+    if descending:
+        return query.order_by(timestamp_column.desc(), id_column.desc())
+    return query.order_by(timestamp_column, id_column)
+
+
+def paginated_response(query, schema, limit, sort_key):
+    """
+    One page of query (already ordered by keyset()) as a JSON array, with X-Next-Cursor
+    set when more rows follow. sort_key(row) returns the row's (timestamp, id).
+    """
+    rows = query.limit(limit + 1).all()
+    response = jsonify(schema.dump(rows[:limit], many=True))
+    if len(rows) > limit:
+        response.headers['X-Next-Cursor'] = encode_cursor(*sort_key(rows[limit - 1]))
+    return response
+
+
+def wants_page():
+    """Whether the request asked for a page (?limit= or ?cursor=) rather than the whole listing."""
+    return 'limit' in request.args or 'cursor' in request.args
+
+
+def _stream_rows(query, schema, description):
+    """
+    Yields every row of query, dumped as a JSON string, through a server-side cursor. The
+    stream has its own (read) session, since the request's scoped session is removed before
+    it starts.
+    """
+    session = Session(bind=read_engine())
+    try:
+        rows = query.with_session(session).yield_per(Config.LIST_STREAM_BATCH_SIZE)
+        for row in rows:
+            yield json.dumps(schema.dump(row))
+    except Exception as e:
+        # The status line is already sent; the client sees a truncated stream
+        print(f"Error streaming {description}: {e}")
+    finally:
+        session.close()
+
+
+def ndjson_response(query, schema, description):
+    """Streams every row of query as NDJSON through a server-side cursor."""
+    def generate():
+        for row in _stream_rows(query, schema, description):
+            yield row + "\n"
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+
+
+def json_array_response(query, schema, description):
+    """
+    Streams every row of query as one JSON array, the same body as jsonify() of the whole
+    result, without building it in memory.
+    """
+    def generate():
+        yield "["
+        for i, row in enumerate(_stream_rows(query, schema, description)):
+            yield row if i == 0 else "," + row
+        yield "]"
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
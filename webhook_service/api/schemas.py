@@ -1,5 +1,6 @@
 from marshmallow import Schema, fields, validate, ValidationError
 import uuid
+from ..config import Config
 
 # Custom UUID field for Marshmallow
 class UUIDField(fields.UUID):
@@ -21,6 +22,17 @@ class SubscriptionCreateUpdateSchema(Schema):
     target_url = fields.URL(required=True, validate=validate.Length(min=1, max=255))
     secret = fields.String(validate=validate.Length(max=255), allow_none=True, missing=None)
     event_type_filter = fields.String(validate=validate.Length(max=255), allow_none=True, missing=None) # Bonus
+    passthrough = fields.Boolean(missing=False) # Forward the raw request body verbatim
+    # Coalesce pending tasks into one POST with a JSON array body
+    batch_max_size = fields.Integer(validate=validate.Range(min=1, max=Config.DELIVERY_BATCH_MAX_SIZE_LIMIT), allow_none=True, missing=None)
+    batch_linger_ms = fields.Integer(validate=validate.Range(min=0, max=Config.DELIVERY_BATCH_MAX_LINGER_MS), allow_none=True, missing=None)
+    # Token bucket for deliveries to this subscription
+    rate_limit_per_second = fields.Float(validate=validate.Range(min=0, min_inclusive=False), allow_none=True, missing=None)
+    rate_limit_burst = fields.Integer(validate=validate.Range(min=1), allow_none=True, missing=None)
+    weight = fields.Integer(validate=validate.Range(min=1, max=1000), missing=1) # Fair share of delivery throughput
+    # Content-Encoding of delivered bodies the receiver accepts
+    compression = fields.String(validate=validate.OneOf(['gzip', 'zstd']), allow_none=True, missing=None)
+    compression_min_bytes = fields.Integer(validate=validate.Range(min=0), allow_none=True, missing=None)
 
 # Schema for Subscription output
 class SubscriptionSchema(SubscriptionCreateUpdateSchema):
@@ -32,17 +44,24 @@ class SubscriptionSchema(SubscriptionCreateUpdateSchema):
 class DeliveryAttemptSchema(Schema):
     id = UUIDField(dump_only=True)
     delivery_task_id = UUIDField(dump_only=True)
+    subscription_id = UUIDField(dump_only=True, allow_none=True)
     attempt_number = fields.Integer(dump_only=True)
     timestamp = fields.DateTime(dump_only=True)
     outcome = fields.String(dump_only=True)
     http_status = fields.Integer(dump_only=True, allow_none=True)
     error_details = fields.String(dump_only=True, allow_none=True)
+    connect_timeout_ms = fields.Integer(dump_only=True, allow_none=True)
+    read_timeout_ms = fields.Integer(dump_only=True, allow_none=True)
+    latency_ms = fields.Integer(dump_only=True, allow_none=True)
 
 # Schema for Delivery Task output (for status endpoint)
 class DeliveryTaskSchema(Schema):
     id = UUIDField(dump_only=True)
     subscription_id = UUIDField(dump_only=True)
-    payload = fields.Dict(dump_only=True)
+    payload = fields.Dict(dump_only=True, allow_none=True) # None for passthrough tasks
+    content_type = fields.String(dump_only=True, allow_none=True)
+    payload_storage = fields.String(dump_only=True, allow_none=True) # Set when the body is stored compressed out of row
+    payload_size = fields.Integer(dump_only=True, allow_none=True)
     status = fields.String(dump_only=True)
     created_at = fields.DateTime(dump_only=True)
     last_attempt_at = fields.DateTime(dump_only=True, allow_none=True)
@@ -62,3 +81,4 @@ delivery_attempt_schema = DeliveryAttemptSchema()
 delivery_attempts_schema = DeliveryAttemptSchema(many=True)
 
 delivery_task_schema = DeliveryTaskSchema()
+delivery_task_summary_schema = DeliveryTaskSchema(exclude=('payload',)) # Task listings leave out the bodies
@@ -1,10 +1,24 @@
-from flask import jsonify, request
-from sqlalchemy import desc
+from flask import jsonify, request, Response
+from marshmallow import fields
+from sqlalchemy import desc, func, select, text
+from sqlalchemy.dialects.postgresql import aggregate_order_by
 from . import api_bp
-from ..database import db_session
-from ..models import DeliveryTask, DeliveryAttempt, Subscription
-from .schemas import delivery_task_schema, delivery_attempts_schema
+from ..database import db_read_session, replicas, engine, pool_stats
+from ..models import DeliveryTask, DeliveryAttempt, Subscription, OutboxMessage
+from .schemas import delivery_task_schema, delivery_task_summary_schema, delivery_attempt_schema
+from .pagination import InvalidCursor, keyset, page_limit, wants_ndjson, paginated_response, ndjson_response
+from ..cache import cache_stats, redis_client
+from ..config import Config
+from .. import circuit_breaker, latency
 import uuid
+import json
+import hashlib
+from datetime import datetime, timezone
+
+TASK_STATUSES = {'pending', 'processing', 'retrying', 'succeeded', 'failed'}
+TERMINAL_STATUSES = ('succeeded', 'failed')
+TERMINAL_OUTCOMES = ('success', 'permanently_failed') # Outcome of the attempt that finished a task
+TASK_STATUS_KEY_PREFIX = "task-status:"
 
 def validate_uuid_param(uuid_str):
     try:
@@ -12,54 +26,280 @@ def validate_uuid_param(uuid_str):
     except ValueError:
         return None
 
+# Fixed-width ISO 8601, so the timestamps parse back into the datetimes DeliveryAttemptSchema dumps
+ATTEMPT_TIMESTAMP_FORMAT = 'YYYY-MM-DD"T"HH24:MI:SS.USTZH:TZM'
+ATTEMPT_DATETIME_FIELDS = [name for name, field in delivery_attempt_schema.fields.items() if isinstance(field, fields.DateTime)]
+
+
+def attempts_json():
+    """
+    Correlated subquery that aggregates a task's attempts, in attempt order, into a JSON
+    array of the fields of DeliveryAttemptSchema (see dump_attempts).
+    """
+    def column(name):
+        if name in ATTEMPT_DATETIME_FIELDS:
+            return func.to_char(getattr(DeliveryAttempt, name), ATTEMPT_TIMESTAMP_FORMAT)
+        return getattr(DeliveryAttempt, name)
+
+    attempt = func.json_build_object(*[
+        arg for name in delivery_attempt_schema.fields for arg in (name, column(name))
+    ])
+    return select(func.coalesce(func.json_agg(aggregate_order_by(attempt, DeliveryAttempt.attempt_number)), text("'[]'::json")))\
+        .where(DeliveryAttempt.delivery_task_id == DeliveryTask.id)\
+        .scalar_subquery()
+
+
+def dump_attempts(attempts):
+    """The attempts of attempts_json() as DeliveryAttemptSchema dumps them everywhere else in the API."""
+    for attempt in attempts:
+        for name in ATTEMPT_DATETIME_FIELDS:
+            if attempt[name] is not None:
+                attempt[name] = datetime.fromisoformat(attempt[name])
+    return delivery_attempt_schema.dump(attempts, many=True)
+
+
+def get_cached_task_status(task_id):
+    try:
+        return redis_client.get(f"{TASK_STATUS_KEY_PREFIX}{task_id}")
+    except Exception as e:
+        print(f"Error reading cached status of task {task_id}: {e}")
+        return None
+
+
+def cache_task_status(task_id, body):
+    try:
+        redis_client.set(f"{TASK_STATUS_KEY_PREFIX}{task_id}", body, ex=Config.TASK_STATUS_CACHE_TTL_SECONDS)
+    except Exception as e:
+        print(f"Error caching status of task {task_id}: {e}")
+
+
+def task_status_response(body):
+    """The status JSON with a strong ETag; answers 304 Not Modified to a matching If-None-Match."""
+    response = Response(body, mimetype='application/json')
+    response.set_etag(hashlib.sha1(body.encode()).hexdigest())
+    return response.make_conditional(request)
+
+
 @api_bp.route('/status/delivery_tasks/<uuid:task_id>', methods=['GET'])
 def get_delivery_task_status(task_id):
-    """Gets the status and attempts for a specific delivery task."""
+    """
+    Gets the status and attempts for a specific delivery task, in one query.
+    Succeeded and failed tasks never change, so their response is served from Redis.
+    """
     try:
-        task = db_session.query(DeliveryTask).filter_by(id=task_id).first()
-        if not task:
-            return jsonify({"message": "Delivery task not found"}), 404
-
-        attempts = db_session.query(DeliveryAttempt)\
-                             .filter_by(delivery_task_id=task_id)\
-                             .order_by(DeliveryAttempt.attempt_number)\
-                             .all()
+        body = get_cached_task_status(task_id)
+        if body:
+            return task_status_response(body)
 
-        task_data = delivery_task_schema.dump(task)
-        attempts_data = delivery_attempts_schema.dump(attempts)
+        row = db_read_session.query(DeliveryTask, attempts_json().label('attempts'))\
+                        .filter(DeliveryTask.id == task_id)\
+                        .first()
+        if not row:
+            return jsonify({"message": "Delivery task not found"}), 404
+        task, attempts = row
 
-        response_data = task_data
-        response_data['attempts'] = attempts_data # type: ignore[reportGeneralTypeIssues]
+        response_data = delivery_task_schema.dump(task)
+        response_data['attempts'] = dump_attempts(attempts) # type: ignore[reportGeneralTypeIssues]
+        body = json.dumps(response_data, sort_keys=True)
 
-        return jsonify(response_data), 200
+        # Attempts are written behind the task update, so wait until the final one is visible
+        if task.status in TERMINAL_STATUSES and any(attempt['outcome'] in TERMINAL_OUTCOMES for attempt in attempts):
+            cache_task_status(task_id, body)
+        return task_status_response(body)
 
     except Exception as e:
         print(f"Error getting status for task {task_id}: {e}")
         return jsonify({"message": "An error occurred"}), 500
     finally:
-        db_session.remove()
+        db_read_session.remove()
 
 
 @api_bp.route('/status/subscriptions/<uuid:sub_id>/attempts', methods=['GET'])
 def list_subscription_attempts(sub_id):
-    """Lists recent delivery attempts for a specific subscription."""
+    """
+    Lists delivery attempts for a specific subscription, newest first, one page
+    (?limit=, default 20; ?cursor=) at a time, or all of them with ?format=ndjson.
+    """
+    try:
+        subscription = db_read_session.query(Subscription).filter_by(id=sub_id).first()
+        if not subscription:
+             return jsonify({"message": "Subscription not found"}), 404
+
+        # Served by the (subscription_id, timestamp, id) index alone, without joining delivery_tasks
+        query = db_read_session.query(DeliveryAttempt).filter(DeliveryAttempt.subscription_id == sub_id)
+        query = keyset(query, DeliveryAttempt.timestamp, DeliveryAttempt.id, descending=True)
+        if wants_ndjson():
+            return ndjson_response(query, delivery_attempt_schema, f"attempts for subscription {sub_id}")
+        return paginated_response(query, delivery_attempt_schema, page_limit(default=20),
+                                  lambda attempt: (attempt.timestamp, attempt.id)), 200
+
+    except InvalidCursor as e:
+        return jsonify({"message": str(e)}), 400
+    except Exception as e:
+        print(f"Error listing attempts for subscription {sub_id}: {e}")
+        return jsonify({"message": "An error occurred"}), 500
+    finally:
+        db_read_session.remove()
+
+
+def parse_time_param(name):
+    """An ISO 8601 query parameter as an aware datetime (UTC if no offset is given), or None if absent."""
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an ISO 8601 timestamp")
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+@api_bp.route('/status/delivery_tasks', methods=['GET'])
+def list_delivery_tasks():
+    """
+    Lists delivery tasks, newest first, filtered by ?status= (comma-separated),
+    ?subscription_id=, ?created_after= and ?created_before= (ISO 8601). Paginated with
+    ?limit= and ?cursor=, or streamed with ?format=ndjson. Payloads are left out.
+    """
+    try:
+        query = db_read_session.query(DeliveryTask)
+
+        statuses = [status for status in request.args.get('status', '').split(',') if status]
+        unknown = set(statuses) - TASK_STATUSES
+        if unknown:
+            return jsonify({"message": f"Unknown status: {', '.join(sorted(unknown))}"}), 400
+        if statuses:
+            query = query.filter(DeliveryTask.status.in_(statuses))
+
+        if request.args.get('subscription_id'):
+            sub_id = validate_uuid_param(request.args['subscription_id'])
+            if not sub_id:
+                return jsonify({"message": "subscription_id must be a UUID"}), 400
+            query = query.filter(DeliveryTask.subscription_id == sub_id)
+
+        # A time range also limits the scan to the matching daily partitions
+        created_after = parse_time_param('created_after')
+        created_before = parse_time_param('created_before')
+        if created_after:
+            query = query.filter(DeliveryTask.created_at >= created_after)
+        if created_before:
+            query = query.filter(DeliveryTask.created_at < created_before)
+
+        query = keyset(query, DeliveryTask.created_at, DeliveryTask.id, descending=True)
+        if wants_ndjson():
+            return ndjson_response(query, delivery_task_summary_schema, "delivery tasks")
+        return paginated_response(query, delivery_task_summary_schema, page_limit(),
+                                  lambda task: (task.created_at, task.id)), 200
+
+    except ValueError as e: # Malformed cursor or time parameter
+        return jsonify({"message": str(e)}), 400
+    except Exception as e:
+        print(f"Error listing delivery tasks: {e}")
+        return jsonify({"message": "An error occurred"}), 500
+    finally:
+        db_read_session.remove()
+
+
+@api_bp.route('/status/subscriptions/<uuid:sub_id>/queue', methods=['GET'])
+def get_subscription_queue_depth(sub_id):
+    """Returns how many of a subscription's tasks wait in its outbox queue and in each unfinished status."""
     try:
-        subscription = db_session.query(Subscription).filter_by(id=sub_id).first()
+        subscription = db_read_session.query(Subscription).filter_by(id=sub_id).first()
         if not subscription:
              return jsonify({"message": "Subscription not found"}), 404
 
+        queued = db_read_session.query(func.count(OutboxMessage.id))\
+                           .filter(OutboxMessage.subscription_id == sub_id)\
+                           .scalar()
+        by_status = dict(db_read_session.query(DeliveryTask.status, func.count(DeliveryTask.id))
+                                   .filter(DeliveryTask.subscription_id == sub_id,
+                                           DeliveryTask.status.in_(['pending', 'processing', 'retrying']))
+                                   .group_by(DeliveryTask.status)
+                                   .all())
+
+        return jsonify({
+            "subscription_id": str(sub_id),
+            "weight": subscription.weight,
+            "queued_for_publishing": queued,
+            "pending": by_status.get('pending', 0),
+            "processing": by_status.get('processing', 0),
+            "retrying": by_status.get('retrying', 0)
+        }), 200
+
+    except Exception as e:
+        print(f"Error getting queue depth for subscription {sub_id}: {e}")
+        return jsonify({"message": "An error occurred"}), 500
+    finally:
+        db_read_session.remove()
 
-        recent_attempts = db_session.query(DeliveryAttempt)\
-                                    .join(DeliveryTask)\
-                                    .filter(DeliveryTask.subscription_id == sub_id)\
-                                    .order_by(desc(DeliveryAttempt.timestamp))\
-                                    .limit(20)\
-                                    .all()
 
-        return jsonify(delivery_attempts_schema.dump(recent_attempts)), 200
+@api_bp.route('/status/queues', methods=['GET'])
+def list_queue_depths():
+    """Lists the subscriptions with the deepest outbox queues (?limit=, default 20)."""
+    try:
+        limit = min(request.args.get('limit', 20, type=int), 1000)
+        depths = db_read_session.query(OutboxMessage.subscription_id, func.count(OutboxMessage.id).label('queued'))\
+                           .group_by(OutboxMessage.subscription_id)\
+                           .order_by(desc('queued'))\
+                           .limit(limit)\
+                           .all()
+        return jsonify([
+            {"subscription_id": str(row.subscription_id), "queued_for_publishing": row.queued}
+            for row in depths
+        ]), 200
 
     except Exception as e:
-        print(f"Error listing attempts for subscription {sub_id}: {e}")
+        print(f"Error listing queue depths: {e}")
         return jsonify({"message": "An error occurred"}), 500
     finally:
-        db_session.remove()
+        db_read_session.remove()
+
+
+@api_bp.route('/status/cache', methods=['GET'])
+def get_cache_stats():
+    """Returns the subscription cache hit/miss counters per tier for this API process."""
+    return jsonify(cache_stats()), 200
+
+
+@api_bp.route('/status/replicas', methods=['GET'])
+def list_replicas():
+    """Lists the read replicas with their last measured lag and whether this API process reads from them."""
+    return jsonify([replica.status() for replica in replicas]), 200
+
+
+@api_bp.route('/status/db_pool', methods=['GET'])
+def get_db_pool_stats():
+    """Returns the database pool usage and checkout wait times of this API process, for the primary and each replica."""
+    return jsonify({
+        "primary": pool_stats(engine),
+        "replicas": [dict(pool_stats(replica.engine), url=replica.status()['url']) for replica in replicas]
+    }), 200
+
+
+@api_bp.route('/status/circuits', methods=['GET'])
+def list_circuits():
+    """
+    Lists the circuit breaker state of target hosts with recent failures,
+    or of a single host with ?url=<target url>.
+    """
+    try:
+        url = request.args.get('url')
+        if url:
+            return jsonify(circuit_breaker.get_circuit(url)), 200
+        return jsonify(circuit_breaker.list_circuits()), 200
+    except Exception as e:
+        print(f"Error listing circuit breaker states: {e}")
+        return jsonify({"message": "An error occurred"}), 500
+
+
+@api_bp.route('/status/latency', methods=['GET'])
+def get_host_latency():
+    """Rolling latency percentiles of a target host (?url=<target url>) and the timeouts derived from them."""
+    url = request.args.get('url')
+    if not url:
+        return jsonify({"message": "The url query parameter is required"}), 400
+    try:
+        return jsonify(latency.latency_stats(url)), 200
+    except Exception as e:
+        print(f"Error reading delivery latency: {e}")
+        return jsonify({"message": "An error occurred"}), 500
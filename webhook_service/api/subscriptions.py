@@ -1,13 +1,13 @@
 from flask import request, jsonify
 from sqlalchemy.exc import IntegrityError
 from . import api_bp
-from ..database import db_session
+from ..database import db_session, db_read_session
 from ..models import Subscription
-from .schemas import subscription_schema, subscriptions_schema, subscription_create_update_schema, ValidationError
-from ..cache import redis_client
-from ..config import Config
+from .schemas import subscription_schema, subscription_create_update_schema, ValidationError
+from .pagination import (InvalidCursor, keyset, page_limit, wants_ndjson, wants_page, paginated_response,
+                         ndjson_response, json_array_response)
+from ..cache import cache_subscription, invalidate_subscription
 import uuid
-import json
 
 def get_and_load_subscription_data(schema, partial=False):
     """Helper to handle request.json and Marshmallow loading."""
@@ -38,17 +38,20 @@ def create_subscription():
             id=uuid.uuid4(),
             target_url=data['target_url'], # type: ignore[reportGeneralTypeIssues]
             secret=data.get('secret'), # type: ignore[reportOptionalIterable]
-            event_type_filter=data.get('event_type_filter') # type: ignore[reportOptionalIterable]
+            event_type_filter=data.get('event_type_filter'), # type: ignore[reportOptionalIterable]
+            passthrough=data.get('passthrough', False), # type: ignore[reportOptionalIterable]
+            batch_max_size=data.get('batch_max_size'), # type: ignore[reportOptionalIterable]
+            batch_linger_ms=data.get('batch_linger_ms'), # type: ignore[reportOptionalIterable]
+            rate_limit_per_second=data.get('rate_limit_per_second'), # type: ignore[reportOptionalIterable]
+            rate_limit_burst=data.get('rate_limit_burst'), # type: ignore[reportOptionalIterable]
+            weight=data.get('weight', 1), # type: ignore[reportOptionalIterable]
+            compression=data.get('compression'), # type: ignore[reportOptionalIterable]
+            compression_min_bytes=data.get('compression_min_bytes') # type: ignore[reportOptionalIterable]
         )
 
         session.add(new_subscription)
         session.commit()
-        cache_key = f"subscription:{new_subscription.id}"
-        redis_client.setex(cache_key, Config.CACHE_EXPIRY_SECONDS, json.dumps({
-             'target_url': new_subscription.target_url,
-             'secret': new_subscription.secret,
-             'event_type_filter': new_subscription.event_type_filter
-        }))
+        cache_subscription(new_subscription)
 
 
         return jsonify(subscription_schema.dump(new_subscription)), 201
@@ -66,21 +69,31 @@ def create_subscription():
 
 @api_bp.route('/subscriptions', methods=['GET'])
 def list_subscriptions():
-    """Lists all webhook subscriptions."""
-    session = db_session()
+    """
+    Lists webhook subscriptions, oldest first: all of them as one JSON array (streamed),
+    one page at a time when ?limit= or ?cursor= is passed, or as NDJSON with ?format=ndjson.
+    """
+    session = db_read_session() # Read-only: may be served by a replica
     try:
-        subscriptions = session.query(Subscription).all()
-        return jsonify(subscriptions_schema.dump(subscriptions)), 200
+        query = keyset(session.query(Subscription), Subscription.created_at, Subscription.id)
+        if wants_ndjson():
+            return ndjson_response(query, subscription_schema, "subscriptions")
+        if not wants_page():
+            return json_array_response(query, subscription_schema, "subscriptions"), 200
+        return paginated_response(query, subscription_schema, page_limit(),
+                                  lambda subscription: (subscription.created_at, subscription.id)), 200
+    except InvalidCursor as e:
+        return jsonify({"message": str(e)}), 400
     except Exception as e:
         print(f"Error listing subscriptions: {e}")
         return jsonify({"message": "An error occurred"}), 500
     finally:
-        db_session.remove() # Ensure session is closed
+        db_read_session.remove() # Ensure session is closed
 
 @api_bp.route('/subscriptions/<uuid:sub_id>', methods=['GET'])
 def get_subscription(sub_id):
     """Gets details for a specific subscription."""
-    session = db_session()
+    session = db_read_session() # Read-only: may be served by a replica
     try:
         subscription = session.query(Subscription).filter_by(id=sub_id).first()
         if not subscription:
@@ -91,7 +104,7 @@ def get_subscription(sub_id):
         print(f"Error getting subscription {sub_id}: {e}")
         return jsonify({"message": "An error occurred"}), 500
     finally:
-        db_session.remove() # Ensure session is closed
+        db_read_session.remove() # Ensure session is closed
 
 @api_bp.route('/subscriptions/<uuid:sub_id>', methods=['PUT']) # type: ignore[reportReturnType]
 def update_subscription(sub_id):
@@ -111,12 +124,7 @@ def update_subscription(sub_id):
             setattr(subscription, key, value)
 
         session.commit()
-        cache_key = f"subscription:{subscription.id}"
-        redis_client.setex(cache_key, Config.CACHE_EXPIRY_SECONDS, json.dumps({
-            'target_url': subscription.target_url,
-            'secret': subscription.secret,
-            'event_type_filter': subscription.event_type_filter
-        }))
+        cache_subscription(subscription) # Also invalidates the in-process copies in every worker
 
         return jsonify(subscription_schema.dump(subscription)), 200
     except IntegrityError:
@@ -141,8 +149,7 @@ def delete_subscription(sub_id):
 
         session.delete(subscription)
         session.commit()
-        cache_key = f"subscription:{sub_id}"
-        redis_client.delete(cache_key)
+        invalidate_subscription(sub_id)
 
         return jsonify({"message": "Subscription deleted"}), 200
     except Exception as e:
@@ -0,0 +1,178 @@
+"""
+Native asyncio ingestion server, an alternative to the gunicorn/WSGI entry point.
+
+Serves the same POST /api/v1/ingest/<uuid> contract as api/ingestion.py (also under
+/api, like wsgi.py), sharing its signature and event type checks and the subscription
+cache tiers, but with async Redis and async Postgres (asyncpg), so one process can
+hold thousands of ingests in flight. Publishing happens through the outbox, so the
+request never talks to the broker. Run with:
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000 --workers 4
+"""
+import json
+import uuid
+import asyncio
+import contextlib
+import redis.asyncio as aioredis
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.pool import NullPool
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Route
+
+from .config import Config
+from .models import DeliveryTask, DeliveryPayload, OutboxMessage, IdempotencyKey, new_delivery_task_row
+from .payloads import offload_large_payload, discard_offloaded_payload
+from .cache import get_subscription_details_async
+from .validation import verify_signature, check_event_type
+from .idempotency import (extract_idempotency_key, claim_idempotency_key_async, remember_idempotency_key_async,
+                          release_idempotency_key_async, existing_task_ids_query)
+
+
+def async_database_url():
+    """The configured database URL, switched to the asyncpg driver."""
+    url = Config.SQLALCHEMY_DATABASE_URI
+    for prefix in ('postgresql+psycopg2://', 'postgresql://', 'postgres://'):
+        if url.startswith(prefix):
+            return 'postgresql+asyncpg://' + url[len(prefix):]
+    return url
+
+
+async_redis_client = aioredis.from_url(Config.REDIS_CACHE_URL, decode_responses=True)
+if Config.DB_PGBOUNCER:
+    # PgBouncer in transaction mode may hand each transaction another server connection: no cached prepared statements
+    async_engine = create_async_engine(
+        async_database_url(),
+        poolclass=NullPool,
+        connect_args={
+            'statement_cache_size': 0,
+            'prepared_statement_cache_size': 0,
+            'prepared_statement_name_func': lambda: f"__asyncpg_{uuid.uuid4()}__",
+        }
+    )
+else:
+    async_engine = create_async_engine(
+        async_database_url(),
+        pool_size=Config.ASGI_DB_POOL_SIZE,
+        max_overflow=Config.ASGI_DB_MAX_OVERFLOW,
+        pool_timeout=Config.DB_POOL_TIMEOUT_SECONDS,
+        pool_recycle=Config.DB_POOL_RECYCLE_SECONDS,
+        pool_pre_ping=Config.DB_POOL_PRE_PING
+    )
+AsyncSession = async_sessionmaker(async_engine, expire_on_commit=False)
+
+
+async def ingest_webhook(request):
+    """Ingests a webhook payload and queues it for delivery."""
+    sub_id = request.path_params['sub_id']
+    body = await request.body()
+
+    try:
+        # --- 1. Subscription lookup (local cache, then Redis, then DB) ---
+        subscription = await get_subscription_details_async(sub_id, async_redis_client, AsyncSession)
+        if not subscription:
+            return JSONResponse({"message": "Subscription not found"}, status_code=404)
+
+        content_type = request.headers.get('content-type')
+        payload = None
+        if subscription.get('passthrough'):
+            # Stored and forwarded verbatim, never decoded
+            task_row = new_delivery_task_row(sub_id, raw_body=body, content_type=content_type)
+        else:
+            if (content_type or '').split(';')[0].strip() != 'application/json':
+                return JSONResponse({"message": "Request body must be JSON"}, status_code=415)
+            try:
+                payload = json.loads(body)
+            except ValueError:
+                payload = None
+            if not payload:
+                return JSONResponse({"message": "Request body must be JSON"}, status_code=415)
+            task_row = new_delivery_task_row(sub_id, payload=payload)
+
+        # --- 2. Signature Verification ---
+        secret = subscription.get('secret')
+        if secret:
+            signature_error = verify_signature(secret, body, request.headers.get(Config.WEBHOOK_SECRET_HEADER))
+            if signature_error:
+                message, status_code = signature_error
+                print(f"Webhook {sub_id}: Signature check failed: {message}.")
+                return JSONResponse({"message": message}, status_code=status_code)
+
+        # --- 3. Event Type Filtering ---
+        skipped_message = check_event_type(subscription.get('event_type_filter'),
+                                           request.headers.get(Config.WEBHOOK_EVENT_TYPE_HEADER))
+        if skipped_message:
+            print(f"Webhook {sub_id}: {skipped_message}")
+            return JSONResponse({"message": skipped_message}, status_code=202)
+
+        # --- 4. Idempotency: a retried request gets its original task back, without a write ---
+        task_id = task_row['id']
+        idempotency_key = extract_idempotency_key(request.headers, payload)
+        if idempotency_key:
+            task_row['idempotency_key'] = idempotency_key
+            original_task_id = await claim_idempotency_key_async(async_redis_client, sub_id, idempotency_key, task_id)
+            if original_task_id:
+                return JSONResponse({"message": "Duplicate webhook, already queued", "task_id": original_task_id}, status_code=202)
+
+        # --- 5. Create Delivery Task and its outbox row in one transaction ---
+        try:
+            # Large bodies are compressed and kept out of row; compressing and a blob file write would block the event loop
+            payload_blob = await asyncio.to_thread(offload_large_payload, task_row, body)
+            async with AsyncSession() as session:
+                async with session.begin():
+                    await session.execute(insert(DeliveryTask).values(**task_row))
+                    if idempotency_key:
+                        await session.execute(insert(IdempotencyKey).values(subscription_id=sub_id, idempotency_key=idempotency_key,
+                                                                            delivery_task_id=task_id))
+                    if payload_blob:
+                        await session.execute(insert(DeliveryPayload).values(**payload_blob))
+                    if Config.DELIVERY_ENGINE != 'asyncio': # The asyncio engine claims tasks without the outbox
+                        await session.execute(insert(OutboxMessage).values(delivery_task_id=task_id, subscription_id=sub_id))
+        except IntegrityError:
+            # The idempotency key table caught a duplicate whose Redis claim had already expired
+            await asyncio.to_thread(discard_offloaded_payload, task_row)
+            if not idempotency_key:
+                raise
+            async with AsyncSession() as session:
+                row = (await session.execute(existing_task_ids_query([(sub_id, idempotency_key)]))).first()
+            if not row:
+                # Another constraint (e.g. the subscription was deleted): the claimed key has no task behind it
+                await release_idempotency_key_async(async_redis_client, sub_id, idempotency_key, task_id)
+                raise
+            await remember_idempotency_key_async(async_redis_client, sub_id, idempotency_key, row.id)
+            return JSONResponse({"message": "Duplicate webhook, already queued", "task_id": str(row.id)}, status_code=202)
+        except Exception:
+            await asyncio.to_thread(discard_offloaded_payload, task_row)
+            if idempotency_key:
+                await release_idempotency_key_async(async_redis_client, sub_id, idempotency_key, task_id)
+            raise
+
+        print(f"Webhook {sub_id}: Delivery task {task_id} created and queued.")
+        return JSONResponse({"message": "Webhook received and queued", "task_id": str(task_id)}, status_code=202)
+
+    except Exception as e:
+        print(f"Error during webhook ingestion for subscription {sub_id}: {e}")
+        return JSONResponse({"message": "An internal error occurred during ingestion"}, status_code=500)
+
+
+async def index(request):
+    return PlainTextResponse("Webhook Service is running!")
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    yield
+    await async_engine.dispose()
+    await async_redis_client.aclose()
+
+
+app = Starlette(
+    routes=[
+        Route('/', index),
+        Route('/api/v1/ingest/{sub_id:uuid}', ingest_webhook, methods=['POST']),
+        Route('/api/ingest/{sub_id:uuid}', ingest_webhook, methods=['POST']),
+    ],
+    lifespan=lifespan,
+)
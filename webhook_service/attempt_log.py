@@ -0,0 +1,150 @@
+"""
+Write-behind logging of DeliveryAttempt rows.
+
+With ATTEMPT_LOG_BUFFERED, log_attempt() does not add the attempt row to the
+delivery transaction. It is parked on the session and handed to a per-process
+writer only once that transaction commits (a rollback discards it), so task status
+updates stay transactional while the attempt log, the largest write stream, is
+written in multi-row INSERTs: every ATTEMPT_LOG_FLUSH_INTERVAL_MS, or as soon as
+ATTEMPT_LOG_BATCH_SIZE rows are queued. The queue holds at most
+ATTEMPT_LOG_QUEUE_SIZE rows; when it is full the committing thread writes the
+backlog itself instead of dropping rows. The queue is flushed on worker shutdown
+and at interpreter exit; rows queued when a process is killed outright are lost.
+"""
+import os
+import queue
+import atexit
+import threading
+from sqlalchemy import insert, event
+from celery.signals import worker_process_shutdown, worker_shutdown
+
+from .database import db_session, engine
+from .models import DeliveryAttempt
+from .config import Config
+
+PENDING_ATTEMPTS_KEY = 'pending_delivery_attempts'
+
+
+class AttemptLogWriter:
+    """Bounded queue of attempt rows flushed in batches by a background thread."""
+
+    def __init__(self, max_queue, batch_size, flush_interval_ms):
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval_seconds = flush_interval_ms / 1000.0
+        self.reset_after_fork()
+
+    def reset_after_fork(self):
+        """
+        Gives a forked child its own queue, locks and flusher. A lock held by a parent
+        thread at the fork would otherwise stay locked in the child forever.
+        """
+        self._queue = queue.Queue(maxsize=self.max_queue) # Rows queued in a parent process are the parent's to write
+        self._wake = threading.Event()
+        self._write_lock = threading.Lock() # Held while draining and writing, so flush() waits for a write in progress
+        self._flusher_pid = None
+        self._flusher_lock = threading.Lock()
+
+    def log(self, rows):
+        """Queues committed attempt rows for writing."""
+        self._ensure_flusher()
+        for row in rows:
+            try:
+                self._queue.put_nowait(row)
+            except queue.Full:
+                # Backpressure instead of data loss: write the backlog from this thread
+                self.flush()
+                self._queue.put(row)
+        if self._queue.qsize() >= self.batch_size:
+            self._wake.set()
+
+    def flush(self):
+        """Writes everything queued so far. Returns the number of rows written."""
+        with self._write_lock:
+            rows = []
+            while True:
+                try:
+                    rows.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            for start in range(0, len(rows), self.batch_size):
+                self._write(rows[start:start + self.batch_size])
+            return len(rows)
+
+    def _ensure_flusher(self):
+        """Starts the flusher thread once per process (again after a fork)."""
+        if self._flusher_pid == os.getpid():
+            return
+        with self._flusher_lock:
+            if self._flusher_pid == os.getpid():
+                return
+            threading.Thread(target=self._run, name="attempt-log-writer", daemon=True).start()
+            self._flusher_pid = os.getpid()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval_seconds)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Attempt log flush failed: {e}")
+
+    def _write(self, rows):
+        # A plain connection rather than db_session: log() may run inside another session's after_commit hook
+        try:
+            with engine.begin() as connection:
+                connection.execute(insert(DeliveryAttempt), rows)
+        except Exception as e:
+            print(f"Writing {len(rows)} delivery attempts failed: {e}. Retrying rows individually.")
+            self._write_individually(rows)
+
+    def _write_individually(self, rows):
+        for row in rows:
+            try:
+                with engine.begin() as connection:
+                    connection.execute(insert(DeliveryAttempt), [row])
+            except Exception as e:
+                print(f"Dropping delivery attempt {row['attempt_number']} of task {row['delivery_task_id']}: {e}")
+
+
+attempt_log_writer = AttemptLogWriter(Config.ATTEMPT_LOG_QUEUE_SIZE, Config.ATTEMPT_LOG_BATCH_SIZE,
+                                      Config.ATTEMPT_LOG_FLUSH_INTERVAL_MS)
+os.register_at_fork(after_in_child=attempt_log_writer.reset_after_fork)
+
+
+def log_attempt(session, **columns):
+    """
+    Logs a DeliveryAttempt as part of the session's transaction: added to the session,
+    or with ATTEMPT_LOG_BUFFERED queued for the writer once the transaction commits.
+    """
+    if not Config.ATTEMPT_LOG_BUFFERED:
+        session.add(DeliveryAttempt(**columns))
+        return
+    session.info.setdefault(PENDING_ATTEMPTS_KEY, []).append(columns)
+
+
+@event.listens_for(db_session, 'after_commit')
+def _queue_committed_attempts(session):
+    rows = session.info.pop(PENDING_ATTEMPTS_KEY, None)
+    if rows:
+        attempt_log_writer.log(rows)
+
+
+@event.listens_for(db_session, 'after_rollback')
+def _discard_rolled_back_attempts(session):
+    session.info.pop(PENDING_ATTEMPTS_KEY, None)
+
+
+def _flush_on_shutdown(**kwargs):
+    try:
+        written = attempt_log_writer.flush()
+        if written:
+            print(f"Flushed {written} buffered delivery attempts on shutdown.")
+    except Exception as e:
+        print(f"CRITICAL: Failed to flush buffered delivery attempts on shutdown: {e}")
+
+
+worker_process_shutdown.connect(_flush_on_shutdown, weak=False) # Prefork pool children
+worker_shutdown.connect(_flush_on_shutdown, weak=False) # Worker main process (eventlet/gevent/solo pools)
+atexit.register(_flush_on_shutdown)
@@ -1,8 +1,81 @@
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
 import redis
 from .config import Config
 
 redis_client = redis.from_url(Config.REDIS_CACHE_URL, decode_responses=True) # decode_responses=True decodes keys/values to strings
 
+SUBSCRIPTION_INVALIDATION_CHANNEL = "subscription-invalidations"
+
+
+class LocalTTLCache:
+    """A bounded, thread-safe LRU cache whose entries expire after ttl_seconds."""
+
+    def __init__(self, max_entries, ttl_seconds):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict() # key -> (expires_at, value), least recently used first
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+local_subscription_cache = LocalTTLCache(Config.LOCAL_CACHE_MAX_ENTRIES, Config.LOCAL_CACHE_TTL_SECONDS)
+
+_stats_lock = threading.Lock()
+_stats = {
+    'local': {'hits': 0, 'misses': 0},
+    'redis': {'hits': 0, 'misses': 0},
+}
+_listener_lock = threading.Lock()
+_listener_pid = None
+
+
+def _count(tier, outcome, n=1):
+    with _stats_lock:
+        _stats[tier][outcome] += n
+
+
+def cache_stats():
+    """Returns the hit/miss counters of each cache tier for this process."""
+    with _stats_lock:
+        stats = {tier: dict(counters) for tier, counters in _stats.items()}
+    stats['local']['entries'] = len(local_subscription_cache)
+    stats['local']['listener_running'] = _listener_pid == os.getpid()
+    return stats
+
+
 def init_cache():
     """Optional: Basic check if Redis is reachable (can add more robust logic)."""
     try:
@@ -10,3 +83,163 @@ def init_cache():
         print("Redis cache connected successfully.")
     except redis.ConnectionError as e:
         print(f"Error connecting to Redis cache: {e}")
+
+
+def _listen_for_invalidations():
+    """Drops local entries announced on the invalidation channel; reconnects on errors."""
+    while True:
+        try:
+            pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(SUBSCRIPTION_INVALIDATION_CHANNEL)
+            # Anything published while we were not subscribed is lost, so start from scratch
+            local_subscription_cache.clear()
+            for message in pubsub.listen():
+                if message and message.get('type') == 'message':
+                    local_subscription_cache.delete(message['data'])
+        except Exception as e:
+            print(f"Subscription invalidation listener error: {e}. Reconnecting.")
+            local_subscription_cache.clear()
+            time.sleep(1)
+
+
+def _ensure_invalidation_listener():
+    """Starts the invalidation listener once per process (again after a fork)."""
+    global _listener_pid
+    if _listener_pid == os.getpid():
+        return
+    with _listener_lock:
+        if _listener_pid == os.getpid():
+            return
+        local_subscription_cache.clear() # Entries inherited from a parent process are not being invalidated
+        threading.Thread(target=_listen_for_invalidations, name="subscription-invalidations", daemon=True).start()
+        _listener_pid = os.getpid()
+
+
+def subscription_cache_data(db_subscription):
+    """Builds the dict cached for a subscription."""
+    return {
+        'target_url': db_subscription.target_url,
+        'secret': db_subscription.secret,
+        'event_type_filter': db_subscription.event_type_filter,
+        'passthrough': db_subscription.passthrough,
+        'batch_max_size': db_subscription.batch_max_size,
+        'batch_linger_ms': db_subscription.batch_linger_ms,
+        'rate_limit_per_second': db_subscription.rate_limit_per_second,
+        'rate_limit_burst': db_subscription.rate_limit_burst,
+        'weight': db_subscription.weight,
+        'compression': db_subscription.compression,
+        'compression_min_bytes': db_subscription.compression_min_bytes
+    }
+
+
+def get_subscriptions_details(sub_ids, session):
+    """
+    Looks up subscription details through the local tier, then Redis (one MGET),
+    then the DB (one query for the remaining misses), filling the tiers above.
+    Returns a dict {sub_id: details}; unknown subscriptions are left out.
+    """
+    from .models import Subscription
+
+    _ensure_invalidation_listener()
+    found = {}
+    missing = []
+    for sub_id in sub_ids:
+        subscription = local_subscription_cache.get(str(sub_id))
+        if subscription is not None:
+            found[sub_id] = subscription
+        else:
+            missing.append(sub_id)
+    _count('local', 'hits', len(found))
+    _count('local', 'misses', len(missing))
+    if not missing:
+        return found
+
+    cached = redis_client.mget([f"subscription:{sub_id}" for sub_id in missing])
+    uncached = []
+    for sub_id, sub_details in zip(missing, cached):
+        if sub_details:
+            try:
+                subscription = json.loads(sub_details) # type: ignore[reportGeneralTypeIssues]
+                found[sub_id] = subscription
+                local_subscription_cache.set(str(sub_id), subscription)
+                continue
+            except json.JSONDecodeError:
+                print(f"Cache decode error for subscription {sub_id}, fetching from DB.")
+                redis_client.delete(f"subscription:{sub_id}")
+        uncached.append(sub_id)
+    _count('redis', 'hits', len(missing) - len(uncached))
+    _count('redis', 'misses', len(uncached))
+    if not uncached:
+        return found
+
+    requested = {str(sub_id): sub_id for sub_id in uncached}
+    db_subscriptions = session.query(Subscription).filter(Subscription.id.in_(uncached)).all()
+    pipe = redis_client.pipeline()
+    for db_subscription in db_subscriptions:
+        subscription = subscription_cache_data(db_subscription)
+        found[requested[str(db_subscription.id)]] = subscription
+        local_subscription_cache.set(str(db_subscription.id), subscription)
+        pipe.setex(f"subscription:{db_subscription.id}", Config.CACHE_EXPIRY_SECONDS, json.dumps(subscription))
+    pipe.execute()
+    print(f"Fetched {len(db_subscriptions)} of {len(uncached)} uncached subscriptions from DB and cached.")
+    return found
+
+
+def get_subscription_details(sub_id, session):
+    """Looks up one subscription through the cache tiers. Returns None if it does not exist."""
+    return get_subscriptions_details([sub_id], session).get(sub_id)
+
+
+def cache_subscription(db_subscription):
+    """Stores fresh subscription details in Redis and tells every process to drop its local copy."""
+    redis_client.setex(f"subscription:{db_subscription.id}", Config.CACHE_EXPIRY_SECONDS,
+                       json.dumps(subscription_cache_data(db_subscription)))
+    local_subscription_cache.delete(str(db_subscription.id))
+    redis_client.publish(SUBSCRIPTION_INVALIDATION_CHANNEL, str(db_subscription.id))
+
+
+def invalidate_subscription(sub_id):
+    """Removes a subscription from Redis and from the local tier of every process."""
+    redis_client.delete(f"subscription:{sub_id}")
+    local_subscription_cache.delete(str(sub_id))
+    redis_client.publish(SUBSCRIPTION_INVALIDATION_CHANNEL, str(sub_id))
+
+
+async def get_subscription_details_async(sub_id, async_redis, async_session_factory):
+    """
+    asyncio counterpart of get_subscription_details for the ASGI ingestion server:
+    the same local tier and counters, then an async Redis GET, then an async DB query.
+    """
+    from sqlalchemy import select
+    from .models import Subscription
+
+    _ensure_invalidation_listener()
+    subscription = local_subscription_cache.get(str(sub_id))
+    if subscription is not None:
+        _count('local', 'hits')
+        return subscription
+    _count('local', 'misses')
+
+    cache_key = f"subscription:{sub_id}"
+    sub_details = await async_redis.get(cache_key)
+    if sub_details:
+        try:
+            subscription = json.loads(sub_details)
+            _count('redis', 'hits')
+            local_subscription_cache.set(str(sub_id), subscription)
+            return subscription
+        except json.JSONDecodeError:
+            print(f"Cache decode error for subscription {sub_id}, fetching from DB.")
+            await async_redis.delete(cache_key)
+    _count('redis', 'misses')
+
+    async with async_session_factory() as session:
+        db_subscription = (await session.execute(select(Subscription).filter_by(id=sub_id))).scalars().first()
+    if not db_subscription:
+        return None
+
+    subscription = subscription_cache_data(db_subscription)
+    local_subscription_cache.set(str(sub_id), subscription)
+    await async_redis.setex(cache_key, Config.CACHE_EXPIRY_SECONDS, json.dumps(subscription))
+    print(f"Fetched subscription {sub_id} from DB and cached.")
+    return subscription
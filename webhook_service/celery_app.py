@@ -6,7 +6,7 @@ celery_app = Celery(
     'webhook_service_tasks',
     broker=Config.CELERY_BROKER_URL,
     backend=Config.CELERY_RESULT_BACKEND,
-    include=['webhook_service.tasks']
+    include=['webhook_service.tasks', 'webhook_service.control']
 )
 
 celery_app.conf.update(
@@ -17,11 +17,17 @@ celery_app.conf.update(
     enable_utc=Config.CELERY_ENABLE_UTC,
     task_ignore_result=Config.CELERY_TASK_IGNORE_RESULT,
     task_track_started=Config.CELERY_TASK_TRACK_STARTED,
+    worker_prefetch_multiplier=Config.CELERY_WORKER_PREFETCH_MULTIPLIER,
     beat_schedule={
         'cleanup-old-logs': {
             'task': 'webhook_service.tasks.cleanup_old_logs',
             'schedule': crontab(minute='0', hour='*/6'),
             'args': (),
         },
+        'create-partitions': {
+            'task': 'webhook_service.tasks.create_partitions',
+            'schedule': crontab(minute='30'),
+            'args': (),
+        },
     },
 )
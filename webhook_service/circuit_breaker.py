@@ -0,0 +1,142 @@
+"""
+Per-host circuit breaker shared by all workers through Redis.
+
+Each target host (scheme://host:port) has a hash circuit:<host> with its state:
+- closed: deliveries go through; consecutive failures (connection errors, timeouts
+  and 5xx responses) are counted, any other response resets the count.
+- open: after CIRCUIT_BREAKER_FAILURE_THRESHOLD consecutive failures. Deliveries to
+  the host are deferred without an HTTP call until CIRCUIT_BREAKER_COOLDOWN_SECONDS
+  have passed.
+- half_open: after the cooldown a single delivery is let through as a probe (for at
+  most CIRCUIT_BREAKER_PROBE_TIMEOUT_SECONDS); its success closes the circuit, its
+  failure opens it for another cooldown.
+State transitions are Lua scripts, so concurrent workers never both get the probe.
+"""
+import time
+from urllib.parse import urlsplit
+
+from .cache import redis_client
+from .config import Config
+
+CIRCUIT_KEY_PREFIX = "circuit:"
+
+# KEYS[1] circuit hash; ARGV: now, cooldown, probe timeout.
+# Returns 0 if the request may go out, otherwise the seconds to wait (rounded up).
+ALLOW_SCRIPT = """
+local state = redis.call('HGET', KEYS[1], 'state')
+if not state or state == 'closed' then
+    return 0
+end
+local now = tonumber(ARGV[1])
+if state == 'open' then
+    local reopen_at = tonumber(redis.call('HGET', KEYS[1], 'opened_at')) + tonumber(ARGV[2])
+    if now < reopen_at then
+        return math.ceil(reopen_at - now)
+    end
+end
+local probe_until = tonumber(redis.call('HGET', KEYS[1], 'probe_until') or '0')
+if state == 'half_open' and now < probe_until then
+    return math.ceil(probe_until - now)
+end
+redis.call('HSET', KEYS[1], 'state', 'half_open', 'probe_until', now + tonumber(ARGV[3]))
+return 0
+"""
+
+# KEYS[1] circuit hash; ARGV: now, 1 for a failure / 0 for a success, threshold, key TTL.
+# Returns the new state.
+RECORD_SCRIPT = """
+if ARGV[2] == '0' then
+    redis.call('DEL', KEYS[1])
+    return 'closed'
+end
+local state = redis.call('HGET', KEYS[1], 'state') or 'closed'
+local failures = redis.call('HINCRBY', KEYS[1], 'failures', 1)
+if state == 'half_open' or (state == 'closed' and failures >= tonumber(ARGV[3])) then
+    state = 'open'
+    redis.call('HSET', KEYS[1], 'state', state, 'opened_at', ARGV[1])
+    redis.call('HDEL', KEYS[1], 'probe_until')
+elseif state == 'closed' then
+    redis.call('HSET', KEYS[1], 'state', state)
+end
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[4]))
+return state
+"""
+
+_allow_script = redis_client.register_script(ALLOW_SCRIPT)
+_record_script = redis_client.register_script(RECORD_SCRIPT)
+
+
+def host_key(url):
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}".lower()
+
+
+def is_failure(http_status):
+    """Whether an attempt outcome says the receiver is unavailable (no response, or a 5xx)."""
+    return http_status is None or http_status >= 500
+
+
+def allow_request(url):
+    """
+    Returns None if a delivery to url may be made now, otherwise the number of
+    seconds to defer it by. Fails open when Redis is unreachable.
+    """
+    if not Config.CIRCUIT_BREAKER_ENABLED:
+        return None
+    try:
+        wait_seconds = _allow_script(keys=[CIRCUIT_KEY_PREFIX + host_key(url)],
+                                     args=[time.time(), Config.CIRCUIT_BREAKER_COOLDOWN_SECONDS,
+                                           Config.CIRCUIT_BREAKER_PROBE_TIMEOUT_SECONDS])
+    except Exception as e:
+        print(f"Circuit breaker check failed for {host_key(url)}: {e}")
+        return None
+    return int(wait_seconds) or None # type: ignore[reportArgumentType]
+
+
+def record_result(url, http_status):
+    """Counts a delivery outcome towards the host's circuit."""
+    if not Config.CIRCUIT_BREAKER_ENABLED:
+        return
+    host = host_key(url)
+    try:
+        state = _record_script(keys=[CIRCUIT_KEY_PREFIX + host],
+                               args=[time.time(), 1 if is_failure(http_status) else 0,
+                                     Config.CIRCUIT_BREAKER_FAILURE_THRESHOLD, Config.CIRCUIT_BREAKER_STATE_TTL_SECONDS])
+    except Exception as e:
+        print(f"Circuit breaker update failed for {host}: {e}")
+        return
+    if state == 'open':
+        print(f"Circuit for {host} is open; deferring deliveries for {Config.CIRCUIT_BREAKER_COOLDOWN_SECONDS}s.")
+
+
+def _circuit_state(host, fields):
+    state = {
+        'host': host,
+        'state': fields.get('state', 'closed'),
+        'consecutive_failures': int(fields.get('failures', 0)),
+    }
+    if fields.get('opened_at'):
+        state['opened_at'] = float(fields['opened_at'])
+        state['reopens_at'] = float(fields['opened_at']) + Config.CIRCUIT_BREAKER_COOLDOWN_SECONDS
+    if fields.get('probe_until'):
+        state['probe_until'] = float(fields['probe_until'])
+    return state
+
+
+def get_circuit(url_or_host):
+    """State of one host's circuit (closed when nothing is recorded)."""
+    host = host_key(url_or_host) if '://' in url_or_host else url_or_host.lower()
+    return _circuit_state(host, redis_client.hgetall(CIRCUIT_KEY_PREFIX + host))
+
+
+def list_circuits():
+    """States of all hosts with recent failures, open and half-open circuits first."""
+    keys = list(redis_client.scan_iter(match=CIRCUIT_KEY_PREFIX + '*', count=500))
+    pipe = redis_client.pipeline(transaction=False)
+    for key in keys:
+        pipe.hgetall(key)
+    circuits = [
+        _circuit_state(key[len(CIRCUIT_KEY_PREFIX):], fields)
+        for key, fields in zip(keys, pipe.execute()) if fields
+    ]
+    return sorted(circuits, key=lambda circuit: (circuit['state'] == 'closed', circuit['host']))
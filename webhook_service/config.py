@@ -15,6 +15,19 @@ class Config:
         "DATABASE_URL",
         f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
     )
+    # Read replicas for the status and listing endpoints (comma-separated URLs); empty reads from the primary
+    DATABASE_REPLICA_URLS = [url.strip() for url in os.environ.get("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+    REPLICA_MAX_LAG_SECONDS = float(os.environ.get("REPLICA_MAX_LAG_SECONDS", "5")) # A replica further behind is skipped
+    REPLICA_CHECK_INTERVAL_SECONDS = float(os.environ.get("REPLICA_CHECK_INTERVAL_SECONDS", "5")) # How often each process re-checks a replica's lag
+    REPLICA_CONNECT_TIMEOUT_SECONDS = int(os.environ.get("REPLICA_CONNECT_TIMEOUT_SECONDS", "2")) # An unreachable replica falls back to the primary this fast
+    # Connection pool of each process (rebuilt in forked children, e.g. gunicorn workers)
+    DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "5")) # Connections kept open; cover the process's concurrent DB users (threads/greenlets)
+    DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", "10")) # Extra connections opened under load and closed when returned
+    DB_POOL_TIMEOUT_SECONDS = float(os.environ.get("DB_POOL_TIMEOUT_SECONDS", "30")) # Longest wait for a free connection
+    DB_POOL_RECYCLE_SECONDS = int(os.environ.get("DB_POOL_RECYCLE_SECONDS", "1800")) # Older connections are replaced at checkout; -1 disables
+    DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "true").lower() == "true" # Test each connection at checkout (a round trip per checkout)
+    # Connect through PgBouncer in transaction pooling mode: no pool in the process, no named prepared statements
+    DB_PGBOUNCER = os.environ.get("DB_PGBOUNCER", "false").lower() == "true"
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     DEBUG = True
     # RabbitMQ Broker Configuration
@@ -47,22 +60,130 @@ class Config:
     CELERY_ACCEPT_CONTENT = ['json']
     CELERY_TIMEZONE = 'UTC'
     CELERY_ENABLE_UTC = True
+    # Keep the fair order of the outbox relay: workers should not hoard queued messages
+    CELERY_WORKER_PREFETCH_MULTIPLIER = int(os.environ.get("CELERY_WORKER_PREFETCH_MULTIPLIER", "1"))
 
     # Webhook Delivery Settings
     DELIVERY_TIMEOUT_SECONDS = int(os.environ.get("DELIVERY_TIMEOUT_SECONDS", "10"))
+    HTTP_POOL_MAXSIZE = int(os.environ.get("HTTP_POOL_MAXSIZE", "10")) # Pooled keep-alive connections per target host
+    HTTP_POOL_MAX_HOSTS = int(os.environ.get("HTTP_POOL_MAX_HOSTS", "1000")) # Host sessions kept per worker process (LRU)
+    HTTP_KEEPALIVE = os.environ.get("HTTP_KEEPALIVE", "true").lower() == "true"
+    HTTP_RESPONSE_READ_LIMIT_BYTES = int(os.environ.get("HTTP_RESPONSE_READ_LIMIT_BYTES", "65536")) # Larger bodies are cut off and their connection closed
+    DNS_CACHE_ENABLED = os.environ.get("DNS_CACHE_ENABLED", "true").lower() == "true" # Process-wide DNS cache for target hosts
+    DNS_CACHE_MAX_ENTRIES = int(os.environ.get("DNS_CACHE_MAX_ENTRIES", "10000"))
+    DNS_CACHE_MIN_TTL_SECONDS = int(os.environ.get("DNS_CACHE_MIN_TTL_SECONDS", "5")) # Floor on record TTLs (and TTL of /etc/hosts answers)
+    DNS_CACHE_MAX_TTL_SECONDS = int(os.environ.get("DNS_CACHE_MAX_TTL_SECONDS", "300")) # Cap on record TTLs
+    DNS_CACHE_NEGATIVE_TTL_SECONDS = int(os.environ.get("DNS_CACHE_NEGATIVE_TTL_SECONDS", "60")) # Cap on caching NXDOMAIN
     MAX_RETRIES = int(os.environ.get("MAX_RETRIES", "5"))
+
+    # Adaptive Timeout Settings (timeouts derived from each target host's latency)
+    ADAPTIVE_TIMEOUTS_ENABLED = os.environ.get("ADAPTIVE_TIMEOUTS_ENABLED", "true").lower() == "true"
+    ADAPTIVE_TIMEOUT_PERCENTILE = float(os.environ.get("ADAPTIVE_TIMEOUT_PERCENTILE", "0.99")) # Latency percentile the timeouts are based on
+    ADAPTIVE_TIMEOUT_MULTIPLIER = float(os.environ.get("ADAPTIVE_TIMEOUT_MULTIPLIER", "3.0")) # Headroom over that percentile
+    ADAPTIVE_TIMEOUT_MIN_SAMPLES = int(os.environ.get("ADAPTIVE_TIMEOUT_MIN_SAMPLES", "20")) # Below this DELIVERY_TIMEOUT_SECONDS is used
+    ADAPTIVE_CONNECT_TIMEOUT_FLOOR_SECONDS = float(os.environ.get("ADAPTIVE_CONNECT_TIMEOUT_FLOOR_SECONDS", "1"))
+    ADAPTIVE_CONNECT_TIMEOUT_CEILING_SECONDS = float(os.environ.get("ADAPTIVE_CONNECT_TIMEOUT_CEILING_SECONDS", str(DELIVERY_TIMEOUT_SECONDS)))
+    ADAPTIVE_READ_TIMEOUT_FLOOR_SECONDS = float(os.environ.get("ADAPTIVE_READ_TIMEOUT_FLOOR_SECONDS", "2"))
+    # Raising the read ceiling above DELIVERY_TIMEOUT_SECONDS also needs a longer CIRCUIT_BREAKER_PROBE_TIMEOUT_SECONDS
+    ADAPTIVE_READ_TIMEOUT_CEILING_SECONDS = float(os.environ.get("ADAPTIVE_READ_TIMEOUT_CEILING_SECONDS", str(DELIVERY_TIMEOUT_SECONDS)))
+    LATENCY_WINDOW_SECONDS = int(os.environ.get("LATENCY_WINDOW_SECONDS", "60")) # Width of one latency histogram in Redis
+    LATENCY_WINDOWS = int(os.environ.get("LATENCY_WINDOWS", "10")) # Histograms merged into the rolling sketch (10 minutes)
+    LATENCY_SKETCH_CACHE_SECONDS = int(os.environ.get("LATENCY_SKETCH_CACHE_SECONDS", "5")) # In-process reuse of a host's sketch
+
     # Exponential Backoff: base * (factor ^ (attempts - 1))
     RETRY_BASE_DELAY_SECONDS = int(os.environ.get("RETRY_BASE_DELAY_SECONDS", "10")) # First retry after 10s
     RETRY_FACTOR = int(os.environ.get("RETRY_FACTOR", "3")) # Delays: 10s, 30s, 90s, 270s, 810s (~13.5m)
     MAX_RETRY_DELAY_SECONDS = int(os.environ.get("MAX_RETRY_DELAY_SECONDS", "900")) # Cap at 15 minutes
 
+    # Rate Limit Settings (per subscription limits are set on the subscription)
+    HOST_RATE_LIMIT_PER_SECOND = float(os.environ.get("HOST_RATE_LIMIT_PER_SECOND", "0")) # Deliveries per second to any one target host; 0 disables
+    HOST_RATE_LIMIT_BURST = int(os.environ.get("HOST_RATE_LIMIT_BURST", "0")) # Host bucket size; 0 means one second's worth
+    RATE_LIMIT_RESERVATION_GRACE_SECONDS = int(os.environ.get("RATE_LIMIT_RESERVATION_GRACE_SECONDS", "300")) # A deferred task's reserved token is kept this long past its release time
+
+    # Circuit Breaker Settings (per target host, shared through Redis)
+    CIRCUIT_BREAKER_ENABLED = os.environ.get("CIRCUIT_BREAKER_ENABLED", "true").lower() == "true"
+    CIRCUIT_BREAKER_FAILURE_THRESHOLD = int(os.environ.get("CIRCUIT_BREAKER_FAILURE_THRESHOLD", "5")) # Consecutive failures that open a circuit
+    CIRCUIT_BREAKER_COOLDOWN_SECONDS = int(os.environ.get("CIRCUIT_BREAKER_COOLDOWN_SECONDS", "30")) # Open time before a probe is let through
+    CIRCUIT_BREAKER_PROBE_TIMEOUT_SECONDS = int(os.environ.get("CIRCUIT_BREAKER_PROBE_TIMEOUT_SECONDS", str(2 * DELIVERY_TIMEOUT_SECONDS))) # Probe lease
+    CIRCUIT_BREAKER_STATE_TTL_SECONDS = int(os.environ.get("CIRCUIT_BREAKER_STATE_TTL_SECONDS", "3600")) # Idle circuit state is forgotten after this
+
+    # Delivery Attempt Log Settings (write-behind from the workers)
+    ATTEMPT_LOG_BUFFERED = os.environ.get("ATTEMPT_LOG_BUFFERED", "true").lower() == "true"
+    ATTEMPT_LOG_BATCH_SIZE = int(os.environ.get("ATTEMPT_LOG_BATCH_SIZE", "500")) # Rows per multi-row INSERT
+    ATTEMPT_LOG_FLUSH_INTERVAL_MS = int(os.environ.get("ATTEMPT_LOG_FLUSH_INTERVAL_MS", "200")) # Longest time a row waits in the queue
+    ATTEMPT_LOG_QUEUE_SIZE = int(os.environ.get("ATTEMPT_LOG_QUEUE_SIZE", "10000")) # Bound on queued rows per process
+
+    # Retry Scheduler Settings
+    RETRY_SCHEDULER_BATCH_SIZE = int(os.environ.get("RETRY_SCHEDULER_BATCH_SIZE", "500")) # Due retries dispatched per transaction
+    RETRY_SCHEDULER_POLL_INTERVAL_SECONDS = float(os.environ.get("RETRY_SCHEDULER_POLL_INTERVAL_SECONDS", "1.0")) # Longest sleep between checks
+    WORKER_LEASE_SECONDS = int(os.environ.get("WORKER_LEASE_SECONDS", "300")) # A task claimed by a worker is re-queued after this if never booked; keep above linger plus timeouts
+
+    # Delivery Engine Settings
+    DELIVERY_ENGINE = os.environ.get("DELIVERY_ENGINE", "celery") # 'celery' (outbox + workers) or 'asyncio' (webhook_service.delivery_engine)
+    ENGINE_MAX_IN_FLIGHT = int(os.environ.get("ENGINE_MAX_IN_FLIGHT", "500")) # Deliveries in flight per engine process
+    ENGINE_PER_HOST_CONCURRENCY = int(os.environ.get("ENGINE_PER_HOST_CONCURRENCY", "20")) # Concurrent connections per target host
+    ENGINE_CLAIM_BATCH_SIZE = int(os.environ.get("ENGINE_CLAIM_BATCH_SIZE", "200")) # Due tasks claimed per transaction
+    ENGINE_POLL_INTERVAL_SECONDS = float(os.environ.get("ENGINE_POLL_INTERVAL_SECONDS", "0.5")) # Sleep when nothing is due
+    ENGINE_LEASE_SECONDS = int(os.environ.get("ENGINE_LEASE_SECONDS", "300")) # A claimed task is re-claimed after this if never booked
+    ENGINE_DB_THREADS = int(os.environ.get("ENGINE_DB_THREADS", "8")) # Threads for DB work; keep below the SQLAlchemy pool size
+
+    # Delivery Batching Settings (per subscription: batch_max_size, batch_linger_ms)
+    DELIVERY_BATCH_MAX_SIZE_LIMIT = int(os.environ.get("DELIVERY_BATCH_MAX_SIZE_LIMIT", "500")) # Upper bound accepted for batch_max_size
+    DELIVERY_BATCH_MAX_LINGER_MS = int(os.environ.get("DELIVERY_BATCH_MAX_LINGER_MS", "5000")) # Upper bound accepted for batch_linger_ms
+
+    # Batch Ingestion Settings
+    BATCH_INGEST_MAX_ITEMS = int(os.environ.get("BATCH_INGEST_MAX_ITEMS", "1000")) # Max items in one JSON batch request
+    BATCH_INGEST_CHUNK_SIZE = int(os.environ.get("BATCH_INGEST_CHUNK_SIZE", "500")) # NDJSON items per INSERT/publish
+
+    # Group Commit Settings (coalesce concurrent single ingests of one process into one INSERT + COMMIT)
+    INGEST_GROUP_COMMIT_ENABLED = os.environ.get("INGEST_GROUP_COMMIT_ENABLED", "false").lower() == "true"
+    INGEST_GROUP_COMMIT_MAX_ROWS = int(os.environ.get("INGEST_GROUP_COMMIT_MAX_ROWS", "200")) # Flush when this many rows are waiting
+    INGEST_GROUP_COMMIT_MAX_WAIT_MS = int(os.environ.get("INGEST_GROUP_COMMIT_MAX_WAIT_MS", "5")) # ...or when the oldest row waited this long
+    INGEST_GROUP_COMMIT_TIMEOUT_MS = int(os.environ.get("INGEST_GROUP_COMMIT_TIMEOUT_MS", "5000")) # Longest wait of a request for its group's commit
+
+    # ASGI Ingestion Server Settings (asyncpg pool per uvicorn worker)
+    ASGI_DB_POOL_SIZE = int(os.environ.get("ASGI_DB_POOL_SIZE", "20"))
+    ASGI_DB_MAX_OVERFLOW = int(os.environ.get("ASGI_DB_MAX_OVERFLOW", "20"))
+
+    # Idempotency Settings
+    IDEMPOTENCY_KEY_HEADER = os.environ.get("IDEMPOTENCY_KEY_HEADER", "Idempotency-Key")
+    IDEMPOTENCY_KEY_JSON_PATH = os.environ.get("IDEMPOTENCY_KEY_JSON_PATH", "") # Dotted path in the payload, e.g. "data.event_id"
+    IDEMPOTENCY_TTL_SECONDS = int(os.environ.get("IDEMPOTENCY_TTL_SECONDS", "86400")) # Redis duplicate window
+
+    # Large Payload Storage Settings
+    PAYLOAD_OFFLOAD_THRESHOLD_BYTES = int(os.environ.get("PAYLOAD_OFFLOAD_THRESHOLD_BYTES", "65536")) # 0 keeps every payload inline
+    PAYLOAD_COMPRESSION = os.environ.get("PAYLOAD_COMPRESSION", "gzip") # 'gzip' or 'zstd' (needs the zstandard package)
+    PAYLOAD_GZIP_LEVEL = int(os.environ.get("PAYLOAD_GZIP_LEVEL", "6"))
+    PAYLOAD_STORAGE = os.environ.get("PAYLOAD_STORAGE", "db") # 'db' (delivery_payloads table) or 'fs' (PAYLOAD_BLOB_DIR)
+    PAYLOAD_BLOB_DIR = os.environ.get("PAYLOAD_BLOB_DIR", "/app/payload_blobs") # Must be shared by the API and the workers
+    DELIVERY_COMPRESSION_MIN_BYTES = int(os.environ.get("DELIVERY_COMPRESSION_MIN_BYTES", "1024")) # Default threshold for subscriptions with compression
+    DELIVERY_COMPRESSION_CACHE_TTL_SECONDS = int(os.environ.get("DELIVERY_COMPRESSION_CACHE_TTL_SECONDS", "3600")) # Compressed bodies kept for retries
+
+    # Outbox Relay Settings
+    OUTBOX_RELAY_BATCH_SIZE = int(os.environ.get("OUTBOX_RELAY_BATCH_SIZE", "500")) # Outbox rows published per relay transaction
+    OUTBOX_RELAY_POLL_INTERVAL_SECONDS = float(os.environ.get("OUTBOX_RELAY_POLL_INTERVAL_SECONDS", "0.2")) # Sleep when the outbox is drained
+    OUTBOX_RELAY_QUANTUM = int(os.environ.get("OUTBOX_RELAY_QUANTUM", "10")) # Rows per round per unit of subscription weight
+    OUTBOX_RELAY_MAX_BROKER_DEPTH = int(os.environ.get("OUTBOX_RELAY_MAX_BROKER_DEPTH", "2000")) # Ready messages kept in RabbitMQ; 0 = unbounded
+
     # Log Retention Settings
     LOG_RETENTION_HOURS = int(os.environ.get("LOG_RETENTION_HOURS", "72")) # 72 hours
+    # Delivery tasks (with their payloads and idempotency keys); keep it at least LOG_RETENTION_HOURS
+    TASK_RETENTION_HOURS = int(os.environ.get("TASK_RETENTION_HOURS", str(LOG_RETENTION_HOURS)))
+    PARTITION_PREMAKE_DAYS = int(os.environ.get("PARTITION_PREMAKE_DAYS", "7")) # Daily partitions created ahead of time
+    PARTITION_LOCK_TIMEOUT_MS = int(os.environ.get("PARTITION_LOCK_TIMEOUT_MS", "5000")) # Partition DDL gives up (and retries next run) rather than queue up traffic
 
     # Caching Settings
     CACHE_EXPIRY_SECONDS = int(os.environ.get("CACHE_EXPIRY_SECONDS", "3600")) # Cache subscriptions for 1 hour
+    LOCAL_CACHE_MAX_ENTRIES = int(os.environ.get("LOCAL_CACHE_MAX_ENTRIES", "10000")) # In-process subscription cache size per worker
+    LOCAL_CACHE_TTL_SECONDS = int(os.environ.get("LOCAL_CACHE_TTL_SECONDS", "60")) # Upper bound on staleness if an invalidation is missed
+    TASK_STATUS_CACHE_TTL_SECONDS = int(os.environ.get("TASK_STATUS_CACHE_TTL_SECONDS", "3600")) # Status responses of succeeded/failed tasks kept in Redis
     WEBHOOK_SECRET_HEADER = os.environ.get("WEBHOOK_SECRET_HEADER", "X-Hub-Signature-256")
     WEBHOOK_EVENT_TYPE_HEADER = os.environ.get("WEBHOOK_EVENT_TYPE_HEADER", "X-Event-Type")
 
+    # Listing Settings
+    LIST_PAGE_SIZE = int(os.environ.get("LIST_PAGE_SIZE", "100")) # Rows per page when ?limit= is not given
+    LIST_MAX_PAGE_SIZE = int(os.environ.get("LIST_MAX_PAGE_SIZE", "1000"))
+    LIST_STREAM_BATCH_SIZE = int(os.environ.get("LIST_STREAM_BATCH_SIZE", "1000")) # Rows fetched per round trip of an NDJSON listing's server-side cursor
+
     # Flask Settings
     SECRET_KEY = os.environ.get("SECRET_KEY", "super-secret-dev-key") # Required for Flask sessions/security
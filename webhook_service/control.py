@@ -0,0 +1,30 @@
+"""
+Celery remote control commands exposing per-process statistics of the workers, e.g.
+
+    celery -A webhook_service.celery_app inspect subscription_cache_stats
+    celery -A webhook_service.celery_app inspect dns_cache_stats
+    celery -A webhook_service.celery_app inspect db_pool_stats
+"""
+from celery.worker.control import inspect_command
+
+from .cache import cache_stats
+from .dns_cache import dns_cache
+from .database import engine, pool_stats
+
+
+@inspect_command()
+def subscription_cache_stats(state):
+    """Hit/miss counters of the subscription cache tiers in this worker."""
+    return cache_stats()
+
+
+@inspect_command()
+def dns_cache_stats(state):
+    """Hit/miss counters and entries of the delivery DNS cache in this worker."""
+    return dns_cache.stats()
+
+
+@inspect_command()
+def db_pool_stats(state):
+    """Connections in use/idle/overflow and checkout wait times of the database pool in this worker."""
+    return pool_stats(engine)
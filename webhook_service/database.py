@@ -1,19 +1,199 @@
-from sqlalchemy import create_engine
+import os
+import time
+import bisect
+import itertools
+import threading
+from sqlalchemy import create_engine, event, text, exc
+from sqlalchemy.pool import QueuePool, NullPool
 from sqlalchemy.orm import scoped_session, sessionmaker, declarative_base
 from .config import Config
 
+POOL_WAIT_BUCKETS_MS = [1, 5, 10, 50, 100, 500, 1000, 5000] # Upper bounds of the checkout wait histogram
+
+
+class InstrumentedQueuePool(QueuePool):
+    """A QueuePool that records how long each checkout waited for a connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._wait_lock = threading.Lock()
+        self._checkouts = 0
+        self._timeouts = 0
+        self._wait_total_ms = 0.0
+        self._wait_max_ms = 0.0
+        self._wait_histogram = [0] * (len(POOL_WAIT_BUCKETS_MS) + 1)
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self._record_wait((time.perf_counter() - start) * 1000, timed_out=True)
+            raise
+        self._record_wait((time.perf_counter() - start) * 1000)
+        return connection
+
+    def _record_wait(self, wait_ms, timed_out=False):
+        with self._wait_lock:
+            self._checkouts += 1
+            self._timeouts += timed_out
+            self._wait_total_ms += wait_ms
+            self._wait_max_ms = max(self._wait_max_ms, wait_ms)
+            self._wait_histogram[bisect.bisect_left(POOL_WAIT_BUCKETS_MS, wait_ms)] += 1
+
+    def wait_stats(self):
+        with self._wait_lock:
+            return {
+                'checkouts': self._checkouts,
+                'checkout_timeouts': self._timeouts,
+                'checkout_wait_avg_ms': round(self._wait_total_ms / self._checkouts, 3) if self._checkouts else None,
+                'checkout_wait_max_ms': round(self._wait_max_ms, 3),
+                # Checkouts by wait, keyed by bucket upper bound in ms
+                'checkout_wait_histogram': dict(zip([str(bound) for bound in POOL_WAIT_BUCKETS_MS] + ['inf'], self._wait_histogram)),
+            }
+
+
+def make_engine(url, **kwargs):
+    """An engine with the process's pool settings, or without a pool of its own behind PgBouncer."""
+    if Config.DB_PGBOUNCER:
+        # PgBouncer pools server connections; psycopg2 uses no named prepared statements
+        return create_engine(url, poolclass=NullPool, **kwargs)
+    return create_engine(
+        url,
+        poolclass=InstrumentedQueuePool,
+        pool_size=Config.DB_POOL_SIZE,
+        max_overflow=Config.DB_MAX_OVERFLOW,
+        pool_timeout=Config.DB_POOL_TIMEOUT_SECONDS,
+        pool_recycle=Config.DB_POOL_RECYCLE_SECONDS,
+        pool_pre_ping=Config.DB_POOL_PRE_PING,
+        **kwargs
+    )
+
+
+def pool_stats(engine):
+    """Connections in use, idle and in overflow of an engine's pool in this process, with its checkout wait times."""
+    pool = engine.pool
+    stats = {'pid': os.getpid(), 'pool': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            'size': pool.size(),
+            'max_overflow': pool._max_overflow,
+            'in_use': pool.checkedout(),
+            'idle': pool.checkedin(),
+            'overflow': max(pool.overflow(), 0), # overflow() counts up from -size as connections are opened
+            'open': pool.size() + pool.overflow(),
+        })
+    if isinstance(pool, InstrumentedQueuePool):
+        stats.update(pool.wait_stats())
+    return stats
+
+
 # Database engine
-engine = create_engine(Config.SQLALCHEMY_DATABASE_URI, pool_pre_ping=True)
+engine = make_engine(Config.SQLALCHEMY_DATABASE_URI)
 db_session = scoped_session(sessionmaker(autocommit=False, autoflush=False, bind=engine))
 
 Base = declarative_base()
 Base.query = db_session.query_property()
 
+# Seconds the replica is behind; 0 when it is streaming and has replayed everything it received (an idle
+# primary is not lag). A replica whose WAL receiver is down stops receiving, so its receive and replay
+# positions stay equal: it is measured by its last replayed transaction instead, and is NULL (unknown)
+# if it has replayed none. The receiver's status is only visible to members of pg_read_all_stats.
+REPLICATION_LAG_SQL = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn()
+             AND EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming') THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+""")
+
+
+class Replica:
+    """A read replica and whether it can serve reads, re-checked at most every REPLICA_CHECK_INTERVAL_SECONDS."""
+
+    def __init__(self, url):
+        self.engine = make_engine(url, connect_args={'connect_timeout': Config.REPLICA_CONNECT_TIMEOUT_SECONDS})
+        self.usable = False
+        self.lag_seconds = None
+        self.checked_at = None
+        self._lock = threading.Lock()
+        event.listen(self.engine, 'handle_error', self._on_error)
+
+    def is_usable(self):
+        if self._check_due():
+            with self._lock:
+                if self._check_due():
+                    self._check()
+        return self.usable
+
+    def _check_due(self):
+        return self.checked_at is None or time.monotonic() - self.checked_at >= Config.REPLICA_CHECK_INTERVAL_SECONDS
+
+    def _check(self):
+        was_usable = self.usable
+        try:
+            with self.engine.connect() as connection:
+                lag_seconds = connection.execute(REPLICATION_LAG_SQL).scalar()
+            self.lag_seconds = float(lag_seconds) if lag_seconds is not None else None # type: ignore[reportArgumentType]
+            self.usable = self.lag_seconds is not None and self.lag_seconds <= Config.REPLICA_MAX_LAG_SECONDS
+            if was_usable and not self.usable:
+                behind = f"{self.lag_seconds:.1f}s behind" if self.lag_seconds is not None else "not streaming"
+                print(f"Read replica {self.engine.url.host} is {behind}, reading from the primary.")
+        except Exception as e:
+            self.usable = False
+            self.lag_seconds = None
+            if was_usable or self.checked_at is None:
+                print(f"Read replica {self.engine.url.host} unavailable, reading from the primary: {e}")
+        self.checked_at = time.monotonic()
+
+    def _on_error(self, context):
+        # A replica that drops connections between checks is skipped until the next check
+        if context.is_disconnect:
+            self.usable = False
+            self.checked_at = time.monotonic()
+
+    def status(self):
+        return {'url': self.engine.url.render_as_string(hide_password=True), 'usable': self.usable, 'lag_seconds': self.lag_seconds}
+
+
+replicas = [Replica(url) for url in Config.DATABASE_REPLICA_URLS]
+_replica_turns = itertools.count()
+
+
+def read_engine():
+    """A usable replica's engine (round robin), or the primary's if none is within REPLICA_MAX_LAG_SECONDS."""
+    if replicas:
+        start = next(_replica_turns)
+        for i in range(len(replicas)):
+            replica = replicas[(start + i) % len(replicas)]
+            if replica.is_usable():
+                return replica.engine
+    return engine
+
+
+def _dispose_pools_after_fork():
+    """
+    Gives a forked child (gunicorn worker, celery prefork child) fresh pools. The
+    parent's connections are left open for the parent instead of being shared.
+    """
+    for pooled_engine in [engine] + [replica.engine for replica in replicas]:
+        pooled_engine.dispose(close=False)
+
+
+os.register_at_fork(after_in_child=_dispose_pools_after_fork)
+
+
+# Sessions of read-only endpoints; each picks its engine when it is created
+_read_session_factory = sessionmaker(autocommit=False, autoflush=False)
+db_read_session = scoped_session(lambda: _read_session_factory(bind=read_engine()))
+
 def init_db():
     """Creates database tables based on models."""
     import webhook_service.models
     Base.metadata.create_all(bind=engine)
 
 def shutdown_session(exception=None):
-    """Removes the session, typically called at the end of a request or task."""
+    """Removes the sessions, typically called at the end of a request or task."""
     db_session.remove()
+    db_read_session.remove()
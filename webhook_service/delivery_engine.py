@@ -0,0 +1,350 @@
+"""
+asyncio delivery engine, an alternative to the Celery worker (DELIVERY_ENGINE='asyncio').
+
+Instead of one broker message and one worker slot per attempt, the engine claims
+batches of due tasks straight from delivery_tasks (pending ones, retrying ones whose
+next_attempt_at has passed, and processing ones whose lease ran out) with
+FOR UPDATE SKIP LOCKED, so several engines can run side by side. Claimed tasks are
+leased for ENGINE_LEASE_SECONDS by moving next_attempt_at ahead; a crashed engine's
+tasks are picked up again once their lease expires.
+
+Deliveries run concurrently over one aiohttp session: at most ENGINE_MAX_IN_FLIGHT
+tasks are claimed at a time and at most ENGINE_PER_HOST_CONCURRENCY deliveries are
+sent to any one receiver host at once. Once a host has that many tasks claimed, the
+engine stops claiming tasks of the subscriptions it is delivering to that host, so a
+slow receiver's backlog cannot fill the in-flight budget and starve the others. A
+claimed task still waiting for a slot of its host keeps extending its lease. Outcomes, retries and DeliveryAttempt rows are booked with
+the same helpers as process_delivery; DB work runs on a small thread pool. The
+engine does not batch: tasks of subscriptions with batch_max_size > 1 are delivered
+one per POST.
+
+Run with: python -m webhook_service.delivery_engine
+"""
+import asyncio
+import random
+import contextlib
+import socket
+import ipaddress
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+import aiohttp
+from aiohttp.abc import AbstractResolver
+from sqlalchemy import select, update, or_, and_
+
+from .database import db_session
+from .models import DeliveryTask
+from .config import Config
+from .cache import get_subscriptions_details
+from .tasks import build_request_body, resolve_target_url, record_delivery_outcome, describe_request_error, defer_task, \
+    keep_compressed_body_for_retry
+from .dns_cache import dns_cache
+from . import circuit_breaker, rate_limit, latency
+
+
+def claim_deliveries(limit, skip_subscription_ids=()):
+    """
+    Claims up to limit due tasks, other than those of skip_subscription_ids, and
+    prepares them for delivery in one transaction.
+    Tasks whose subscription is gone are failed on the spot. Returns a list of
+    (task_id, subscription_id, subscription, target_url, body, headers, error) tuples;
+    error is set when the body could not be built, in which case the attempt is booked
+    as failed without a POST.
+    """
+    session = db_session()
+    try:
+        now = datetime.now(timezone.utc)
+        due = or_(
+            DeliveryTask.status == 'pending',
+            and_(DeliveryTask.status.in_(['retrying', 'processing']), DeliveryTask.next_attempt_at <= now)
+        )
+        due_ids = select(DeliveryTask.id).where(due)
+        if skip_subscription_ids:
+            due_ids = due_ids.where(DeliveryTask.subscription_id.notin_(skip_subscription_ids))
+        due_ids = due_ids\
+            .order_by(DeliveryTask.created_at)\
+            .limit(limit)\
+            .with_for_update(skip_locked=True)
+        claimed_ids = session.execute(
+            update(DeliveryTask)
+            .where(DeliveryTask.id.in_(due_ids.scalar_subquery()))
+            .values(status='processing', next_attempt_at=now + timedelta(seconds=Config.ENGINE_LEASE_SECONDS))
+            .returning(DeliveryTask.id)
+            .execution_options(synchronize_session=False)
+        ).scalars().all()
+        if not claimed_ids:
+            session.commit()
+            return []
+
+        tasks = session.query(DeliveryTask).filter(DeliveryTask.id.in_(claimed_ids)).all()
+        # One lookup for the whole batch; resolve_target_url below then hits the local cache tier
+        subscriptions = get_subscriptions_details({task.subscription_id for task in tasks}, session)
+
+        deliveries = []
+        for task in tasks:
+            target_url = resolve_target_url(session, task)
+            if not target_url:
+                continue
+            try:
+                body, headers = build_request_body(session, task, subscriptions[task.subscription_id])
+                deliveries.append((task.id, task.subscription_id, subscriptions[task.subscription_id], target_url, body, headers, None))
+            except Exception as e:
+                deliveries.append((task.id, task.subscription_id, subscriptions[task.subscription_id], target_url, None, None,
+                                   describe_request_error(e)))
+        session.commit()
+        return deliveries
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        db_session.remove()
+
+
+def book_outcome(task_id, attempt_outcome, http_status, error_details, timeouts=None, latency_ms=None, body=None, headers=None):
+    """
+    Records the outcome of one attempt (success, failure or the next retry) and commits it.
+    A compressed body is kept for the retry.
+    """
+    session = db_session()
+    try:
+        task = session.query(DeliveryTask).filter_by(id=task_id).first()
+        if task is None:
+            print(f"Task {task_id} disappeared before its outcome could be recorded.")
+            return
+        retry_delay = record_delivery_outcome(session, task, attempt_outcome, http_status, error_details,
+                                              timeouts=timeouts, latency_ms=latency_ms)
+        if retry_delay is not None and body is not None:
+            keep_compressed_body_for_retry(task, body, headers or {})
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        db_session.remove()
+
+
+def book_deferral(task_id, delay_seconds, reason):
+    """Defers a claimed task without counting an attempt; it is claimed again once due."""
+    session = db_session()
+    try:
+        task = session.query(DeliveryTask).filter_by(id=task_id).first()
+        if task is not None:
+            defer_task(session, task, delay_seconds, reason)
+            session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        db_session.remove()
+
+
+def extend_lease(task_id):
+    """Moves the lease of a claimed task that is still waiting to be sent ENGINE_LEASE_SECONDS ahead."""
+    session = db_session()
+    try:
+        session.execute(
+            update(DeliveryTask)
+            .where(DeliveryTask.id == task_id, DeliveryTask.status == 'processing')
+            .values(next_attempt_at=datetime.now(timezone.utc) + timedelta(seconds=Config.ENGINE_LEASE_SECONDS))
+            .execution_options(synchronize_session=False)
+        )
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        db_session.remove()
+
+
+def describe_client_error(e, timeouts=None):
+    """aiohttp counterpart of describe_request_error."""
+    if isinstance(e, asyncio.TimeoutError):
+        return f"Delivery timeout after {timeouts[1] if timeouts else Config.DELIVERY_TIMEOUT_SECONDS} seconds."
+    if isinstance(e, aiohttp.ClientConnectionError):
+        return f"Connection error: {e}"
+    if isinstance(e, aiohttp.ClientError):
+        return f"Request error: {e}"
+    return f"Unexpected error during delivery HTTP request: {e}"
+
+
+class CachedResolver(AbstractResolver):
+    """aiohttp resolver backed by the process-wide dns_cache; only cache misses go to a thread."""
+
+    async def resolve(self, host, port=0, family=socket.AF_INET):
+        if dns_cache.cached(host.rstrip('.').lower()) is None:
+            addresses = await asyncio.to_thread(dns_cache.resolve, host)
+        else:
+            addresses = dns_cache.resolve(host) # A cache hit (or cached NXDOMAIN) does not block
+        return [
+            {
+                'hostname': host, 'host': address, 'port': port,
+                'family': socket.AF_INET6 if ipaddress.ip_address(address).version == 6 else socket.AF_INET,
+                'proto': 0, 'flags': socket.AI_NUMERICHOST
+            }
+            for address in addresses
+        ]
+
+    async def close(self):
+        pass
+
+
+class DeliveryEngine:
+    """Claims due tasks and delivers them concurrently with per-host and global limits."""
+
+    def __init__(self, max_in_flight=None, per_host_concurrency=None, claim_batch_size=None):
+        self.max_in_flight = max_in_flight or Config.ENGINE_MAX_IN_FLIGHT
+        self.per_host_concurrency = per_host_concurrency or Config.ENGINE_PER_HOST_CONCURRENCY
+        self.claim_batch_size = claim_batch_size or Config.ENGINE_CLAIM_BATCH_SIZE
+        self._in_flight = set()
+        self._http = None
+        self._claimed = defaultdict(Counter) # host -> claimed tasks per subscription, waiting or being sent
+        self._host_slots = {} # host -> semaphore of its ENGINE_PER_HOST_CONCURRENCY delivery slots
+
+    async def run(self):
+        """Claims and delivers forever."""
+        loop = asyncio.get_running_loop()
+        # Bounds concurrent DB sessions; keep it within the SQLAlchemy pool size
+        loop.set_default_executor(ThreadPoolExecutor(Config.ENGINE_DB_THREADS, thread_name_prefix="delivery-engine-db"))
+        connector = aiohttp.TCPConnector(
+            limit=self.max_in_flight,
+            limit_per_host=self.per_host_concurrency, # Per-host concurrency cap: further requests wait for a connection
+            force_close=not Config.HTTP_KEEPALIVE,
+            **({'resolver': CachedResolver(), 'use_dns_cache': False} if Config.DNS_CACHE_ENABLED else {})
+        )
+        # Like the requests timeout of process_delivery: connect and read, not time spent waiting for a host slot.
+        # Each POST overrides them with the adaptive timeouts of its host.
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=Config.DELIVERY_TIMEOUT_SECONDS,
+                                        sock_read=Config.DELIVERY_TIMEOUT_SECONDS)
+        print(f"Delivery engine started (max in flight {self.max_in_flight}, per host {self.per_host_concurrency}).")
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as http:
+            self._http = http
+            while True:
+                wanted = min(self.max_in_flight - len(self._in_flight), self.claim_batch_size)
+                if wanted <= 0:
+                    # Global in-flight limit reached: wait for a delivery to finish
+                    await asyncio.wait(self._in_flight, return_when=asyncio.FIRST_COMPLETED)
+                    continue
+
+                try:
+                    deliveries = await asyncio.to_thread(claim_deliveries, wanted, self._saturated_subscriptions())
+                except Exception as e:
+                    deliveries = []
+                    print(f"Delivery engine claim error: {e}")
+
+                for delivery in deliveries:
+                    host, subscription_id = circuit_breaker.host_key(delivery[3]), delivery[1]
+                    self._claimed[host][subscription_id] += 1
+                    in_flight = asyncio.create_task(self.deliver(*delivery))
+                    self._in_flight.add(in_flight)
+                    in_flight.add_done_callback(self._in_flight.discard)
+                    in_flight.add_done_callback(lambda _, host=host, subscription_id=subscription_id:
+                                                self._release_claim(host, subscription_id))
+
+                if len(deliveries) < wanted:
+                    await asyncio.sleep(Config.ENGINE_POLL_INTERVAL_SECONDS)
+
+    def _saturated_subscriptions(self):
+        """Subscriptions delivering to a host that already has ENGINE_PER_HOST_CONCURRENCY claimed tasks."""
+        return [subscription_id
+                for subscriptions in self._claimed.values() if sum(subscriptions.values()) >= self.per_host_concurrency
+                for subscription_id in subscriptions]
+
+    def _release_claim(self, host, subscription_id):
+        subscriptions = self._claimed[host]
+        subscriptions[subscription_id] -= 1
+        if subscriptions[subscription_id] <= 0:
+            del subscriptions[subscription_id]
+        if not subscriptions:
+            # Nothing of this host is waiting or being sent: its slots are all free
+            del self._claimed[host]
+            self._host_slots.pop(host, None)
+
+    @contextlib.asynccontextmanager
+    async def _host_slot(self, task_id, target_url):
+        """Holds one of the delivery slots of the target host, extending the task's lease while it waits."""
+        slot = self._host_slots.setdefault(circuit_breaker.host_key(target_url), asyncio.Semaphore(self.per_host_concurrency))
+        while True:
+            try:
+                await asyncio.wait_for(slot.acquire(), timeout=Config.ENGINE_LEASE_SECONDS / 3)
+                break
+            except asyncio.TimeoutError:
+                try:
+                    await asyncio.to_thread(extend_lease, task_id)
+                except Exception as e:
+                    print(f"Task {task_id}: Failed to extend lease: {e}")
+        try:
+            yield
+        finally:
+            slot.release()
+
+    @staticmethod
+    def _admission_delay(task_id, subscription_id, subscription, target_url):
+        """(seconds to defer, reason) when a rate limit or an open circuit holds the delivery back, else (None, None)."""
+        circuit_wait = circuit_breaker.allow_request(target_url)
+        if circuit_wait:
+            return circuit_wait + random.uniform(0, Config.CIRCUIT_BREAKER_COOLDOWN_SECONDS / 10), \
+                f"Circuit open for {circuit_breaker.host_key(target_url)}."
+        token_wait = rate_limit.take_token(subscription_id, subscription, target_url, task_id)
+        if token_wait:
+            return token_wait, "Rate limit reached."
+        return None, None
+
+    async def deliver(self, task_id, subscription_id, subscription, target_url, body, headers, error_details):
+        """POSTs one claimed task and books the outcome."""
+        attempt_outcome = 'failed_attempt'
+        http_status = None
+        timeouts = None
+        latency_ms = None
+        if error_details is None:
+            async with self._host_slot(task_id, target_url):
+                delay_seconds, reason = await asyncio.to_thread(self._admission_delay, task_id, subscription_id, subscription, target_url)
+                if delay_seconds:
+                    try:
+                        await asyncio.to_thread(book_deferral, task_id, delay_seconds, reason)
+                    except Exception as e:
+                        print(f"Task {task_id}: Failed to defer delivery: {e}")
+                    return
+
+                timeouts = await asyncio.to_thread(latency.timeouts_for, target_url)
+                loop = asyncio.get_running_loop()
+                started = loop.time()
+                try:
+                    async with self._http.post(target_url, data=body, headers=headers, # type: ignore[reportOptionalMemberAccess]
+                                               timeout=aiohttp.ClientTimeout(total=None, sock_connect=timeouts[0],
+                                                                             sock_read=timeouts[1])) as response:
+                        latency_ms = round((loop.time() - started) * 1000) # Until the response headers arrived
+                        http_status = response.status
+                        # Bounded read, like http_client.read_response_body
+                        response_text = (await response.content.read(Config.HTTP_RESPONSE_READ_LIMIT_BYTES))\
+                            .decode(response.charset or 'utf-8', errors='replace')
+                    await asyncio.to_thread(latency.record_latency, target_url, latency_ms)
+                    await asyncio.to_thread(circuit_breaker.record_result, target_url, http_status)
+                    if 200 <= http_status < 300:
+                        attempt_outcome = 'success'
+                        print(f"Task {task_id}: Delivery successful (Status: {http_status})")
+                    else:
+                        error_details = f"Non-2xx status code: {http_status}. Response: {response_text[:200]}"
+                        print(f"Task {task_id}: Delivery failed (Status: {http_status})")
+                except Exception as e:
+                    error_details = describe_client_error(e, timeouts)
+                    print(f"Task {task_id}: {error_details}")
+                    if isinstance(e, asyncio.TimeoutError):
+                        # Counted at the timeout, so a slowing host raises its own percentiles
+                        await asyncio.to_thread(latency.record_latency, target_url, timeouts[1] * 1000)
+                    if isinstance(e, (aiohttp.ClientError, asyncio.TimeoutError)):
+                        await asyncio.to_thread(circuit_breaker.record_result, target_url, None)
+
+        try:
+            await asyncio.to_thread(book_outcome, task_id, attempt_outcome, http_status, error_details, timeouts, latency_ms,
+                                    body, headers)
+        except Exception as e:
+            # The lease expires and the task is claimed again
+            print(f"Task {task_id}: Failed to record delivery outcome: {e}")
+
+
+def run_engine():
+    asyncio.run(DeliveryEngine().run())
+
+
+if __name__ == '__main__':
+    run_engine()
@@ -0,0 +1,141 @@
+"""
+Process-wide DNS cache for outbound webhook delivery.
+
+Target hostnames are resolved with dnspython so the record TTLs are known: answers are
+cached for their TTL (clamped to DNS_CACHE_MIN_TTL_SECONDS..DNS_CACHE_MAX_TTL_SECONDS)
+and NXDOMAIN is cached for the zone's negative TTL (SOA minimum, at most
+DNS_CACHE_NEGATIVE_TTL_SECONDS), so deliveries to a dead hostname fail without a
+resolver round trip. Names the DNS does not know are looked up once more with the
+system resolver (getaddrinfo), which also covers /etc/hosts; its answers are cached
+for DNS_CACHE_MIN_TTL_SECONDS. Used by http_client's connections and the asyncio
+delivery engine's resolver.
+"""
+import socket
+import ipaddress
+import threading
+import time
+from collections import OrderedDict
+import dns.exception
+import dns.resolver
+import dns.rdatatype
+
+from .config import Config
+
+
+class DNSCache:
+    """A bounded, thread-safe cache of hostname -> addresses, positive and negative."""
+
+    def __init__(self, max_entries, min_ttl, max_ttl, negative_ttl):
+        self.max_entries = max_entries
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        self._entries = OrderedDict() # hostname -> (expires_at, addresses; [] for NXDOMAIN), least recently used first
+        self._lock = threading.Lock()
+        self._resolver = dns.resolver.Resolver()
+        self._stats = {'hits': 0, 'misses': 0, 'negative_hits': 0, 'nxdomain': 0, 'errors': 0}
+
+    def resolve(self, hostname):
+        """
+        Returns the IP addresses of hostname, from the cache while its TTL lasts.
+        Raises socket.gaierror for a name that does not exist (cached) or cannot be resolved (not cached).
+        """
+        hostname = hostname.rstrip('.').lower()
+        try:
+            return [str(ipaddress.ip_address(hostname))] # IP literals need no lookup
+        except ValueError:
+            pass
+
+        cached = self.cached(hostname)
+        if cached is not None:
+            if not cached:
+                self._count('negative_hits')
+                raise socket.gaierror(socket.EAI_NONAME, f"Name or service not known: {hostname} (cached)")
+            self._count('hits')
+            return cached
+
+        self._count('misses')
+        try:
+            addresses, ttl = self._query(hostname)
+        except dns.resolver.NXDOMAIN as e:
+            addresses, ttl = self._system_lookup(hostname), self.min_ttl
+            if not addresses:
+                self._count('nxdomain')
+                self._store(hostname, [], self._negative_ttl(e))
+                raise socket.gaierror(socket.EAI_NONAME, f"Name or service not known: {hostname}")
+        except dns.exception.DNSException as e:
+            # Timeouts and SERVFAIL are not cached; the next attempt asks again
+            addresses, ttl = self._system_lookup(hostname), self.min_ttl
+            if not addresses:
+                self._count('errors')
+                raise socket.gaierror(socket.EAI_AGAIN, f"Resolving {hostname} failed: {e}")
+        self._store(hostname, addresses, ttl)
+        return addresses
+
+    def cached(self, hostname):
+        """Cached addresses of hostname ([] for a cached NXDOMAIN), or None if it has to be resolved."""
+        with self._lock:
+            entry = self._entries.get(hostname)
+            if entry is None:
+                return None
+            expires_at, addresses = entry
+            if expires_at < time.monotonic():
+                del self._entries[hostname]
+                return None
+            self._entries.move_to_end(hostname)
+            return addresses
+
+    def _query(self, hostname):
+        """A records, else AAAA records, with the TTL of the answer."""
+        try:
+            answer = self._resolver.resolve(hostname, 'A', search=True)
+        except dns.resolver.NoAnswer:
+            answer = self._resolver.resolve(hostname, 'AAAA', search=True)
+        return [rdata.address for rdata in answer], answer.rrset.ttl # type: ignore[reportOptionalMemberAccess]
+
+    def _negative_ttl(self, nxdomain):
+        """The zone's negative caching TTL (RFC 2308) from the SOA in the NXDOMAIN response, capped."""
+        for response in nxdomain.responses().values():
+            for rrset in response.authority:
+                if rrset.rdtype == dns.rdatatype.SOA:
+                    return min(rrset.ttl, rrset[0].minimum, self.negative_ttl)
+        return self.negative_ttl
+
+    @staticmethod
+    def _system_lookup(hostname):
+        try:
+            infos = socket.getaddrinfo(hostname, None, type=socket.SOCK_STREAM)
+        except socket.gaierror:
+            return []
+        return list(dict.fromkeys(info[4][0] for info in infos))
+
+    def _store(self, hostname, addresses, ttl):
+        if not addresses:
+            ttl = min(ttl, self.negative_ttl)
+        else:
+            ttl = min(max(ttl, self.min_ttl), self.max_ttl)
+        with self._lock:
+            self._entries[hostname] = (time.monotonic() + ttl, addresses)
+            self._entries.move_to_end(hostname)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _count(self, counter):
+        with self._lock:
+            self._stats[counter] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Hit/miss counters and the number of cached names (positive and negative)."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['negative_entries'] = sum(1 for _, addresses in self._entries.values() if not addresses)
+        return stats
+
+
+dns_cache = DNSCache(Config.DNS_CACHE_MAX_ENTRIES, Config.DNS_CACHE_MIN_TTL_SECONDS,
+                     Config.DNS_CACHE_MAX_TTL_SECONDS, Config.DNS_CACHE_NEGATIVE_TTL_SECONDS)
@@ -0,0 +1,148 @@
+"""
+Pooled keep-alive HTTP sessions for outbound webhook delivery.
+
+Each worker process keeps one requests.Session per target host (scheme + host + port),
+each with its own connection pool of HTTP_POOL_MAXSIZE connections, so repeated
+deliveries to the same receiver reuse TCP/TLS connections instead of opening a new
+one per attempt. At most HTTP_POOL_MAX_HOSTS sessions are kept; the least recently
+used one is closed when that is exceeded. With DNS_CACHE_ENABLED, new connections
+resolve the target host through the process-wide dns_cache instead of getaddrinfo.
+"""
+import os
+import socket
+import threading
+from collections import OrderedDict
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NameResolutionError, ConnectTimeoutError, NewConnectionError
+from urllib3.util import connection
+
+from .circuit_breaker import host_key
+from .config import Config
+from .dns_cache import dns_cache
+
+_sessions = OrderedDict() # host key -> requests.Session, least recently used first
+_sessions_lock = threading.Lock()
+_sessions_pid = None
+
+
+class CachedDNSConnectionMixin:
+    """Opens connections to the addresses cached for the host, trying each in turn."""
+
+    def _new_conn(self):
+        try:
+            addresses = dns_cache.resolve(self._dns_host) # type: ignore[reportAttributeAccessIssue]
+        except socket.gaierror as e:
+            raise NameResolutionError(self.host, self, e) from e # type: ignore[reportAttributeAccessIssue]
+
+        error = None
+        for address in addresses:
+            try:
+                return connection.create_connection(
+                    (address, self.port), # type: ignore[reportAttributeAccessIssue]
+                    self.timeout, # type: ignore[reportAttributeAccessIssue]
+                    source_address=self.source_address, # type: ignore[reportAttributeAccessIssue]
+                    socket_options=self.socket_options, # type: ignore[reportAttributeAccessIssue]
+                )
+            except OSError as e:
+                error = e
+        if isinstance(error, socket.timeout):
+            raise ConnectTimeoutError(self, f"Connection to {self.host} timed out. (connect timeout={self.timeout})") from error # type: ignore[reportAttributeAccessIssue]
+        raise NewConnectionError(self, f"Failed to establish a new connection: {error}") from error # type: ignore[reportArgumentType]
+
+
+class CachedDNSHTTPConnection(CachedDNSConnectionMixin, HTTPConnection):
+    pass
+
+
+class CachedDNSHTTPSConnection(CachedDNSConnectionMixin, HTTPSConnection):
+    pass
+
+
+class CachedDNSHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = CachedDNSHTTPConnection
+
+
+class CachedDNSHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = CachedDNSHTTPSConnection
+
+
+class KeepAliveAdapter(HTTPAdapter):
+    """HTTPAdapter with TCP keepalive probes on pooled connections and no implicit retries."""
+
+    def __init__(self, **kwargs):
+        super().__init__(
+            pool_connections=1, # One host per session
+            pool_maxsize=Config.HTTP_POOL_MAXSIZE,
+            max_retries=0, # Retries are scheduled by the delivery task, not hidden in the client
+            **kwargs
+        )
+
+    def init_poolmanager(self, *args, **kwargs):
+        socket_options = list(HTTPConnection.default_socket_options)
+        if Config.HTTP_KEEPALIVE:
+            socket_options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+        kwargs['socket_options'] = socket_options
+        super().init_poolmanager(*args, **kwargs)
+        if Config.DNS_CACHE_ENABLED:
+            # TLS still verifies and sends SNI for the hostname; only the address lookup is cached
+            self.poolmanager.pool_classes_by_scheme = {'http': CachedDNSHTTPConnectionPool,
+                                                       'https': CachedDNSHTTPSConnectionPool}
+
+
+def _new_session():
+    session = requests.Session()
+    adapter = KeepAliveAdapter()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers['Connection'] = 'keep-alive' if Config.HTTP_KEEPALIVE else 'close'
+    return session
+
+
+def session_for(url):
+    """Returns this process's pooled session for the host of url."""
+    global _sessions_pid
+    key = host_key(url)
+    with _sessions_lock:
+        if _sessions_pid != os.getpid():
+            # Never share sockets with a parent process
+            _sessions.clear()
+            _sessions_pid = os.getpid()
+        session = _sessions.get(key)
+        if session is None:
+            session = _sessions[key] = _new_session()
+            while len(_sessions) > Config.HTTP_POOL_MAX_HOSTS:
+                _, evicted = _sessions.popitem(last=False)
+                evicted.close()
+        else:
+            _sessions.move_to_end(key)
+        return session
+
+
+def post(url, data, headers, timeout):
+    """POSTs through the host's pooled session. The body is streamed; finish with read_response_body()."""
+    return session_for(url).post(url, data=data, headers=headers, timeout=timeout, stream=True)
+
+
+def read_response_body(response, limit=None):
+    """
+    Reads at most limit bytes (HTTP_RESPONSE_READ_LIMIT_BYTES) of a streamed response
+    body and releases its connection. A body read to the end returns the connection
+    to the pool; a larger one is cut off and its connection closed, so a huge
+    response never gets buffered in memory. Returns the text read.
+    """
+    limit = limit or Config.HTTP_RESPONSE_READ_LIMIT_BYTES
+    chunks = []
+    total = 0
+    try:
+        for chunk in response.iter_content(chunk_size=8192):
+            chunks.append(chunk)
+            total += len(chunk)
+            if total > limit:
+                break
+    finally:
+        response.close()
+    return b"".join(chunks)[:limit].decode(response.encoding or 'utf-8', errors='replace')
+
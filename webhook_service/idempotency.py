@@ -0,0 +1,154 @@
+"""
+Idempotency keys for ingestion.
+
+A producer retrying a webhook sends the same key (IDEMPOTENCY_KEY_HEADER, or the
+value at IDEMPOTENCY_KEY_JSON_PATH in the JSON payload). The first request claims
+idempotency:<sub_id>:<key> in Redis with SET NX for IDEMPOTENCY_TTL_SECONDS, storing
+its task id; duplicates within that window get the original task id back without
+touching the DB write path or the broker. A delivery_idempotency_keys row written
+with the task (primary key (subscription_id, idempotency_key)) catches duplicates
+arriving after the Redis entry has expired or been evicted. Keys are deleted with
+the tasks' partitions after TASK_RETENTION_HOURS.
+"""
+from sqlalchemy import select, insert, or_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from .cache import redis_client
+from .models import IdempotencyKey
+from .config import Config
+
+# Deletes the claim only if it still holds our task id, so a failed write never releases someone else's claim
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def extract_idempotency_key(headers, payload=None):
+    """Returns the idempotency key of a request (header first, then the JSON path), or None."""
+    key = headers.get(Config.IDEMPOTENCY_KEY_HEADER)
+    if not key and Config.IDEMPOTENCY_KEY_JSON_PATH and isinstance(payload, dict):
+        value = payload
+        for part in Config.IDEMPOTENCY_KEY_JSON_PATH.split('.'):
+            value = value.get(part) if isinstance(value, dict) else None
+        if isinstance(value, (str, int)) and not isinstance(value, bool):
+            key = str(value)
+    return key[:255] if key else None
+
+
+def _claim_key(sub_id, key):
+    return f"idempotency:{sub_id}:{key}"
+
+
+def claim_idempotency_keys(claims):
+    """
+    Atomically claims (sub_id, key, task_id) triples with one pipelined SET NX each.
+    Returns, per claim, None if the claim is ours, otherwise the task id recorded
+    by the request that claimed the key first.
+    """
+    pipe = redis_client.pipeline(transaction=False)
+    for sub_id, key, task_id in claims:
+        pipe.set(_claim_key(sub_id, key), str(task_id), nx=True, ex=Config.IDEMPOTENCY_TTL_SECONDS)
+    claimed = pipe.execute()
+
+    lost = [claim for claim, ok in zip(claims, claimed) if not ok]
+    originals = {}
+    if lost:
+        pipe = redis_client.pipeline(transaction=False)
+        for sub_id, key, _ in lost:
+            pipe.get(_claim_key(sub_id, key))
+        # A claim that expired between SET and GET yields None; the unique index still guards the insert
+        originals = {(sub_id, key, task_id): original for (sub_id, key, task_id), original in zip(lost, pipe.execute())}
+    return [originals.get(claim) for claim in claims]
+
+
+def claim_idempotency_key(sub_id, key, task_id):
+    """Single-request form of claim_idempotency_keys."""
+    return claim_idempotency_keys([(sub_id, key, task_id)])[0]
+
+
+def remember_idempotency_key(sub_id, key, task_id):
+    """Points a key at the task that actually holds it (after the unique index caught a duplicate)."""
+    redis_client.set(_claim_key(sub_id, key), str(task_id), ex=Config.IDEMPOTENCY_TTL_SECONDS)
+
+
+def release_idempotency_key(sub_id, key, task_id):
+    """Releases our claim after the task could not be written, so a retry is not reported as a duplicate."""
+    try:
+        redis_client.eval(RELEASE_SCRIPT, 1, _claim_key(sub_id, key), str(task_id))
+    except Exception as e:
+        print(f"Failed to release idempotency key {key} for subscription {sub_id}: {e}")
+
+
+async def claim_idempotency_key_async(async_redis, sub_id, key, task_id):
+    """asyncio counterpart of claim_idempotency_key."""
+    claim_key = _claim_key(sub_id, key)
+    if await async_redis.set(claim_key, str(task_id), nx=True, ex=Config.IDEMPOTENCY_TTL_SECONDS):
+        return None
+    return await async_redis.get(claim_key)
+
+
+async def remember_idempotency_key_async(async_redis, sub_id, key, task_id):
+    """asyncio counterpart of remember_idempotency_key."""
+    await async_redis.set(_claim_key(sub_id, key), str(task_id), ex=Config.IDEMPOTENCY_TTL_SECONDS)
+
+
+async def release_idempotency_key_async(async_redis, sub_id, key, task_id):
+    """asyncio counterpart of release_idempotency_key."""
+    try:
+        await async_redis.eval(RELEASE_SCRIPT, 1, _claim_key(sub_id, key), str(task_id))
+    except Exception as e:
+        print(f"Failed to release idempotency key {key} for subscription {sub_id}: {e}")
+
+
+def idempotency_key_rows(task_rows):
+    """delivery_idempotency_keys rows for the keyed ones of some new_delivery_task_row()s."""
+    return [
+        {'subscription_id': row['subscription_id'], 'idempotency_key': row['idempotency_key'], 'delivery_task_id': row['id']}
+        for row in task_rows if row.get('idempotency_key')
+    ]
+
+
+def add_idempotency_keys(session, task_rows):
+    """
+    Adds the key rows of task rows to the caller's transaction (one multi-row INSERT).
+    A key that is already taken raises IntegrityError.
+    """
+    rows = idempotency_key_rows(task_rows)
+    if rows:
+        session.execute(insert(IdempotencyKey), rows)
+
+
+def add_new_idempotency_keys(session, task_rows):
+    """
+    Like add_idempotency_keys, but skips keys that are already taken (ON CONFLICT DO NOTHING).
+    Returns the ids of the tasks whose key was added.
+    """
+    rows = idempotency_key_rows(task_rows)
+    if not rows:
+        return set()
+    stmt = pg_insert(IdempotencyKey).on_conflict_do_nothing(
+        index_elements=['subscription_id', 'idempotency_key']
+    ).returning(IdempotencyKey.delivery_task_id)
+    return set(session.execute(stmt, rows).scalars().all())
+
+
+def existing_task_ids_query(pairs):
+    """SELECT of (subscription_id, idempotency_key, id) for already stored tasks with these keys."""
+    conditions = [
+        (IdempotencyKey.subscription_id == sub_id) & (IdempotencyKey.idempotency_key == key)
+        for sub_id, key in pairs
+    ]
+    return select(IdempotencyKey.subscription_id, IdempotencyKey.idempotency_key,
+                  IdempotencyKey.delivery_task_id.label('id')).where(or_(*conditions))
+
+
+def find_existing_task_ids(session, pairs):
+    """Maps (subscription_id, idempotency_key) pairs to the ids of tasks already stored with them."""
+    pairs = list(pairs)
+    if not pairs:
+        return {}
+    rows = session.execute(existing_task_ids_query(pairs)).all()
+    return {(str(row.subscription_id), row.idempotency_key): row.id for row in rows}
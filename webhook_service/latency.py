@@ -0,0 +1,115 @@
+"""
+Delivery latency per target host and the adaptive timeouts derived from it.
+
+Every attempt records how long the receiver took to answer (time to response
+headers; timeouts are recorded at the timeout used, so slow receivers push their own
+percentiles up) in a log-scale histogram in Redis: latency:<host>:<window> holds one
+counter per bucket for a LATENCY_WINDOW_SECONDS window, and the last LATENCY_WINDOWS
+windows form the rolling sketch. Buckets grow by 25%, so percentiles are accurate to
+within a bucket for anything from 1 ms to minutes.
+
+Each attempt's timeouts are ADAPTIVE_TIMEOUT_MULTIPLIER times the host's
+ADAPTIVE_TIMEOUT_PERCENTILE latency, clamped to the configured floor and ceiling.
+Until a host has ADAPTIVE_TIMEOUT_MIN_SAMPLES samples, DELIVERY_TIMEOUT_SECONDS
+(clamped the same way) is used. Sketches are cached in-process for a few seconds.
+"""
+import math
+import time
+
+from .cache import redis_client, LocalTTLCache
+from .circuit_breaker import host_key
+from .config import Config
+
+LATENCY_KEY_PREFIX = "latency:"
+BUCKET_GROWTH = 1.25
+
+_sketch_cache = LocalTTLCache(Config.LOCAL_CACHE_MAX_ENTRIES, Config.LATENCY_SKETCH_CACHE_SECONDS)
+
+
+def _bucket(latency_ms):
+    return max(0, math.ceil(math.log(max(latency_ms, 1.0), BUCKET_GROWTH)))
+
+
+def _bucket_upper_ms(bucket):
+    return BUCKET_GROWTH ** bucket
+
+
+def record_latency(url, latency_ms):
+    """Adds one latency sample for the host of url to the current window."""
+    window = int(time.time() // Config.LATENCY_WINDOW_SECONDS)
+    key = f"{LATENCY_KEY_PREFIX}{host_key(url)}:{window}"
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.hincrby(key, str(_bucket(latency_ms)), 1)
+        pipe.expire(key, Config.LATENCY_WINDOW_SECONDS * (Config.LATENCY_WINDOWS + 1))
+        pipe.execute()
+    except Exception as e:
+        print(f"Failed to record delivery latency for {host_key(url)}: {e}")
+
+
+def latency_sketch(url):
+    """Returns the host's rolling histogram {bucket: count} over the last LATENCY_WINDOWS windows."""
+    host = host_key(url)
+    sketch = _sketch_cache.get(host)
+    if sketch is not None:
+        return sketch
+
+    current = int(time.time() // Config.LATENCY_WINDOW_SECONDS)
+    pipe = redis_client.pipeline(transaction=False)
+    for window in range(current - Config.LATENCY_WINDOWS + 1, current + 1):
+        pipe.hgetall(f"{LATENCY_KEY_PREFIX}{host}:{window}")
+    sketch = {}
+    for counts in pipe.execute():
+        for bucket, count in counts.items():
+            sketch[int(bucket)] = sketch.get(int(bucket), 0) + int(count)
+    _sketch_cache.set(host, sketch)
+    return sketch
+
+
+def percentile_ms(sketch, percentile):
+    """Upper bound of the bucket holding the given percentile (0-1), or None for an empty sketch."""
+    total = sum(sketch.values())
+    if not total:
+        return None
+    rank = percentile * total
+    seen = 0
+    for bucket in sorted(sketch):
+        seen += sketch[bucket]
+        if seen >= rank:
+            return _bucket_upper_ms(bucket)
+    return _bucket_upper_ms(max(sketch))
+
+
+def _clamp(value, floor, ceiling):
+    return min(max(value, floor), ceiling)
+
+
+def timeouts_for(url):
+    """Returns the (connect, read) timeouts in seconds for the next attempt to url."""
+    base = Config.DELIVERY_TIMEOUT_SECONDS
+    if Config.ADAPTIVE_TIMEOUTS_ENABLED:
+        try:
+            sketch = latency_sketch(url)
+            if sum(sketch.values()) >= Config.ADAPTIVE_TIMEOUT_MIN_SAMPLES:
+                base = percentile_ms(sketch, Config.ADAPTIVE_TIMEOUT_PERCENTILE) / 1000.0 * Config.ADAPTIVE_TIMEOUT_MULTIPLIER # type: ignore[reportOptionalOperand]
+        except Exception as e:
+            print(f"Failed to read delivery latency for {host_key(url)}, using the default timeout: {e}")
+    return (
+        _clamp(base, Config.ADAPTIVE_CONNECT_TIMEOUT_FLOOR_SECONDS, Config.ADAPTIVE_CONNECT_TIMEOUT_CEILING_SECONDS),
+        _clamp(base, Config.ADAPTIVE_READ_TIMEOUT_FLOOR_SECONDS, Config.ADAPTIVE_READ_TIMEOUT_CEILING_SECONDS)
+    )
+
+
+def latency_stats(url):
+    """Sample count and p50/p90/p99 (ms) of a host's rolling sketch, plus the timeouts currently derived from it."""
+    sketch = latency_sketch(url)
+    connect_timeout, read_timeout = timeouts_for(url)
+    return {
+        'host': host_key(url),
+        'samples': sum(sketch.values()),
+        'p50_ms': percentile_ms(sketch, 0.5),
+        'p90_ms': percentile_ms(sketch, 0.9),
+        'p99_ms': percentile_ms(sketch, 0.99),
+        'connect_timeout_seconds': connect_timeout,
+        'read_timeout_seconds': read_timeout,
+    }
@@ -1,5 +1,5 @@
 import uuid
-from sqlalchemy import Column, String, Integer, DateTime, ForeignKey, JSON, text, func, TEXT
+from sqlalchemy import Column, String, Integer, BigInteger, Boolean, Float, LargeBinary, DateTime, ForeignKey, JSON, text, func, TEXT
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.orm import relationship
 from sqlalchemy import Index
@@ -8,6 +8,22 @@ from .database import Base, engine
 def generate_uuid():
     return str(uuid.uuid4())
 
+def new_delivery_task_row(subscription_id, payload=None, raw_body=None, content_type=None, idempotency_key=None):
+    """Column values of a new pending DeliveryTask, for ORM construction or multi-row INSERTs."""
+    return {
+        'id': uuid.uuid4(),
+        'subscription_id': subscription_id,
+        'payload': payload,
+        'raw_body': raw_body,
+        'content_type': content_type,
+        'idempotency_key': idempotency_key,
+        'payload_storage': None,
+        'payload_encoding': None,
+        'payload_size': None,
+        'status': 'pending',
+        'attempts_count': 0
+    }
+
 class Subscription(Base):
     __tablename__ = 'subscriptions'
 
@@ -15,10 +31,28 @@ class Subscription(Base):
     target_url = Column(String(255), nullable=False)
     secret = Column(String(255))
     event_type_filter = Column(String(255), index=True) # <-- Added index=True
-    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), index=True)
+    # Store the original request bytes and forward them verbatim instead of parsing JSON
+    passthrough = Column(Boolean, nullable=False, default=False, server_default=text('false'))
+    # Coalesce up to batch_max_size pending tasks into one POST with a JSON array body; NULL or 1 disables batching
+    batch_max_size = Column(Integer)
+    batch_linger_ms = Column(Integer) # How long the worker waits for more tasks before sending a batch
+    # Token bucket shared by all workers; NULL means unlimited
+    rate_limit_per_second = Column(Float)
+    rate_limit_burst = Column(Integer) # Bucket size; NULL means one second's worth of tokens
+    # Share of the outbox relay's publishing when several subscriptions have a backlog
+    weight = Column(Integer, nullable=False, default=1, server_default=text('1'))
+    # Content-Encoding of delivered bodies ('gzip' or 'zstd'); NULL sends them uncompressed
+    compression = Column(String(10))
+    compression_min_bytes = Column(Integer) # Smaller bodies are sent uncompressed; NULL means DELIVERY_COMPRESSION_MIN_BYTES
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now()) # Indexed with id for keyset pagination
     updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now(), index=True)
 
     delivery_tasks = relationship("DeliveryTask", back_populates="subscription", cascade="all, delete-orphan")
+
+    __table_args__ = (
+        Index('idx_subscriptions_created_at_id', created_at, id),
+    )
+
     def __repr__(self):
         return f"<Subscription(id='{self.id}', target_url='{self.target_url}')>"
 
@@ -28,25 +62,38 @@ class DeliveryTask(Base):
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=generate_uuid)
     subscription_id = Column(UUID(as_uuid=True), ForeignKey('subscriptions.id', ondelete='CASCADE'), nullable=False)
-    payload = Column(JSONB, nullable=False)
+    payload = Column(JSONB(none_as_null=True)) # Parsed JSON body; NULL for passthrough tasks
+    raw_body = Column(LargeBinary) # Original request bytes of passthrough tasks
+    content_type = Column(String(255)) # Content-Type the raw body was received with
     # Index on status is defined in __table_args__
     status = Column(String(50), nullable=False, default='pending')
     # Add index to created_at
-    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), index=True) # <-- Added index=True
+    # Part of the primary key: the table is range-partitioned by day on created_at (see partitions.py)
+    created_at = Column(DateTime(timezone=True), primary_key=True, nullable=False, server_default=func.now(), index=True) # <-- Added index=True
     last_attempt_at = Column(DateTime(timezone=True))
     next_attempt_at = Column(DateTime(timezone=True))
     attempts_count = Column(Integer, nullable=False, default=0)
     last_http_status = Column(Integer)
     last_error = Column(TEXT)
+    idempotency_key = Column(String(255)) # Producer-supplied key; unique per subscription through IdempotencyKey
+    # Large bodies are compressed and stored out of row; payload/raw_body are then NULL
+    payload_storage = Column(String(16)) # 'db' (delivery_payloads) or 'fs' (PAYLOAD_BLOB_DIR); NULL when inline
+    payload_encoding = Column(String(16)) # 'gzip' or 'zstd'
+    payload_size = Column(Integer) # Uncompressed body size in bytes
 
     # Define relationship to subscription and attempts
     subscription = relationship("Subscription", back_populates="delivery_tasks")
-    delivery_attempts = relationship("DeliveryAttempt", back_populates="delivery_task", cascade="all, delete-orphan")
+    # No foreign keys point at a partitioned table, so the joins are spelled out
+    delivery_attempts = relationship("DeliveryAttempt", primaryjoin="DeliveryTask.id == foreign(DeliveryAttempt.delivery_task_id)",
+                                     back_populates="delivery_task", cascade="all, delete-orphan")
 
     __table_args__ = (
-        Index('idx_delivery_tasks_subscription_id', subscription_id),
-        Index('idx_delivery_tasks_status', status),
+        # Task listing filters, in its (created_at, id) order; they also serve lookups by subscription_id or status alone
+        Index('idx_delivery_tasks_subscription_created', subscription_id, created_at.desc(), id.desc()),
+        Index('idx_delivery_tasks_status_created', status, created_at.desc(), id.desc()),
+        Index('idx_delivery_tasks_subscription_status_created', subscription_id, status, created_at.desc(), id.desc()),
         Index('idx_delivery_tasks_next_attempt_at', next_attempt_at, postgresql_where=(text("status = 'retrying'"))),
+        {'postgresql_partition_by': 'RANGE (created_at)'},
     )
 
     def __repr__(self):
@@ -57,20 +104,77 @@ class DeliveryAttempt(Base):
     __tablename__ = 'delivery_attempts'
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=generate_uuid)
-    # Index on FK is defined in __table_args__
-    delivery_task_id = Column(UUID(as_uuid=True), ForeignKey('delivery_tasks.id', ondelete='CASCADE'), nullable=False)
+    # Index on delivery_task_id is defined in __table_args__
+    delivery_task_id = Column(UUID(as_uuid=True), nullable=False)
+    # Copied from the task so a subscription's history is read from one index without a join; NULL only if the task was unknown
+    subscription_id = Column(UUID(as_uuid=True))
     attempt_number = Column(Integer, nullable=False)
-    timestamp = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    # Part of the primary key: the table is range-partitioned by day on timestamp (see partitions.py)
+    timestamp = Column(DateTime(timezone=True), primary_key=True, nullable=False, server_default=func.now())
     outcome = Column(String(50), nullable=False)
     http_status = Column(Integer)
     error_details = Column(TEXT)
+    connect_timeout_ms = Column(Integer) # Adaptive timeouts the POST was sent with
+    read_timeout_ms = Column(Integer)
+    latency_ms = Column(Integer) # Time until the response headers arrived
 
-    delivery_task = relationship("DeliveryTask", back_populates="delivery_attempts")
+    delivery_task = relationship("DeliveryTask", primaryjoin="foreign(DeliveryAttempt.delivery_task_id) == DeliveryTask.id",
+                                 back_populates="delivery_attempts")
 
     __table_args__ = (
         Index('idx_delivery_attempts_delivery_task_id', delivery_task_id),
         Index('idx_delivery_attempts_timestamp', timestamp),
+        Index('idx_delivery_attempts_subscription_timestamp', subscription_id, timestamp.desc(), id.desc()),
+        {'postgresql_partition_by': 'RANGE ("timestamp")'},
     )
 
     def __repr__(self):
         return f"<DeliveryAttempt(id='{self.id}', task_id='{self.delivery_task_id}', attempt={self.attempt_number}, outcome='{self.outcome}')>"
+
+
+class OutboxMessage(Base):
+    """A delivery task waiting to be published to the broker by the outbox relay."""
+    __tablename__ = 'delivery_outbox'
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True) # Ordered, so the relay publishes oldest first
+    delivery_task_id = Column(UUID(as_uuid=True), nullable=False) # Deleted with the task's partition
+    subscription_id = Column(UUID(as_uuid=True), nullable=False) # The virtual queue the relay drains fairly
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    __table_args__ = (
+        Index('idx_delivery_outbox_subscription_id_id', subscription_id, id),
+    )
+
+    def __repr__(self):
+        return f"<OutboxMessage(id={self.id}, task_id='{self.delivery_task_id}')>"
+
+
+class DeliveryPayload(Base):
+    """Compressed body of a DeliveryTask whose payload exceeded PAYLOAD_OFFLOAD_THRESHOLD_BYTES."""
+    __tablename__ = 'delivery_payloads'
+
+    delivery_task_id = Column(UUID(as_uuid=True), primary_key=True) # Deleted with the task's partition
+    data = Column(LargeBinary, nullable=False)
+
+    def __repr__(self):
+        return f"<DeliveryPayload(task_id='{self.delivery_task_id}', bytes={len(self.data or b'')})>"
+
+
+class IdempotencyKey(Base):
+    """
+    Claims an idempotency key for a subscription's task. delivery_tasks is partitioned,
+    so it cannot carry a unique index on (subscription_id, idempotency_key) itself.
+    """
+    __tablename__ = 'delivery_idempotency_keys'
+
+    subscription_id = Column(UUID(as_uuid=True), ForeignKey('subscriptions.id', ondelete='CASCADE'), primary_key=True)
+    idempotency_key = Column(String(255), primary_key=True)
+    delivery_task_id = Column(UUID(as_uuid=True), nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    __table_args__ = (
+        Index('idx_delivery_idempotency_keys_created_at', created_at),
+    )
+
+    def __repr__(self):
+        return f"<IdempotencyKey(subscription_id='{self.subscription_id}', key='{self.idempotency_key}')>"
@@ -0,0 +1,183 @@
+"""
+Transactional outbox between delivery task creation and the Celery broker.
+
+Ingestion writes an OutboxMessage in the same transaction as its DeliveryTask
+instead of publishing to RabbitMQ inline; so does the retry scheduler for due
+retries. The relay (python -m webhook_service.outbox) drains the outbox in batches,
+publishes over one broker connection and deletes the published rows. Publishing is
+at-least-once: a crash between publish and delete re-publishes the batch, which
+process_delivery ignores for finished tasks.
+
+Each subscription's outbox rows form a virtual queue. The relay drains them with
+deficit round robin: every round each subscription with a backlog may publish
+OUTBOX_RELAY_QUANTUM * weight rows, so a burst for one subscription cannot starve
+the others. The relay also keeps the broker queue at most
+OUTBOX_RELAY_MAX_BROKER_DEPTH deep, so the fair order is not lost again in a long
+FIFO queue in RabbitMQ.
+"""
+import time
+from collections import deque
+from sqlalchemy import insert, text
+
+from .celery_app import celery_app
+from .database import db_session
+from .models import OutboxMessage
+from .config import Config
+from .cache import get_subscriptions_details
+from .tasks import process_delivery
+
+
+def add_to_outbox(session, tasks):
+    """
+    Adds outbox rows for (task_id, subscription_id) pairs to the caller's transaction
+    (one multi-row INSERT). The asyncio delivery engine claims tasks from delivery_tasks
+    itself, so nothing is added then.
+    """
+    rows = [{'delivery_task_id': task_id, 'subscription_id': sub_id} for task_id, sub_id in tasks]
+    if rows and Config.DELIVERY_ENGINE != 'asyncio':
+        session.execute(insert(OutboxMessage), rows)
+
+
+def publish_deliveries(task_ids):
+    """Publishes process_delivery messages for many tasks over one broker connection."""
+    with celery_app.producer_or_acquire() as producer:
+        for task_id in task_ids:
+            process_delivery.apply_async((str(task_id),), producer=producer) # type: ignore[reportGeneralTypeIssues]
+
+
+# Loose index scan of idx_delivery_outbox_subscription_id_id: one index probe per subscription
+# with a backlog, instead of reading every outbox row as SELECT DISTINCT does
+ACTIVE_SUBSCRIPTIONS_SQL = text("""
+    WITH RECURSIVE active AS (
+        (SELECT subscription_id FROM delivery_outbox ORDER BY subscription_id LIMIT 1)
+        UNION ALL
+        SELECT (SELECT o.subscription_id FROM delivery_outbox o
+                WHERE o.subscription_id > active.subscription_id
+                ORDER BY o.subscription_id LIMIT 1)
+        FROM active
+        WHERE active.subscription_id IS NOT NULL
+    )
+    SELECT subscription_id FROM active WHERE subscription_id IS NOT NULL
+""").columns(subscription_id=OutboxMessage.__table__.c.subscription_id.type)
+
+
+def broker_queue_depth():
+    """
+    Number of ready messages in the Celery delivery queue; 0 if the queue does not
+    exist yet (the first publish declares it).
+    """
+    with celery_app.pool.acquire(block=True) as connection:
+        # A passive declare of a missing queue closes its channel: use a channel of our own
+        with connection.channel() as channel:
+            try:
+                return channel.queue_declare(queue=celery_app.conf.task_default_queue, passive=True).message_count
+            except connection.channel_errors:
+                return 0
+
+
+class FairRelay:
+    """Deficit round robin over the subscriptions that have outbox rows."""
+
+    def __init__(self, quantum=None):
+        self.quantum = quantum or Config.OUTBOX_RELAY_QUANTUM
+        self._round = deque() # Subscriptions still to be visited in this round
+        self._weights = {}
+        self._deficits = {}
+        self._visiting = None # Subscription whose visit was cut short by the batch budget
+        self._round_quantum = self.quantum
+
+    def _start_round(self, session, budget):
+        sub_ids = session.execute(ACTIVE_SUBSCRIPTIONS_SQL).scalars().all()
+        details = get_subscriptions_details(sub_ids, session)
+        self._weights = {sub_id: details.get(sub_id, {}).get('weight') or 1 for sub_id in sub_ids}
+        self._deficits = {sub_id: self._deficits[sub_id] for sub_id in sub_ids if sub_id in self._deficits}
+        self._round = deque(sub_ids)
+        # Scale the quantum so a round fills about one batch; the shares between subscriptions stay the same
+        total_weight = sum(self._weights.values()) or 1
+        self._round_quantum = self.quantum * max(1, budget // (self.quantum * total_weight))
+
+    def relay_batch(self, budget=None):
+        """
+        Publishes and deletes up to budget outbox rows in fair order.
+        Rows are locked with SKIP LOCKED, so several relays can run side by side.
+        Returns the number of rows relayed.
+        """
+        budget = budget or Config.OUTBOX_RELAY_BATCH_SIZE
+        session = db_session()
+        try:
+            rows = []
+            last_taken = {} # Our own locks are not skipped: a later round must continue after rows already taken
+            round_start = None
+            while len(rows) < budget:
+                if not self._round:
+                    if round_start == len(rows):
+                        break # A whole round found nothing more
+                    self._start_round(session, budget)
+                    round_start = len(rows)
+                    if not self._round:
+                        break
+                sub_id = self._round[0]
+                if self._visiting != sub_id:
+                    self._deficits[sub_id] = self._deficits.get(sub_id, 0) + self._round_quantum * self._weights.get(sub_id, 1)
+                    self._visiting = sub_id
+                wanted = min(self._deficits[sub_id], budget - len(rows))
+                taken = session.query(OutboxMessage.id, OutboxMessage.delivery_task_id)\
+                               .filter(OutboxMessage.subscription_id == sub_id,
+                                       OutboxMessage.id > last_taken.get(sub_id, 0))\
+                               .order_by(OutboxMessage.id)\
+                               .limit(wanted)\
+                               .with_for_update(skip_locked=True)\
+                               .all()
+                if taken:
+                    rows.extend(taken)
+                    last_taken[sub_id] = taken[-1].id
+                self._deficits[sub_id] -= len(taken)
+                if len(taken) < wanted:
+                    # Backlog drained: an idle queue keeps no credit
+                    self._deficits.pop(sub_id, None)
+                    self._round.popleft()
+                    self._visiting = None
+                elif self._deficits[sub_id] == 0:
+                    self._round.popleft()
+                    self._visiting = None
+
+            if not rows:
+                session.commit()
+                return 0
+
+            publish_deliveries([row.delivery_task_id for row in rows])
+
+            session.query(OutboxMessage)\
+                   .filter(OutboxMessage.id.in_([row.id for row in rows]))\
+                   .delete(synchronize_session=False)
+            session.commit()
+            return len(rows)
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            db_session.remove()
+
+
+def run_relay():
+    """Relays the outbox forever, sleeping when it has been drained or the broker queue is full."""
+    print(f"Outbox relay started (batch size {Config.OUTBOX_RELAY_BATCH_SIZE}, quantum {Config.OUTBOX_RELAY_QUANTUM}).")
+    relay = FairRelay()
+    while True:
+        try:
+            budget = Config.OUTBOX_RELAY_BATCH_SIZE
+            if Config.OUTBOX_RELAY_MAX_BROKER_DEPTH > 0:
+                budget = min(budget, Config.OUTBOX_RELAY_MAX_BROKER_DEPTH - broker_queue_depth())
+            relayed = relay.relay_batch(budget) if budget > 0 else 0
+            if relayed:
+                print(f"Outbox relay: published {relayed} delivery tasks.")
+        except Exception as e:
+            relayed = 0
+            print(f"Outbox relay error: {e}")
+
+        if not relayed:
+            time.sleep(Config.OUTBOX_RELAY_POLL_INTERVAL_SECONDS)
+
+
+if __name__ == '__main__':
+    run_relay()
@@ -0,0 +1,172 @@
+"""
+Daily range partitions of delivery_tasks (on created_at) and delivery_attempts (on timestamp).
+
+Partitions are named <table>_pYYYYMMDD and cover one UTC day. create_upcoming_partitions()
+(celery beat, hourly) creates those of the next PARTITION_PREMAKE_DAYS days ahead of
+time; rows that find no partition land in <table>_default instead of failing, which is
+reported because it blocks creating the partition for their day.
+
+drop_expired_partitions() (celery beat, cleanup_old_logs) enforces retention: a
+partition whose upper bound is older than LOG_RETENTION_HOURS (delivery_attempts) or
+TASK_RETENTION_HOURS (delivery_tasks) is detached and dropped in one short transaction,
+so expired rows are never deleted one by one. No foreign keys point at the partitioned
+tables, so before a delivery_tasks partition goes, the delivery_payloads and
+delivery_outbox rows of its tasks are deleted, then their payload blob files; expired
+idempotency keys are deleted in batches.
+"""
+import re
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import text
+
+from .database import engine
+from .config import Config
+from .payloads import delete_payload_blob
+
+PARTITIONED_TABLES = {'delivery_tasks': 'created_at', 'delivery_attempts': 'timestamp'}
+IDEMPOTENCY_KEY_DELETE_BATCH_SIZE = 10000
+
+_UPPER_BOUND = re.compile(r"TO \('([^']+)'\)")
+
+
+def partition_name(table, day):
+    return f"{table}_p{day:%Y%m%d}"
+
+
+def _day_start(day):
+    return datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+
+
+def _begin(connection):
+    """Starts a transaction whose DDL waits at most PARTITION_LOCK_TIMEOUT_MS for locks."""
+    transaction = connection.begin()
+    connection.execute(text(f"SET LOCAL lock_timeout = {int(Config.PARTITION_LOCK_TIMEOUT_MS)}"))
+    connection.execute(text("SET LOCAL TimeZone = 'UTC'")) # Partition bounds are rendered in UTC
+    return transaction
+
+
+def list_partitions(connection, table):
+    """(name, upper bound) of every partition of table; the upper bound is None for the default partition."""
+    rows = connection.execute(text("""
+        SELECT child.relname AS name, pg_get_expr(child.relpartbound, child.oid) AS bound
+        FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = :table
+        ORDER BY child.relname
+    """), {'table': table}).all()
+    partitions = []
+    for row in rows:
+        match = _UPPER_BOUND.search(row.bound)
+        upper = datetime.strptime(match.group(1)[:19], '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc) if match else None
+        partitions.append((row.name, upper))
+    return partitions
+
+
+def create_upcoming_partitions(days=None):
+    """Creates the missing daily partitions from today through `days` days ahead. Returns the names created."""
+    days = Config.PARTITION_PREMAKE_DAYS if days is None else days
+    today = datetime.now(timezone.utc).date()
+    created = []
+    with engine.connect() as connection:
+        for table in PARTITIONED_TABLES:
+            transaction = _begin(connection)
+            partitions = list_partitions(connection, table)
+            transaction.commit()
+            # Partitions are contiguous, so only days after the last covered one are missing
+            covered_until = max((upper for _, upper in partitions if upper), default=None)
+            for offset in range(days + 1):
+                day = today + timedelta(days=offset)
+                start, end = _day_start(day), _day_start(day + timedelta(days=1))
+                if covered_until and start < covered_until:
+                    continue
+                name = partition_name(table, day)
+                transaction = _begin(connection)
+                try:
+                    connection.execute(text(
+                        f"CREATE TABLE {name} PARTITION OF {table} "
+                        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+                    ))
+                    transaction.commit()
+                    created.append(name)
+                except Exception as e:
+                    transaction.rollback()
+                    # E.g. lock timeout, or rows for that day already sitting in the default partition
+                    print(f"Failed to create partition {name}: {e}")
+                    break
+
+            transaction = _begin(connection)
+            if connection.execute(text(f"SELECT EXISTS (SELECT 1 FROM {table}_default)")).scalar():
+                print(f"WARNING: {table}_default holds rows; move them into daily partitions so those can be created.")
+            transaction.commit()
+    return created
+
+
+def _delete_task_dependents(connection, partition):
+    """Deletes the out-of-table rows of a delivery_tasks partition's tasks. Returns their payload blob files."""
+    blobs = connection.execute(text(
+        f"SELECT id, payload_encoding FROM {partition} WHERE payload_storage = 'fs'"
+    )).all()
+    connection.execute(text(f"DELETE FROM delivery_payloads p USING {partition} t WHERE p.delivery_task_id = t.id"))
+    connection.execute(text(f"DELETE FROM delivery_outbox o USING {partition} t WHERE o.delivery_task_id = t.id"))
+    return blobs
+
+
+def drop_partition(connection, table, partition):
+    """Detaches and drops one partition (with its tasks' dependents) in a single transaction."""
+    transaction = _begin(connection)
+    try:
+        blobs = _delete_task_dependents(connection, partition) if table == 'delivery_tasks' else []
+        connection.execute(text(f"ALTER TABLE {table} DETACH PARTITION {partition}"))
+        connection.execute(text(f"DROP TABLE {partition}"))
+        transaction.commit()
+    except Exception:
+        transaction.rollback()
+        raise
+    for blob in blobs:
+        delete_payload_blob(blob.id, blob.payload_encoding)
+
+
+def delete_expired_idempotency_keys(connection, cutoff):
+    """Deletes idempotency keys created before cutoff, in batches. Returns the number deleted."""
+    deleted = 0
+    while True:
+        transaction = _begin(connection)
+        result = connection.execute(text("""
+            DELETE FROM delivery_idempotency_keys
+            WHERE (subscription_id, idempotency_key) IN (
+                SELECT subscription_id, idempotency_key FROM delivery_idempotency_keys
+                WHERE created_at < :cutoff LIMIT :batch_size
+            )
+        """), {'cutoff': cutoff, 'batch_size': IDEMPOTENCY_KEY_DELETE_BATCH_SIZE})
+        transaction.commit()
+        deleted += result.rowcount
+        if result.rowcount < IDEMPOTENCY_KEY_DELETE_BATCH_SIZE:
+            return deleted
+
+
+def drop_expired_partitions():
+    """Drops every partition that lies entirely before its table's retention window. Returns the names dropped."""
+    now = datetime.now(timezone.utc)
+    cutoffs = {
+        'delivery_tasks': now - timedelta(hours=Config.TASK_RETENTION_HOURS),
+        'delivery_attempts': now - timedelta(hours=Config.LOG_RETENTION_HOURS),
+    }
+    dropped = []
+    with engine.connect() as connection:
+        for table, cutoff in cutoffs.items():
+            transaction = _begin(connection)
+            partitions = list_partitions(connection, table)
+            transaction.commit()
+            for name, upper in partitions:
+                if upper is None or upper > cutoff:
+                    continue
+                try:
+                    drop_partition(connection, table, name)
+                    dropped.append(name)
+                except Exception as e:
+                    print(f"Failed to drop expired partition {name}: {e}")
+
+        keys_deleted = delete_expired_idempotency_keys(connection, cutoffs['delivery_tasks'])
+        if keys_deleted:
+            print(f"Deleted {keys_deleted} expired idempotency keys.")
+    return dropped
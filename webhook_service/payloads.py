@@ -0,0 +1,153 @@
+"""
+Compressed out-of-row storage for large webhook bodies.
+
+Bodies of at least PAYLOAD_OFFLOAD_THRESHOLD_BYTES are compressed with
+PAYLOAD_COMPRESSION ('gzip', or 'zstd' when the zstandard package is installed)
+and stored in the delivery_payloads table (PAYLOAD_STORAGE='db') or as a file under
+PAYLOAD_BLOB_DIR (PAYLOAD_STORAGE='fs', which must be shared by the API and the
+workers). The DeliveryTask row then only keeps the storage kind, encoding and size,
+so delivery_tasks stays small; the body is decompressed lazily at delivery time.
+
+The same codecs compress outbound bodies for subscriptions with compression set: a
+stored body already in the subscription's encoding is sent as stored, and a body
+compressed for an attempt that is retried is kept in Redis for
+DELIVERY_COMPRESSION_CACHE_TTL_SECONDS, so retries do not compress it again.
+"""
+import os
+import gzip
+import redis
+from sqlalchemy import insert
+
+from .models import DeliveryPayload
+from .config import Config
+
+try:
+    import zstandard
+except ImportError: # Optional dependency
+    zstandard = None
+
+COMPRESSED_BODY_KEY_PREFIX = "compressed-body:"
+
+# Bodies are bytes, so not the decode_responses client of the cache module
+binary_redis_client = redis.from_url(Config.REDIS_CACHE_URL)
+
+
+def _encoding():
+    if Config.PAYLOAD_COMPRESSION == 'zstd':
+        if zstandard is not None:
+            return 'zstd'
+        print("PAYLOAD_COMPRESSION=zstd but the zstandard package is not installed, using gzip.")
+    return 'gzip'
+
+
+def compress(data, encoding):
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor().compress(data)
+    return gzip.compress(data, compresslevel=Config.PAYLOAD_GZIP_LEVEL)
+
+
+def decompress(data, encoding):
+    if encoding == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("zstd-compressed payload but the zstandard package is not installed")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def _blob_path(task_id, encoding):
+    task_id = str(task_id)
+    return os.path.join(Config.PAYLOAD_BLOB_DIR, task_id[:2], f"{task_id}.{encoding}")
+
+
+def offload_large_payload(row, body):
+    """
+    Moves the body of a new_delivery_task_row() out of row if it is large.
+    body is the request bytes (which, for JSON tasks, encode the payload).
+    Returns the delivery_payloads row to insert with the task, or None when the body
+    stays inline or was written to the blob directory.
+    """
+    if Config.PAYLOAD_OFFLOAD_THRESHOLD_BYTES <= 0 or len(body) < Config.PAYLOAD_OFFLOAD_THRESHOLD_BYTES:
+        return None
+
+    encoding = _encoding()
+    compressed = compress(body, encoding)
+    if row['raw_body'] is None:
+        row['content_type'] = 'application/json'
+    row.update(payload=None, raw_body=None, payload_encoding=encoding, payload_size=len(body))
+
+    if Config.PAYLOAD_STORAGE == 'fs':
+        path = _blob_path(row['id'], encoding)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(compressed)
+        row['payload_storage'] = 'fs'
+        return None
+
+    row['payload_storage'] = 'db'
+    return {'delivery_task_id': row['id'], 'data': compressed}
+
+
+def add_payload_blobs(session, blobs):
+    """Adds delivery_payloads rows to the caller's transaction (one multi-row INSERT)."""
+    blobs = [blob for blob in blobs if blob]
+    if blobs:
+        session.execute(insert(DeliveryPayload), blobs)
+
+
+def delete_payload_blob(task_id, encoding):
+    """Removes the blob file of a task stored with PAYLOAD_STORAGE='fs', if it is still there."""
+    try:
+        os.remove(_blob_path(task_id, encoding))
+    except FileNotFoundError:
+        pass
+
+
+def discard_offloaded_payload(row):
+    """Removes the blob file offload_large_payload wrote for a task row that was not inserted after all."""
+    if row.get('payload_storage') == 'fs':
+        delete_payload_blob(row['id'], row['payload_encoding'])
+
+
+def load_offloaded_body(session, task, decompressed=True):
+    """Reads and decompresses the body of a task stored out of row (as stored with decompressed=False)."""
+    if task.payload_storage == 'fs':
+        with open(_blob_path(task.id, task.payload_encoding), 'rb') as f:
+            data = f.read()
+    else:
+        data = session.query(DeliveryPayload.data).filter_by(delivery_task_id=task.id).scalar()
+        if data is None:
+            raise LookupError(f"Stored payload of task {task.id} is missing")
+    if not decompressed:
+        return bytes(data)
+    return decompress(bytes(data), task.payload_encoding)
+
+
+def delivery_encoding(subscription):
+    """Content-Encoding the subscription wants its deliveries sent with, or None."""
+    encoding = subscription.get('compression')
+    if encoding == 'zstd' and zstandard is None:
+        print("Subscription asks for zstd but the zstandard package is not installed, sending uncompressed.")
+        return None
+    return encoding
+
+
+def compress_for_delivery(task_id, body, encoding):
+    """Compresses a task's body for delivery, reusing the bytes cached by an earlier attempt."""
+    key = f"{COMPRESSED_BODY_KEY_PREFIX}{task_id}:{encoding}"
+    try:
+        cached = binary_redis_client.get(key)
+        if cached is not None:
+            return cached
+    except Exception as e:
+        print(f"Compressed body cache lookup failed for task {task_id}: {e}")
+    return compress(body, encoding)
+
+
+def cache_compressed_body(task_id, body, encoding):
+    """Keeps a compressed body for the retries of a task."""
+    try:
+        binary_redis_client.set(f"{COMPRESSED_BODY_KEY_PREFIX}{task_id}:{encoding}", body,
+                                ex=Config.DELIVERY_COMPRESSION_CACHE_TTL_SECONDS)
+    except Exception as e:
+        print(f"Failed to cache the compressed body of task {task_id}: {e}")
+
@@ -0,0 +1,102 @@
+"""
+Token-bucket rate limits for outbound deliveries, shared by all workers through Redis.
+
+A delivery POST takes one token from the bucket of its subscription (rate_limit_per_second,
+rate_limit_burst) and one from the bucket of its target host (HOST_RATE_LIMIT_PER_SECOND,
+HOST_RATE_LIMIT_BURST). Both are checked and taken in one Lua script using the Redis
+server clock, so workers never race or disagree on time.
+
+If any bucket is empty the caller still takes its token, as a reservation: the buckets
+go into debt and the caller is told when its own token will have been refilled. The
+next refused caller reserves the token after that one, so N deferred deliveries get N
+distinct release times, 1/rate apart and in arrival order, instead of all coming back
+at once and deferring each other again. The reservation is remembered per task; when
+the task comes back it is let through on it without taking another token.
+"""
+import math
+
+from .cache import redis_client
+from .circuit_breaker import host_key
+from .config import Config
+
+RATE_LIMIT_KEY_PREFIX = "ratelimit:"
+
+# KEYS: bucket hashes, then the task's reservation key; ARGV: rate, burst for each bucket, in order,
+# then how long (ms) a reservation outlives its release time.
+# Returns 0 if the delivery may go out now, otherwise the milliseconds until its reserved token.
+TAKE_TOKEN_SCRIPT = """
+local reservation = KEYS[#KEYS]
+if redis.call('DEL', reservation) == 1 then
+    return 0
+end
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local levels = {}
+local wait = 0
+for i = 1, #KEYS - 1 do
+    local rate = tonumber(ARGV[2 * i - 1])
+    local burst = tonumber(ARGV[2 * i])
+    local bucket = redis.call('HMGET', KEYS[i], 'tokens', 'ts')
+    local tokens = tonumber(bucket[1]) or burst
+    local ts = tonumber(bucket[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+    levels[i] = tokens
+    if tokens < 1 then
+        wait = math.max(wait, (1 - tokens) / rate)
+    end
+end
+for i = 1, #KEYS - 1 do
+    local rate = tonumber(ARGV[2 * i - 1])
+    local burst = tonumber(ARGV[2 * i])
+    redis.call('HSET', KEYS[i], 'tokens', levels[i] - 1, 'ts', now)
+    redis.call('PEXPIRE', KEYS[i], math.ceil((burst - levels[i] + 1) / rate * 1000) + 1000)
+end
+if wait > 0 then
+    local wait_ms = math.ceil(wait * 1000)
+    redis.call('SET', reservation, 1, 'PX', wait_ms + tonumber(ARGV[#ARGV]))
+    return wait_ms
+end
+return 0
+"""
+
+_take_token_script = redis_client.register_script(TAKE_TOKEN_SCRIPT)
+
+
+def default_burst(rate):
+    """Bucket size when none is configured: one second's worth of tokens, at least one."""
+    return max(1, math.ceil(rate))
+
+
+def buckets_for(subscription_id, subscription, target_url):
+    """The (key, rate, burst) buckets a delivery for this subscription has to take a token from."""
+    buckets = []
+    rate = subscription.get('rate_limit_per_second')
+    if rate:
+        buckets.append((f"{RATE_LIMIT_KEY_PREFIX}subscription:{subscription_id}", rate,
+                        subscription.get('rate_limit_burst') or default_burst(rate)))
+    if Config.HOST_RATE_LIMIT_PER_SECOND > 0:
+        buckets.append((f"{RATE_LIMIT_KEY_PREFIX}host:{host_key(target_url)}", Config.HOST_RATE_LIMIT_PER_SECOND,
+                        Config.HOST_RATE_LIMIT_BURST or default_burst(Config.HOST_RATE_LIMIT_PER_SECOND)))
+    return buckets
+
+
+def take_token(subscription_id, subscription, target_url, task_id):
+    """
+    Takes a token for one delivery POST of a task. Returns None if it may go out now,
+    otherwise the seconds until the token reserved for the task is available (defer it
+    by exactly that). Fails open when Redis is unreachable.
+    """
+    buckets = buckets_for(subscription_id, subscription, target_url)
+    if not buckets:
+        return None
+    args = []
+    for _, rate, burst in buckets:
+        args.extend([rate, burst])
+    args.append(Config.RATE_LIMIT_RESERVATION_GRACE_SECONDS * 1000)
+    keys = [key for key, _, _ in buckets] + [f"{RATE_LIMIT_KEY_PREFIX}reservation:{task_id}"]
+    try:
+        wait_ms = _take_token_script(keys=keys, args=args)
+    except Exception as e:
+        print(f"Rate limit check failed for subscription {subscription_id}: {e}")
+        return None
+    return int(wait_ms) / 1000.0 if wait_ms else None # type: ignore[reportArgumentType]
@@ -0,0 +1,106 @@
+"""
+Database-driven retry scheduler.
+
+Workers never hold delayed messages: a failed or deferred delivery only sets the
+task to 'retrying' with its next_attempt_at. The scheduler
+(python -m webhook_service.scheduler) claims due retries in next_attempt_at order
+from the partial index idx_delivery_tasks_next_attempt_at with FOR UPDATE SKIP LOCKED,
+moves them back to 'pending' and queues them in the outbox in the same transaction,
+so any number of scheduler replicas can run side by side and retries are published
+by the relay in the same fair order as new tasks. Tasks a worker claimed and never
+booked (status 'processing' past their WORKER_LEASE_SECONDS lease) are queued again
+the same way.
+
+Not needed with DELIVERY_ENGINE=asyncio, where the engine claims due retries itself.
+"""
+import time
+from datetime import datetime, timezone
+from sqlalchemy import func
+
+from .database import db_session
+from .models import DeliveryTask
+from .config import Config
+from .outbox import add_to_outbox
+
+MIN_SLEEP_SECONDS = 0.01
+
+
+def dispatch_due_retries(batch_size=None):
+    """
+    Queues up to batch_size due retries, earliest first, and then expired worker leases
+    for publishing. Returns the number dispatched.
+    """
+    batch_size = batch_size or Config.RETRY_SCHEDULER_BATCH_SIZE
+    session = db_session()
+    try:
+        now = datetime.now(timezone.utc)
+        rows = session.query(DeliveryTask.id, DeliveryTask.subscription_id)\
+                      .filter(DeliveryTask.status == 'retrying',
+                              DeliveryTask.next_attempt_at <= now)\
+                      .order_by(DeliveryTask.next_attempt_at)\
+                      .limit(batch_size)\
+                      .with_for_update(skip_locked=True)\
+                      .all()
+        if len(rows) < batch_size:
+            # Few tasks are 'processing' at a time, so the (status, created_at, id) index finds them cheaply
+            rows += session.query(DeliveryTask.id, DeliveryTask.subscription_id)\
+                           .filter(DeliveryTask.status == 'processing',
+                                   DeliveryTask.next_attempt_at <= now)\
+                           .limit(batch_size - len(rows))\
+                           .with_for_update(skip_locked=True)\
+                           .all()
+        task_ids = [row.id for row in rows]
+        if not task_ids:
+            session.commit()
+            return 0
+
+        add_to_outbox(session, [(row.id, row.subscription_id) for row in rows])
+        session.query(DeliveryTask)\
+               .filter(DeliveryTask.id.in_(task_ids))\
+               .update({'status': 'pending'}, synchronize_session=False)
+        session.commit()
+        return len(task_ids)
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        db_session.remove()
+
+
+def seconds_until_next_retry():
+    """Seconds until the earliest scheduled retry is due, or None if there is none."""
+    session = db_session()
+    try:
+        next_attempt_at = session.query(func.min(DeliveryTask.next_attempt_at))\
+                                 .filter(DeliveryTask.status == 'retrying')\
+                                 .scalar()
+        session.commit()
+    finally:
+        db_session.remove()
+    if next_attempt_at is None:
+        return None
+    return max(0.0, (next_attempt_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def run_scheduler():
+    """Dispatches due retries forever, sleeping until the next one is due (at most the poll interval)."""
+    print(f"Retry scheduler started (batch size {Config.RETRY_SCHEDULER_BATCH_SIZE}).")
+    while True:
+        try:
+            dispatched = dispatch_due_retries()
+            if dispatched:
+                print(f"Retry scheduler: dispatched {dispatched} due retries.")
+            if dispatched >= Config.RETRY_SCHEDULER_BATCH_SIZE:
+                continue
+            wait = seconds_until_next_retry()
+        except Exception as e:
+            wait = None
+            print(f"Retry scheduler error: {e}")
+
+        poll_interval = Config.RETRY_SCHEDULER_POLL_INTERVAL_SECONDS
+        # Due retries locked by another replica report a wait of 0, so never spin without sleeping
+        time.sleep(poll_interval if wait is None else max(MIN_SLEEP_SECONDS, min(wait, poll_interval)))
+
+
+if __name__ == '__main__':
+    run_scheduler()
@@ -2,179 +2,398 @@ import requests
 import json
 import time
 import uuid
+import random
 from datetime import datetime, timedelta, timezone
-from sqlalchemy import text
+from sqlalchemy import text, or_
 from sqlalchemy.exc import SQLAlchemyError
 
 from .celery_app import celery_app
 from .database import db_session
 from .models import DeliveryTask, DeliveryAttempt, Subscription
 from .config import Config
-from .cache import redis_client
+from .cache import redis_client, get_subscription_details
+from .payloads import load_offloaded_body, delivery_encoding, compress_for_delivery, cache_compressed_body, compress
+from .attempt_log import log_attempt
+from . import http_client, circuit_breaker, rate_limit, latency, partitions
+
+
+def compression_threshold(subscription):
+    """Smallest body the subscription's deliveries are compressed from."""
+    min_bytes = subscription.get('compression_min_bytes')
+    return Config.DELIVERY_COMPRESSION_MIN_BYTES if min_bytes is None else min_bytes
+
+
+def build_request_body(session, task, subscription=None):
+    """
+    Returns the (body bytes, headers) to POST for a task. Passthrough tasks forward
+    the original request bytes and content type verbatim; others send their JSON payload.
+    Bodies stored out of row are only loaded and decompressed here.
+    If the subscription has compression set, bodies of at least compression_min_bytes
+    are sent compressed with a Content-Encoding header; a body stored in that
+    encoding is sent without decompressing it.
+    """
+    encoding = delivery_encoding(subscription or {})
+    if task.payload_storage:
+        headers = {'Content-Type': task.content_type or 'application/octet-stream'}
+        if encoding and encoding == task.payload_encoding and (task.payload_size or 0) >= compression_threshold(subscription):
+            return load_offloaded_body(session, task, decompressed=False), {**headers, 'Content-Encoding': encoding}
+        body = load_offloaded_body(session, task)
+    elif task.raw_body is not None:
+        body, headers = bytes(task.raw_body), {'Content-Type': task.content_type or 'application/octet-stream'}
+    else:
+        body, headers = json.dumps(task.payload).encode('utf-8'), {'Content-Type': 'application/json'}
+
+    if encoding and len(body) >= compression_threshold(subscription):
+        return compress_for_delivery(task.id, body, encoding), {**headers, 'Content-Encoding': encoding}
+    return body, headers
+
+
+def is_json_task(task):
+    """True if the task's body is a JSON document (batchable), False for passthrough bytes."""
+    if task.payload_storage:
+        return task.content_type == 'application/json'
+    return task.raw_body is None
+
+
+def batch_size_for(subscription, task):
+    """How many tasks, task included, may go out in one POST; 1 when the task is delivered on its own."""
+    if subscription.get('passthrough') or not is_json_task(task):
+        return 1
+    return subscription.get('batch_max_size') or 1
+
+
+def linger_for_batch(session, delivery_task_id):
+    """
+    For subscriptions with batch_max_size > 1 and batch_linger_ms set, waits that long
+    for more tasks to queue up before the task is locked. The transaction of the lookup
+    is ended first, so no row locks or pooled connection are held while waiting.
+    """
+    task = session.query(DeliveryTask).filter_by(id=delivery_task_id).first()
+    linger_ms = None
+    if task is not None and task.status not in ['succeeded', 'failed']:
+        subscription = get_subscription_details(task.subscription_id, session) or {}
+        if batch_size_for(subscription, task) > 1:
+            linger_ms = subscription.get('batch_linger_ms')
+    session.rollback()
+    if linger_ms:
+        time.sleep(linger_ms / 1000.0)
+
+
+def claim_batch_siblings(session, task):
+    """
+    For subscriptions with batch_max_size > 1, locks up to batch_max_size - 1 other
+    pending JSON tasks of the same subscription (SKIP LOCKED) to deliver together with
+    task. Returns them oldest first; an empty list when the subscription does not batch.
+    """
+    subscription = get_subscription_details(task.subscription_id, session) or {}
+    batch_max_size = batch_size_for(subscription, task)
+    if batch_max_size <= 1:
+        return []
+
+    return session.query(DeliveryTask)\
+        .filter(DeliveryTask.subscription_id == task.subscription_id,
+                DeliveryTask.status == 'pending',
+                DeliveryTask.id != task.id,
+                DeliveryTask.raw_body.is_(None),
+                or_(DeliveryTask.payload_storage.is_(None), DeliveryTask.content_type == 'application/json'))\
+        .order_by(DeliveryTask.created_at)\
+        .limit(batch_max_size - 1)\
+        .with_for_update(skip_locked=True)\
+        .all()
+
+
+def build_batch_body(session, tasks, subscription=None):
+    """Returns the (body bytes, headers) of a batch POST: a JSON array of the tasks' payloads, compressed like build_request_body."""
+    bodies = [build_request_body(session, task)[0] for task in tasks]
+    headers = {'Content-Type': 'application/json', 'X-Webhook-Batch-Size': str(len(tasks))}
+    body = b"[" + b",".join(bodies) + b"]"
+    encoding = delivery_encoding(subscription or {})
+    if encoding and len(body) >= compression_threshold(subscription):
+        # A batch is put together anew for every attempt, so its compressed bytes are not cached
+        return compress(body, encoding), {**headers, 'Content-Encoding': encoding}
+    return body, headers
+
+
+def keep_compressed_body_for_retry(task, body, headers):
+    """Caches a body compressed for delivery once its task is scheduled for a retry."""
+    encoding = headers.get('Content-Encoding')
+    if encoding and not (task.payload_storage and task.payload_encoding == encoding):
+        cache_compressed_body(task.id, body, encoding)
+
+
+def defer_task(session, task, delay_seconds, reason):
+    """
+    Reschedules a task without attempting delivery or counting an attempt (e.g. its
+    host's circuit is open). The caller commits; the task is dispatched again once due.
+    """
+    task.status = 'retrying' # type: ignore[reportAssignmentType]
+    task.next_attempt_at = datetime.now(timezone.utc) + timedelta(seconds=delay_seconds) # type: ignore[reportAssignmentType]
+    task.last_error = reason # type: ignore[reportAssignmentType]
+    print(f"Task {task.id}: {reason} Deferred for {delay_seconds:.1f} seconds.")
+
+
+def retry_delay_seconds(attempts_count):
+    """Exponential backoff before the next attempt, capped at MAX_RETRY_DELAY_SECONDS."""
+    delay_seconds = Config.RETRY_BASE_DELAY_SECONDS * (Config.RETRY_FACTOR ** (attempts_count - 1)) # For attempt_count = 1, (1-1)=0, factor^0 = 1, delay = base
+    return min(delay_seconds, Config.MAX_RETRY_DELAY_SECONDS)
+
+
+def fail_task(session, task, error_details):
+    """Marks a task failed without attempting delivery and logs why. The caller commits."""
+    task.status = 'failed' # type: ignore[reportAssignmentType]
+    task.last_attempt_at = datetime.now(timezone.utc) # type: ignore[reportAssignmentType]
+    task.last_error = error_details # type: ignore[reportAssignmentType]
+    task.next_attempt_at = None # type: ignore[reportAssignmentType]
+    log_attempt(
+        session,
+        id=uuid.uuid4(),
+        delivery_task_id=task.id,
+        subscription_id=task.subscription_id,
+        attempt_number=task.attempts_count + 1,
+        timestamp=task.last_attempt_at,
+        outcome='permanently_failed',
+        http_status=None,
+        error_details=error_details
+    )
+
+
+def resolve_target_url(session, task):
+    """
+    Returns the target URL of the task's subscription. If the subscription is gone or
+    has no target_url the task is failed instead and None is returned.
+    """
+    subscription = get_subscription_details(task.subscription_id, session)
+    if not subscription:
+        print(f"Task {task.id}: Subscription {task.subscription_id} not found in DB. Marking task failed.")
+        fail_task(session, task, "Subscription not found during delivery.")
+        return None
+    target_url = subscription.get('target_url')
+    if not target_url:
+        print(f"Task {task.id}: Subscription {task.subscription_id} has no target_url. Marking task failed.")
+        fail_task(session, task, "Subscription target_url is missing.")
+        return None
+    return target_url
+
+
+def describe_request_error(e, timeouts=None):
+    """The last_error text for an exception raised while POSTing a webhook with the given (connect, read) timeouts."""
+    if isinstance(e, requests.exceptions.ConnectTimeout):
+        return f"Connect timeout after {timeouts[0] if timeouts else Config.DELIVERY_TIMEOUT_SECONDS} seconds."
+    if isinstance(e, requests.exceptions.Timeout):
+        return f"Delivery timeout after {timeouts[1] if timeouts else Config.DELIVERY_TIMEOUT_SECONDS} seconds."
+    if isinstance(e, requests.exceptions.ConnectionError):
+        return f"Connection error: {e}"
+    if isinstance(e, requests.exceptions.RequestException):
+        return f"Request error: {e}"
+    return f"Unexpected error during delivery HTTP request: {e}"
+
+
+def record_delivery_outcome(session, task, attempt_outcome, http_status, error_details, max_retries=Config.MAX_RETRIES,
+                            timeouts=None, latency_ms=None):
+    """
+    Books one delivery attempt: updates the task's counters, logs a DeliveryAttempt
+    (with the (connect, read) timeouts in seconds the POST used and its latency) and
+    moves the task to succeeded, failed (retries exhausted) or retrying with its
+    next_attempt_at set. Returns the delay in seconds before the next attempt, or None
+    once the task is finished. The caller commits.
+    """
+    task.attempts_count += 1 # type: ignore[reportAssignmentType]
+    task.last_attempt_at = datetime.now(timezone.utc) # type: ignore[reportAssignmentType]
+    task.last_http_status = http_status # type: ignore[reportAssignmentType]
+    task.last_error = error_details # type: ignore[reportAssignmentType]
+    delay_seconds = None
+
+    if attempt_outcome == 'success':
+        task.status = 'succeeded' # type: ignore[reportAssignmentType]
+        task.next_attempt_at = None # type: ignore[reportAssignmentType]
+        print(f"Task {task.id}: Marked as succeeded.")
+
+    elif task.attempts_count >= max_retries:
+        task.status = 'failed' # type: ignore[reportAssignmentType]
+        task.next_attempt_at = None # type: ignore[reportAssignmentType]
+        attempt_outcome = 'permanently_failed' # Update the outcome for the log
+        print(f"Task {task.id}: Max retries ({max_retries}) reached. Marked as failed.")
+
+    else:
+        # It's a failed attempt and retries are left
+        task.status = 'retrying' # type: ignore[reportAssignmentType]
+        delay_seconds = retry_delay_seconds(task.attempts_count)
+        task.next_attempt_at = datetime.now(timezone.utc) + timedelta(seconds=delay_seconds) # type: ignore[reportAssignmentType]
+        print(f"Task {task.id}: Failed. Retrying attempt {task.attempts_count} in {delay_seconds} seconds.")
+
+    log_attempt(
+        session,
+        id=uuid.uuid4(),
+        delivery_task_id=task.id,
+        subscription_id=task.subscription_id,
+        attempt_number=task.attempts_count,
+        timestamp=task.last_attempt_at,
+        outcome=attempt_outcome,
+        http_status=http_status,
+        error_details=error_details,
+        connect_timeout_ms=round(timeouts[0] * 1000) if timeouts else None,
+        read_timeout_ms=round(timeouts[1] * 1000) if timeouts else None,
+        latency_ms=latency_ms
+    )
+    return delay_seconds
 
 
 @celery_app.task(bind=True, max_retries=Config.MAX_RETRIES, default_retry_delay=Config.RETRY_BASE_DELAY_SECONDS)
 def process_delivery(self, delivery_task_id_str):
     """
     Celery task to process and attempt delivery of a webhook.
-    Handles retries using Celery's built-in mechanism.
+    Retries and deferrals are only recorded on the task (status 'retrying',
+    next_attempt_at); the retry scheduler dispatches them once due. For batching
+    subscriptions, other pending tasks of the subscription are delivered in the same POST.
+
+    The task (and its batch) is claimed in a short transaction that leases it for
+    WORKER_LEASE_SECONDS, like the asyncio engine does; the POST runs without row locks
+    or a database connection, and the outcome is booked in a second transaction. A
+    worker that dies in between leaves a lease the retry scheduler re-queues once expired.
     """
     session = db_session()
     delivery_task_id = uuid.UUID(delivery_task_id_str)
-    task = None
+    subscription_id = None
+    attempt_number = 1
+    sibling_ids = []
 
     try:
-        task = session.query(DeliveryTask).filter_by(id=delivery_task_id).first()
+        # --- 1. Claim: lock, check and lease the task, then commit ---
+        linger_for_batch(session, delivery_task_id)
+        task = session.query(DeliveryTask).filter_by(id=delivery_task_id).with_for_update(skip_locked=True).first()
+        if not task and session.query(DeliveryTask.id).filter_by(id=delivery_task_id).first():
+            # Locked by a worker claiming it, alone or in a batch, which delivers it
+            print(f"Task {delivery_task_id} is being claimed by another worker, skipping.")
+            session.close()
+            return
         if not task:
             print(f"Task {delivery_task_id} not found in DB, skipping delivery.")
             # Ensure session is closed if task wasn't found and we exit early
             session.close()
             return # Task somehow disappeared, cannot proceed
 
-        if task.status in ['pending', 'retrying']:
-             task.status = 'processing' # type: ignore[reportAssignmentType]
+        if task.status in ['succeeded', 'failed']:
+            # Outbox publishing is at-least-once, so a finished task may be delivered to us again
+            print(f"Task {delivery_task_id} already {task.status}, skipping duplicate message.")
+            session.close()
+            return
 
-        cache_key = f"subscription:{task.subscription_id}"
-        sub_details = redis_client.get(cache_key)
-        subscription = None
+        if task.status == 'retrying' and task.next_attempt_at and task.next_attempt_at > datetime.now(timezone.utc) + timedelta(seconds=1):
+            # A duplicate message; the retry scheduler dispatches the task once it is due
+            print(f"Task {delivery_task_id}: Retry not due until {task.next_attempt_at}, skipping early message.")
+            session.close()
+            return
 
-        if sub_details:
-            try:
-                subscription = json.loads(sub_details) # type: ignore[reportGeneralTypeIssues]
-                print(f"Task {delivery_task_id}: Fetched subscription {task.subscription_id} from cache.")
-            except json.JSONDecodeError:
-                print(f"Task {delivery_task_id}: Cache decode error for {task.subscription_id}, fetching from DB.")
-                redis_client.delete(cache_key)
-
-
-        if not subscription: # If not found in cache or decode failed
-            db_subscription = session.query(Subscription).filter_by(id=task.subscription_id).first()
-            if not db_subscription:
-                print(f"Task {delivery_task_id}: Subscription {task.subscription_id} not found in DB. Marking task failed.")
-                task.status = 'failed' # type: ignore[reportAssignmentType]
-                task.last_attempt_at = datetime.now(timezone.utc) # type: ignore[reportAssignmentType]
-                task.last_error = "Subscription not found during delivery." # type: ignore[reportAssignmentType]
-                final_attempt = DeliveryAttempt(
-                    id=uuid.uuid4(),
-                    delivery_task_id=task.id,
-                    attempt_number=task.attempts_count + 1,
-                    timestamp=task.last_attempt_at,
-                    outcome='permanently_failed',
-                    error_details=task.last_error
-                )
-                session.add(final_attempt)
-                session.commit()
-                session.close()
-                return
-
-            # Cache the subscription details from DB
-            subscription = {
-                'target_url': db_subscription.target_url,
-                'secret': db_subscription.secret,
-                'event_type_filter': db_subscription.event_type_filter
-            }
-            redis_client.setex(cache_key, Config.CACHE_EXPIRY_SECONDS, json.dumps(subscription))
-            print(f"Task {delivery_task_id}: Fetched subscription {task.subscription_id} from DB and cached.")
-
-
-        target_url = subscription.get('target_url')
-        if not target_url: # type: ignore[reportGeneralTypeIssues]
-             print(f"Task {delivery_task_id}: Subscription {task.subscription_id} has no target_url. Marking task failed.")
-             task.status = 'failed' # type: ignore[reportAssignmentType]
-             task.last_attempt_at = datetime.now(timezone.utc) # type: ignore[reportAssignmentType]
-             task.last_error = "Subscription target_url is missing." # type: ignore[reportAssignmentType]
-             final_attempt = DeliveryAttempt(
-                 id=uuid.uuid4(),
-                 delivery_task_id=task.id,
-                 attempt_number=task.attempts_count + 1,
-                 timestamp=task.last_attempt_at,
-                 outcome='permanently_failed',
-                 error_details=task.last_error
-             )
-             session.add(final_attempt)
-             session.commit()
-             session.close()
-             return
+        if task.status == 'processing' and task.next_attempt_at and task.next_attempt_at > datetime.now(timezone.utc):
+            # Leased by a worker delivering it, alone or in a batch, which books its outcome
+            print(f"Task {delivery_task_id} is being delivered by another worker, skipping.")
+            session.close()
+            return
+
+        subscription_id = task.subscription_id
+        attempt_number = task.attempts_count + 1
+        target_url = resolve_target_url(session, task)
+        if not target_url:
+            session.commit()
+            session.close()
+            return
 
         attempt_outcome = 'failed_attempt'
         http_status = None
         error_details = None
-
-        print(f"Task {delivery_task_id}: Attempt {task.attempts_count + 1} delivering to {target_url}")
-
-        try:
-            response = requests.post(
-                target_url, # type: ignore[reportGeneralTypeIssues]
-                json=task.payload,
-                timeout=Config.DELIVERY_TIMEOUT_SECONDS
-            )
-            http_status = response.status_code
-
-            if 200 <= http_status < 300:
-                attempt_outcome = 'success'
-                print(f"Task {delivery_task_id}: Delivery successful (Status: {http_status})")
-            else:
-                error_details = f"Non-2xx status code: {http_status}. Response: {response.text[:200]}"
-                print(f"Task {delivery_task_id}: Delivery failed (Status: {http_status})")
-
-        except requests.exceptions.Timeout:
-            error_details = f"Delivery timeout after {Config.DELIVERY_TIMEOUT_SECONDS} seconds."
-            print(f"Task {delivery_task_id}: Delivery timed out.")
-        except requests.exceptions.ConnectionError as e:
-             error_details = f"Connection error: {e}"
-             print(f"Task {delivery_task_id}: Connection error.")
-        except requests.exceptions.RequestException as e:
-            error_details = f"Request error: {e}"
-            print(f"Task {delivery_task_id}: Request error.")
-        except Exception as e:
-             error_details = f"Unexpected error during delivery HTTP request: {e}"
-             print(f"Task {delivery_task_id}: Unexpected HTTP request error.")
-
-        task.attempts_count += 1 # type: ignore[reportAssignmentType]
-        task.last_attempt_at = datetime.now(timezone.utc) # type: ignore[reportAssignmentType]
-        task.last_http_status = http_status # type: ignore[reportAssignmentType]
-        task.last_error = error_details # type: ignore[reportAssignmentType]
-
-        new_attempt = DeliveryAttempt(
-            id=uuid.uuid4(),
-            delivery_task_id=task.id,
-            attempt_number=task.attempts_count,
-            timestamp=task.last_attempt_at,
-            outcome=attempt_outcome,
-            http_status=http_status,
-            error_details=error_details
-        )
-        session.add(new_attempt)
-
-
-        if attempt_outcome == 'success':
-            task.status = 'succeeded' # type: ignore[reportAssignmentType]
-            task.next_attempt_at = None # type: ignore[reportAssignmentType]
-            print(f"Task {delivery_task_id}: Marked as succeeded.")
+        latency_ms = None
+
+        circuit_wait = circuit_breaker.allow_request(target_url)
+        if circuit_wait:
+            # Checked before the token so an open circuit does not spend rate-limit budget.
+            # Spread the deferred tasks so they do not all come back at the same moment
+            delay_seconds = circuit_wait + random.uniform(0, Config.CIRCUIT_BREAKER_COOLDOWN_SECONDS / 10)
+            defer_task(session, task, delay_seconds, f"Circuit open for {circuit_breaker.host_key(target_url)}.")
             session.commit()
             session.close()
+            return
 
-        elif task.attempts_count >= self.max_retries:
-            task.status = 'failed' # type: ignore[reportAssignmentType]
-            task.next_attempt_at = None # type: ignore[reportAssignmentType]
-            new_attempt.outcome = 'permanently_failed' # Update the outcome for the log # type: ignore[reportAssignmentType]
-            print(f"Task {delivery_task_id}: Max retries ({self.max_retries}) reached. Marked as failed.")
+        subscription = get_subscription_details(task.subscription_id, session) or {}
+        token_wait = rate_limit.take_token(task.subscription_id, subscription, target_url, task.id)
+        if token_wait:
+            # Deferred to the moment its reserved token is available; not counted as an attempt
+            defer_task(session, task, token_wait, "Rate limit reached.")
             session.commit()
             session.close()
+            return
 
+        siblings = claim_batch_siblings(session, task)
+        sibling_ids = [sibling.id for sibling in siblings]
+        if siblings:
+            print(f"Task {delivery_task_id}: Attempt {attempt_number} delivering a batch of {len(siblings) + 1} to {target_url}")
         else:
-            # It's a failed attempt and retries are left
-            task.status = 'retrying' # type: ignore[reportAssignmentType]
-            # Calculate the delay for the *next* attempt
-            delay_seconds = Config.RETRY_BASE_DELAY_SECONDS * (Config.RETRY_FACTOR ** (task.attempts_count - 1)) # For attempt_count = 1, (1-1)=0, factor^0 = 1, delay = base # type: ignore[reportAssignmentType]
-            delay_seconds = min(delay_seconds, Config.MAX_RETRY_DELAY_SECONDS)
-            task.next_attempt_at = datetime.now(timezone.utc) + timedelta(seconds=delay_seconds) # type: ignore[reportAssignmentType]
-
-            print(f"Task {delivery_task_id}: Failed. Retrying attempt {task.attempts_count} in {delay_seconds} seconds.")
-            session.commit()
-            session.close()
-            raise self.retry(exc=Exception(error_details), countdown=delay_seconds)
-
+            print(f"Task {delivery_task_id}: Attempt {attempt_number} delivering to {target_url}")
+        timeouts = latency.timeouts_for(target_url)
+        body, headers = None, {}
+        try:
+            if siblings:
+                body, headers = build_batch_body(session, [task] + siblings, subscription)
+            else:
+                body, headers = build_request_body(session, task, subscription)
+        except Exception as e:
+            # Booked as a failed attempt without a POST
+            error_details = describe_request_error(e, timeouts)
+            print(f"Task {delivery_task_id}: {error_details}")
+
+        lease_until = datetime.now(timezone.utc) + timedelta(seconds=Config.WORKER_LEASE_SECONDS)
+        for claimed in [task] + siblings:
+            claimed.status = 'processing' # type: ignore[reportAssignmentType]
+            claimed.next_attempt_at = lease_until # type: ignore[reportAssignmentType]
+        session.commit()
+        db_session.remove() # Back to the pool for the whole POST
+
+        # --- 2. Deliver, holding no locks and no database connection ---
+        if error_details is None:
+            try:
+                started = time.monotonic()
+                response = http_client.post(
+                    target_url, # type: ignore[reportGeneralTypeIssues]
+                    data=body,
+                    headers=headers,
+                    timeout=timeouts
+                )
+                latency_ms = round((time.monotonic() - started) * 1000) # Until the response headers arrived
+                latency.record_latency(target_url, latency_ms)
+                http_status = response.status_code
+                circuit_breaker.record_result(target_url, http_status)
+                # Bounded read that also hands the keep-alive connection back to the pool
+                response_text = http_client.read_response_body(response)
+
+                if 200 <= http_status < 300:
+                    attempt_outcome = 'success'
+                    print(f"Task {delivery_task_id}: Delivery successful (Status: {http_status})")
+                else:
+                    error_details = f"Non-2xx status code: {http_status}. Response: {response_text[:200]}"
+                    print(f"Task {delivery_task_id}: Delivery failed (Status: {http_status})")
+
+            except Exception as e:
+                error_details = describe_request_error(e, timeouts)
+                print(f"Task {delivery_task_id}: {error_details}")
+                if isinstance(e, requests.exceptions.Timeout):
+                    # A timed-out attempt counts at the timeout, so a slowing host raises its own percentiles
+                    latency.record_latency(target_url, (timeouts[0] if isinstance(e, requests.exceptions.ConnectTimeout) else timeouts[1]) * 1000)
+                if isinstance(e, requests.exceptions.RequestException):
+                    circuit_breaker.record_result(target_url, None)
+
+        # --- 3. Book the outcome of every task of the POST ---
+        session = db_session()
+        # A task whose lease ran out may have been finished by another worker meanwhile
+        booked = session.query(DeliveryTask)\
+                        .filter(DeliveryTask.id.in_([delivery_task_id] + sibling_ids), DeliveryTask.status == 'processing')\
+                        .all()
+        for booked_task in sorted(booked, key=lambda t: t.id != delivery_task_id):
+            # Every task of a batch gets its own DeliveryAttempt and status
+            retry_delay = record_delivery_outcome(session, booked_task, attempt_outcome, http_status, error_details,
+                                                  self.max_retries, timeouts, latency_ms)
+            if retry_delay is not None and body is not None and not sibling_ids:
+                keep_compressed_body_for_retry(booked_task, body, headers)
+        session.commit()
+        session.close()
 
     except Exception as e:
         print(f"FATAL Error processing task {delivery_task_id}: {e}")
@@ -183,28 +402,30 @@ def process_delivery(self, delivery_task_id_str):
              session.close()
         log_session = None
         try:
-            delivery_task_id_for_log = task.id if task else delivery_task_id
-            attempt_number_for_log = task.attempts_count + 1 if task else 1
-
-
-            fatal_attempt = DeliveryAttempt(
+            error_details = f"Fatal internal error processing task {delivery_task_id}: {e}"
+            failed_at = datetime.now(timezone.utc)
+            log_session = db_session()
+            log_session.add(DeliveryAttempt(
                  id=uuid.uuid4(),
-                 delivery_task_id=delivery_task_id_for_log,
-                 attempt_number=attempt_number_for_log,
-                 timestamp=datetime.now(timezone.utc),
+                 delivery_task_id=delivery_task_id,
+                 subscription_id=subscription_id,
+                 attempt_number=attempt_number,
+                 timestamp=failed_at,
                  outcome='permanently_failed',
-                 error_details=f"Fatal internal error processing task {delivery_task_id}: {e}"
-             )
-
-            log_session = db_session()
-            log_session.add(fatal_attempt)
-
-            if task:
-                 task.status = 'failed' # type: ignore[reportAssignmentType]
-                 task.last_attempt_at = datetime.now(timezone.utc) # type: ignore[reportAssignmentType]
-                 task.last_error = fatal_attempt.error_details # type: ignore[reportAssignmentType]
-                 task.next_attempt_at = None # type: ignore[reportAssignmentType]
-                 log_session.merge(task)
+                 error_details=error_details
+             ))
+
+            if subscription_id is not None:
+                 log_session.query(DeliveryTask).filter_by(id=delivery_task_id).update({
+                     'status': 'failed', 'last_attempt_at': failed_at, 'last_error': error_details, 'next_attempt_at': None
+                 }, synchronize_session=False)
+            if sibling_ids:
+                 # Batch siblings are pending again, but their own messages may have been skipped while they were claimed
+                 from .outbox import add_to_outbox # outbox imports this module
+                 log_session.query(DeliveryTask)\
+                            .filter(DeliveryTask.id.in_(sibling_ids), DeliveryTask.status.in_(['pending', 'processing']))\
+                            .update({'status': 'pending', 'next_attempt_at': None}, synchronize_session=False)
+                 add_to_outbox(log_session, [(sibling_id, subscription_id) for sibling_id in sibling_ids])
 
             log_session.commit()
             print(f"Logged fatal error for task {delivery_task_id}.")
@@ -218,3 +439,22 @@ def process_delivery(self, delivery_task_id_str):
     finally:
         if session and session.is_active:
              session.close()
+
+
+@celery_app.task
+def create_partitions():
+    """Celery beat task: creates the delivery table partitions of the coming PARTITION_PREMAKE_DAYS days."""
+    created = partitions.create_upcoming_partitions()
+    if created:
+        print(f"Created partitions: {', '.join(created)}")
+
+
+@celery_app.task
+def cleanup_old_logs():
+    """
+    Celery beat task: enforces LOG_RETENTION_HOURS on delivery_attempts and
+    TASK_RETENTION_HOURS on delivery_tasks by dropping whole expired partitions.
+    """
+    dropped = partitions.drop_expired_partitions()
+    if dropped:
+        print(f"Dropped expired partitions: {', '.join(dropped)}")
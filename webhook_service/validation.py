@@ -0,0 +1,43 @@
+"""Ingestion checks shared by the Flask blueprint and the asyncio ingestion server."""
+import hmac
+import hashlib
+from .config import Config
+
+
+def verify_signature(secret, body, signature_header):
+    """
+    Checks an HMAC-SHA256 signature header ('sha256=<hex>') against the body.
+    Returns None if valid, otherwise a (message, status_code) tuple.
+    """
+    if not signature_header:
+        return "Signature header missing", 401
+
+    try:
+        hash_method, signature = signature_header.split('=', 1)
+    except ValueError:
+        return "Invalid signature header format", 400
+
+    if hash_method != 'sha256':
+        return "Unsupported signature hash method", 400
+
+    expected_signature = hmac.new(
+        secret.encode('utf-8'),
+        body,
+        hashlib.sha256
+    ).hexdigest()
+
+    # Secure comparison to prevent timing attacks
+    if not hmac.compare_digest(expected_signature, signature):
+        return "Invalid signature", 401
+
+    return None
+
+
+def check_event_type(event_type_filter, event_type):
+    """Returns a 'delivery skipped' message if the event type is filtered out, otherwise None."""
+    if event_type_filter and event_type:
+        if event_type_filter != event_type:
+            return f"Event type '{event_type}' filtered, delivery skipped"
+    elif event_type_filter and not event_type:
+        return f"Subscription has event type filter, but no '{Config.WEBHOOK_EVENT_TYPE_HEADER}' header provided. Delivery skipped"
+    return None
@@ -0,0 +1,141 @@
+"""
+Group commit for ingested delivery tasks.
+
+With INGEST_GROUP_COMMIT_ENABLED, request threads of one API process hand their
+DeliveryTask rows to a shared buffer instead of committing them one by one. A
+flusher thread writes everything that has queued up with one multi-row INSERT
+(plus the matching outbox rows) and a single COMMIT, as soon as
+INGEST_GROUP_COMMIT_MAX_ROWS rows are waiting or the oldest row has waited
+INGEST_GROUP_COMMIT_MAX_WAIT_MS. Each submitter blocks until its own row is
+committed, so a 202 still means the task is durable.
+
+Coalescing needs concurrent requests inside one process, i.e. a threaded
+gunicorn worker class (e.g. --threads 16).
+
+A submitter waits at most INGEST_GROUP_COMMIT_TIMEOUT_MS. If its row is still
+queued by then (flusher dead or stalled), the row is withdrawn and the caller
+writes it itself; if its group is already being written, the outcome is unknown
+and the caller answers 503. A dead flusher thread is restarted on the next submit.
+"""
+import os
+import time
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from sqlalchemy import insert
+
+from .database import db_session
+from .models import DeliveryTask
+from .outbox import add_to_outbox
+from .payloads import add_payload_blobs
+from .idempotency import add_idempotency_keys
+from .config import Config
+
+
+class GroupCommitWithdrawn(Exception):
+    """The row was taken back out of the buffer before any write: the caller must write it."""
+
+
+class GroupCommitTimeout(Exception):
+    """The row's group was being written when the wait ran out: it may or may not be committed."""
+
+
+class GroupCommitBuffer:
+    """Collects task rows from many threads and commits them in groups."""
+
+    def __init__(self, max_rows, max_wait_ms):
+        self.max_rows = max_rows
+        self.max_wait_seconds = max_wait_ms / 1000.0
+        self._pending = [] # ((row, payload_blob), future, submitted_at)
+        self._condition = threading.Condition()
+        self._flusher_pid = None
+        self._flusher = None
+
+    def submit(self, row, payload_blob=None, timeout=None):
+        """
+        Queues a new_delivery_task_row() (and its out-of-row payload, if any) and waits
+        until it is committed. Re-raises the flush error on failure. After timeout
+        seconds raises GroupCommitWithdrawn (row not written) or GroupCommitTimeout.
+        """
+        self._ensure_flusher()
+        future = Future()
+        entry = ((row, payload_blob), future, time.monotonic())
+        with self._condition:
+            self._pending.append(entry)
+            # Wake the flusher to start the wait timer (first row) or to flush a full group
+            if len(self._pending) == 1 or len(self._pending) >= self.max_rows:
+                self._condition.notify()
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            with self._condition:
+                if any(pending is entry for pending in self._pending):
+                    self._pending = [pending for pending in self._pending if pending is not entry]
+                    raise GroupCommitWithdrawn(f"Group commit did not pick up the row within {timeout} seconds.")
+            raise GroupCommitTimeout(f"Group commit of the row did not finish within {timeout} seconds.")
+
+    def _ensure_flusher(self):
+        """Starts the flusher thread once per process (again after a fork, or if it died)."""
+        if self._flusher_pid == os.getpid() and self._flusher.is_alive(): # type: ignore[reportOptionalMemberAccess]
+            return
+        with self._condition:
+            if self._flusher_pid == os.getpid() and self._flusher.is_alive(): # type: ignore[reportOptionalMemberAccess]
+                return
+            if self._flusher_pid != os.getpid():
+                self._pending = [] # Rows queued in a parent process belong to the parent's threads
+            else:
+                print("Group commit flusher thread died, restarting it.")
+            self._flusher = threading.Thread(target=self._run, name="group-commit-flusher", daemon=True)
+            self._flusher.start()
+            self._flusher_pid = os.getpid()
+
+    def _take_group(self):
+        """Waits until a group is due and removes it from the buffer."""
+        with self._condition:
+            while True:
+                if self._pending:
+                    waited = time.monotonic() - self._pending[0][2]
+                    if len(self._pending) >= self.max_rows or waited >= self.max_wait_seconds:
+                        group = self._pending[:self.max_rows]
+                        del self._pending[:self.max_rows]
+                        return group
+                    self._condition.wait(self.max_wait_seconds - waited)
+                else:
+                    self._condition.wait()
+
+    def _run(self):
+        while True:
+            group = self._take_group()
+            try:
+                self._write([entry for entry, _, _ in group])
+                for _, future, _ in group:
+                    future.set_result(None)
+            except Exception as e:
+                print(f"Group commit of {len(group)} delivery tasks failed: {e}. Retrying rows individually.")
+                self._write_individually(group)
+
+    def _write_individually(self, group):
+        """Isolates the failing rows of a group so the other requests still succeed."""
+        for entry, future, _ in group:
+            try:
+                self._write([entry])
+                future.set_result(None)
+            except Exception as e:
+                future.set_exception(e)
+
+    def _write(self, entries):
+        rows = [row for row, _ in entries]
+        session = db_session()
+        try:
+            session.execute(insert(DeliveryTask), rows)
+            add_idempotency_keys(session, rows)
+            add_payload_blobs(session, [payload_blob for _, payload_blob in entries])
+            add_to_outbox(session, [(row['id'], row['subscription_id']) for row in rows])
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            db_session.remove()
+
+
+group_commit_buffer = GroupCommitBuffer(Config.INGEST_GROUP_COMMIT_MAX_ROWS, Config.INGEST_GROUP_COMMIT_MAX_WAIT_MS)